@@ -1,29 +1,46 @@
 import threading
 import queue
 import torch
+import io
 import os
-import tempfile
-import subprocess
+import json
 
 import hydra
 from pipelines.pipeline import InferencePipeline
+from pipelines.scheduler import MicroBatchScheduler
 from flask import Flask, request, jsonify
 from flask_cors import CORS
+from flask_sock import Sock
 
 task_queue = queue.Queue()
 app = Flask(__name__)
 CORS(app, resources={r"/process": {"origins": ["http://localhost:3000"]}})
+sock = Sock(app)
+# pipelines lent to live sessions, one session at a time each
+session_pipelines = queue.Queue()
 
-def worker(worker_id, cfg):
+def get_device(cfg):
+    return (
+        torch.device(f"cuda:{cfg.gpu_idx}")
+        if torch.cuda.is_available() and cfg.gpu_idx >= 0
+        else torch.device("cpu")
+    )
+
+def worker(worker_id, cfg, model, scheduler):
+    # Each worker owns its detector and data loader, the model is shared and
+    # batched across workers by the scheduler
     pipeline = InferencePipeline(
         cfg.config_filename,
-        device=(
-            torch.device(f"cuda:{cfg.gpu_idx}")
-            if torch.cuda.is_available() and cfg.gpu_idx >= 0
-            else torch.device("cpu")
-        ),
+        device=get_device(cfg),
         detector=cfg.detector,
         face_track=True,
+        model=model,
+        keyframe_interval=cfg.keyframe_interval,
+        downscale=cfg.downscale,
+        roi_margin=cfg.roi_margin,
+        lmeds_threshold=cfg.lmeds_threshold,
+        gate=cfg.gate,
+        min_motion=cfg.min_motion,
     )
     if not callable(pipeline):
         print(f"Worker {worker_id}: InferencePipeline is not callable.")
@@ -33,7 +50,16 @@ def worker(worker_id, cfg):
         file_path = task.get("file")
         print(f"Worker {worker_id} processing file: {file_path}")
         try:
-            transcription = pipeline(file_path, cfg.landmarks_filename)
+            # uploads are kept in memory, static files are read from disk
+            source = io.BytesIO(task["data"]) if "data" in task else file_path
+            data = pipeline.load_data(source, cfg.landmarks_filename)
+            if data is None:
+                # idle clip, the model is not run
+                print(f"Worker {worker_id} skipped {file_path}: {pipeline.skip_reason}")
+                if "result_queue" in task:
+                    task["result_queue"].put({"transcription": "", "skipped": pipeline.skip_reason})
+                continue
+            transcription = scheduler.submit(data).result()
             if "result_queue" in task:
                 task["result_queue"].put(transcription)
             else:
@@ -74,68 +100,13 @@ def process():
             print(f"Invalid file type: {filename}")
             return jsonify({"error": "Only .mp4 or .webm files are allowed"}), 400
             
-        # Step 3: Save to temporary file
-        temp_dir = tempfile.gettempdir()
-        temp_path = os.path.join(temp_dir, filename)
-        print(f"Saving to temporary path: {temp_path}")
-        
-        try:
-            with open(temp_path, "wb") as f:
-                f.write(raw_data)
-            print(f"Successfully saved file of size: {len(raw_data)} bytes")
-        except Exception as e:
-            print(f"Error saving file: {str(e)}")
-            return jsonify({"error": f"Error saving file: {e}"}), 500
-            
-        # Step 4: Prepare audio file
-        audio_temp_path = temp_path + ".wav"
-        print(f"Converting to WAV: {audio_temp_path}")
-        
-        # First check if the input has an audio stream
-        probe_result = subprocess.run([
-            "ffmpeg", "-i", temp_path
-        ], stdout=subprocess.PIPE, stderr=subprocess.PIPE)
-        
-        # Step 5: Handle audio conversion
-        if "Stream #0:1" not in probe_result.stderr.decode():
-            print("No audio stream detected, creating silent audio")
-            result = subprocess.run([
-                "ffmpeg", "-y",
-                "-f", "lavfi", "-i", "aevalsrc=0:d=3",  # Generate 3 seconds of silence
-                "-acodec", "pcm_s16le",
-                "-ar", "44100",
-                "-ac", "2",
-                audio_temp_path
-            ], stdout=subprocess.PIPE, stderr=subprocess.PIPE)
-        else:
-            print("Audio stream detected, extracting audio")
-            result = subprocess.run([
-                "ffmpeg", "-y", 
-                "-i", temp_path,
-                "-vn",  # No video
-                "-acodec", "pcm_s16le",
-                "-ar", "44100",
-                "-ac", "2",
-                audio_temp_path
-            ], stdout=subprocess.PIPE, stderr=subprocess.PIPE)
-            
-        # Step 6: Check FFmpeg result
-        if result.returncode != 0:
-            err_output = result.stderr.decode("utf-8", errors="replace")
-            print(f"FFmpeg conversion failed: {err_output}")
-            try:
-                os.remove(temp_path)
-            except Exception as e:
-                print(f"Error removing temp file: {str(e)}")
-            return jsonify({"error": f"Audio extraction failed: {err_output}"}), 500
-            
-        # Step 7: Process through inference pipeline
+        # Step 3: Process through inference pipeline, the upload is demuxed
+        # and decoded in process from memory
         print("Starting inference pipeline")
         result_queue = queue.Queue()
-        # Pass the original video file path for video processing, not the audio path
         task_queue.put({
-            "file": temp_path,  # Use original video file instead of audio_temp_path
-            "audio_file": audio_temp_path,  # Optionally pass audio file if needed
+            "file": filename,
+            "data": raw_data,
             "result_queue": result_queue
         })
         
@@ -148,38 +119,108 @@ def process():
         except Exception as e:
             print(f"Error during processing: {str(e)}")
             transcription = f"Error during processing: {str(e)}"
-        finally:
-            # Step 8: Cleanup temporary files
-            for path in (temp_path, audio_temp_path):
-                try:
-                    os.remove(path)
-                    print(f"Successfully removed temporary file: {path}")
-                except Exception as e:
-                    print(f"Error removing temporary file {path}: {e}")
                     
-        # Step 9: Return result
+        # Step 4: Return result, with the reason when an idle clip was skipped
+        if isinstance(transcription, dict):
+            return jsonify(transcription)
         return jsonify({"transcription": transcription})
         
     except Exception as e:
-        # Step 10: Global error handling
+        # Step 5: Global error handling
         import traceback
         print(f"Unexpected error in /process endpoint: {str(e)}")
         print(traceback.format_exc())
         return jsonify({"error": f"Server error: {str(e)}"}), 500
         
+@sock.route("/stream")
+def stream(ws):
+    # A live session: the client pushes binary messages, the chunks of one
+    # encoded stream (or single encoded images with ?input=frames), and sends
+    # {"event": "end"} when done. It gets {"partial": ...} every
+    # partial_frames new frames and {"final": ...} at the end. With
+    # session_decoding: window, partials only hold committed text, which
+    # never changes, and the rest comes in "tentative".
+    try:
+        pipeline = session_pipelines.get_nowait()
+    except queue.Empty:
+        ws.send(json.dumps({"error": "No free session, try again later."}))
+        return
+    cfg = app.config["session_cfg"]
+    scheduler = app.config["scheduler"]
+    session = pipeline.session(
+        encoded=request.args.get("input") != "frames",
+        chunk_size=cfg.session_chunk_size,
+        decoding=cfg.session_decoding,
+        window_size=cfg.session_window,
+    )
+    print(f"Session opened on {request.remote_addr}")
+    try:
+        while True:
+            message = ws.receive(timeout=0.1)
+            try:
+                if isinstance(message, str):
+                    event = json.loads(message)
+                    if not isinstance(event, dict):
+                        raise ValueError(f"Unknown message: {message}")
+                    if event.get("event") == "end":
+                        break
+                elif message is not None:
+                    session.push(message)
+            except ValueError as e:
+                # a malformed message or an image that cannot be decoded is skipped, the session goes on
+                ws.send(json.dumps({"error": str(e)}))
+            if session.error:
+                break
+            # the new patches are decoded every partial_frames frames, on top of the earlier ones
+            if session.num_cropped - session.num_decoded >= cfg.partial_frames:
+                partial = scheduler.call(session.decode).result()
+                reply = {"partial": partial, "frames": session.num_decoded}
+                if session.decoding == "window":
+                    # the tokens after the committed text, which may still change
+                    reply["tentative"] = pipeline.model.text(session.tentative)
+                ws.send(json.dumps(reply))
+        session.close()
+        if session.error:
+            print(f"Session error:\n{session.error}")
+            ws.send(json.dumps({"error": session.error}))
+            return
+        transcription = scheduler.call(session.decode, True).result()
+        ws.send(json.dumps({"final": transcription, "frames": session.num_cropped}))
+    finally:
+        # a client that went away ends its stream too
+        session.close()
+        session_pipelines.put(pipeline)
+        print("Session closed")
+
 @hydra.main(version_base=None, config_path="hydra_configs", config_name="default")
 def main(cfg):
     audio_files = []
     if not audio_files:
         print("No static audio files provided in configuration.")
-    device = torch.device(f"cuda:{cfg.gpu_idx}" if torch.cuda.is_available() and cfg.gpu_idx >= 0 else torch.device("cpu"))
+    device = get_device(cfg)
     print(f"Running inference on device: {device}")
-    num_workers = 4
+    model = InferencePipeline(cfg.config_filename, device=device, detector=cfg.detector).model
+    scheduler = MicroBatchScheduler(model, max_batch_size=cfg.max_batch_size, max_wait_ms=cfg.batch_window_ms)
+    num_workers = cfg.num_workers
     threads = []
     for i in range(num_workers):
-        t = threading.Thread(target=worker, args=(i+1, cfg), daemon=True)
+        t = threading.Thread(target=worker, args=(i+1, cfg, model, scheduler), daemon=True)
         t.start()
         threads.append(t)
+    for i in range(cfg.num_sessions):
+        session_pipelines.put(InferencePipeline(
+            cfg.config_filename,
+            device=device,
+            detector=cfg.detector,
+            face_track=True,
+            model=model,
+            keyframe_interval=cfg.keyframe_interval,
+            downscale=cfg.downscale,
+            roi_margin=cfg.roi_margin,
+            lmeds_threshold=cfg.lmeds_threshold,
+        ))
+    app.config["session_cfg"] = cfg
+    app.config["scheduler"] = scheduler
     for audio_file in audio_files:
         task_queue.put({"file": audio_file})
     if audio_files:
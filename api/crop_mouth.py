@@ -7,6 +7,7 @@
 import os
 import cv2
 import hydra
+import torch
 import torchvision
 from pipelines.detectors.mediapipe.detector import LandmarksDetector
 from pipelines.data.data_module import AVSRDataLoader
@@ -21,11 +22,16 @@ def save2vid(filename, vid, frames_per_second):
 def main(cfg):
     if cfg.detector == "mediapipe":
         from pipelines.detectors.mediapipe.detector import LandmarksDetector
-        landmarks_detector = LandmarksDetector()
+        landmarks_detector = LandmarksDetector(keyframe_interval=cfg.keyframe_interval, downscale=cfg.downscale, roi_margin=cfg.roi_margin)
     if cfg.detector == "retinaface":
         from pipelines.detectors.retinaface.detector import LandmarksDetector
-        landmarks_detector = LandmarksDetector()
-    dataloader = AVSRDataLoader(modality="video", speed_rate=1, transform=False, detector=cfg.detector, convert_gray=False)
+        device = f"cuda:{cfg.gpu_idx}" if torch.cuda.is_available() and cfg.gpu_idx >= 0 else "cpu"
+        landmarks_detector = LandmarksDetector(device=device, keyframe_interval=cfg.keyframe_interval, downscale=cfg.downscale, roi_margin=cfg.roi_margin)
+    if cfg.detector == "cascade":
+        from pipelines.detectors.cascade.detector import LandmarksDetector
+        device = f"cuda:{cfg.gpu_idx}" if torch.cuda.is_available() and cfg.gpu_idx >= 0 else "cpu"
+        landmarks_detector = LandmarksDetector(device=device, keyframe_interval=cfg.keyframe_interval, downscale=cfg.downscale, roi_margin=cfg.roi_margin)
+    dataloader = AVSRDataLoader(modality="video", speed_rate=1, transform=False, detector=cfg.detector, convert_gray=False, lmeds_threshold=cfg.lmeds_threshold)
     landmarks = landmarks_detector(cfg.data_filename)
     data = dataloader.load_data(cfg.data_filename, landmarks)
     fps = cv2.VideoCapture(cfg.data_filename).get(cv2.CAP_PROP_FPS)
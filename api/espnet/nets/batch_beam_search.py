@@ -8,20 +8,20 @@ from typing import NamedTuple
 from typing import Tuple
 
 import torch
-from torch.nn.utils.rnn import pad_sequence
 
 from espnet.nets.beam_search import BeamSearch
 from espnet.nets.beam_search import Hypothesis
+from espnet.nets.e2e_asr_common import end_detect
 
 
 class BatchHypothesis(NamedTuple):
     """Batchfied/Vectorized hypothesis data type."""
 
-    yseq: torch.Tensor = torch.tensor([])  # (batch, maxlen)
+    yseq: torch.Tensor = torch.tensor([])  # (batch, maxlen) token buffer
     score: torch.Tensor = torch.tensor([])  # (batch,)
     length: torch.Tensor = torch.tensor([])  # (batch,)
     scores: Dict[str, torch.Tensor] = dict()  # values: (batch,)
-    states: Dict[str, Dict] = dict()
+    states: Dict[str, Any] = dict()  # values: batched states of each scorer
 
     def __len__(self) -> int:
         """Return a batch size."""
@@ -29,62 +29,60 @@ class BatchHypothesis(NamedTuple):
 
 
 class BatchBeamSearch(BeamSearch):
-    """Batch beam search implementation."""
-
-    def batchfy(self, hyps: List[Hypothesis]) -> BatchHypothesis:
-        """Convert list to batch."""
-        if len(hyps) == 0:
-            return BatchHypothesis()
-        yseq=pad_sequence(
-            [h.yseq for h in hyps], batch_first=True, padding_value=self.eos
-        )
-        return BatchHypothesis(
-            yseq=yseq,
-            length=torch.tensor([len(h.yseq) for h in hyps], dtype=torch.int64, device=yseq.device),
-            score=torch.tensor([h.score for h in hyps]).to(yseq.device),
-            scores={k: torch.tensor([h.scores[k] for h in hyps], device=yseq.device) for k in self.scorers},
-            states={k: [h.states[k] for h in hyps] for k in self.scorers},
-        )
+    """Batch beam search implementation.
 
-    def _batch_select(self, hyps: BatchHypothesis, ids: List[int]) -> BatchHypothesis:
+    Running hypotheses are kept as a struct of arrays: token ids live in a
+    preallocated `(batch, maxlen)` buffer padded with <eos>, and scores and
+    scorer states are batched tensors that are advanced with `index_select`
+    (see :meth:`ScorerInterface.batch_select_state`), so no per-hypothesis
+    Python objects are created during the search.
+
+    """
+
+    def _batch_select(self, hyps: BatchHypothesis, ids: torch.Tensor) -> BatchHypothesis:
         return BatchHypothesis(
-            yseq=hyps.yseq[ids],
-            score=hyps.score[ids],
-            length=hyps.length[ids],
-            scores={k: v[ids] for k, v in hyps.scores.items()},
+            yseq=hyps.yseq.index_select(0, ids),
+            score=hyps.score.index_select(0, ids),
+            length=hyps.length.index_select(0, ids),
+            scores={k: v.index_select(0, ids) for k, v in hyps.scores.items()},
             states={
-                k: [self.scorers[k].select_state(v, i) for i in ids]
+                k: self.scorers[k].batch_select_state(v, ids)
                 for k, v in hyps.states.items()
             },
         )
 
     def _select(self, hyps: BatchHypothesis, i: int) -> Hypothesis:
+        # NOTE: states of ended hypotheses are not kept,
+        # they are never scored again in the batch beam search
         return Hypothesis(
             yseq=hyps.yseq[i, : hyps.length[i]],
             score=hyps.score[i],
             scores={k: v[i] for k, v in hyps.scores.items()},
-            states={
-                k: self.scorers[k].select_state(v, i) for k, v in hyps.states.items()
-            },
         )
 
-    def unbatchfy(self, batch_hyps: BatchHypothesis) -> List[Hypothesis]:
-        """Revert batch to list."""
-        return [
-            Hypothesis(
-                yseq=batch_hyps.yseq[i][: batch_hyps.length[i]],
-                score=batch_hyps.score[i],
-                scores={k: batch_hyps.scores[k][i] for k in self.scorers},
-                states={
-                    k: v.select_state(batch_hyps.states[k], i)
-                    for k, v in self.scorers.items()
-                },
-            )
-            for i in range(len(batch_hyps.length))
-        ]
+    @staticmethod
+    def _prefix(hyps: BatchHypothesis) -> torch.Tensor:
+        """Return prefix tokens (batch, ylen) of running hypotheses.
+
+        All running hypotheses advance one token per step,
+        so they share the same length.
+        """
+        return hyps.yseq[:, : int(hyps.length[0])]
+
+    def _append_token(
+        self, yseq: torch.Tensor, length: torch.Tensor, token_ids: torch.Tensor
+    ) -> torch.Tensor:
+        """Write `token_ids` at position `length` of the token buffer.
+
+        The buffer is grown by doubling if it is full.
+        """
+        if int(length.max()) >= yseq.size(1):
+            yseq = torch.cat((yseq, torch.full_like(yseq, self.eos)), dim=1)
+        yseq.scatter_(1, length.unsqueeze(1), token_ids.unsqueeze(1))
+        return yseq
 
     def batch_beam(
-        self, weighted_scores: torch.Tensor, ids: torch.Tensor
+        self, weighted_scores: torch.Tensor, ids: torch.Tensor, n_utt: int = 1
     ) -> Tuple[torch.Tensor, torch.Tensor, torch.Tensor, torch.Tensor]:
         """Batch-compute topk full token ids and partial token ids.
 
@@ -93,20 +91,28 @@ class BatchBeamSearch(BeamSearch):
                 Its shape is `(n_beam, self.vocab_size)`.
             ids (torch.Tensor): The partial token ids to compute topk.
                 Its shape is `(n_beam, self.pre_beam_size)`.
+            n_utt (int): The number of utterances. The hypotheses are
+                `n_utt` consecutive groups of the same size, one per utterance,
+                and each utterance keeps its own beam.
 
         Returns:
             Tuple[torch.Tensor, torch.Tensor, torch.Tensor, torch.Tensor]:
                 The topk full (prev_hyp, new_token) ids
                 and partial (prev_hyp, new_token) ids.
-                Their shapes are all `(self.beam_size,)`
+                Their shapes are all `(n_utt * self.beam_size,)`
 
         """
-        top_ids = weighted_scores.view(-1).topk(self.beam_size)[1]
-        # Because of the flatten above, `top_ids` is organized as:
+        top_ids = weighted_scores.view(n_utt, -1).topk(self.beam_size, dim=1)[1]
+        # Because of the flatten above, each row of `top_ids` is organized as:
         # [hyp1 * V + token1, hyp2 * V + token2, ..., hypK * V + tokenK],
-        # where V is `self.n_vocab` and K is `self.beam_size`
-        prev_hyp_ids = torch.div(top_ids, self.n_vocab, rounding_mode='trunc')
-        new_token_ids = top_ids % self.n_vocab
+        # where V is `self.n_vocab`, K is `self.beam_size`
+        # and hyp ids are relative to the utterance
+        n_hyps = weighted_scores.size(0) // n_utt
+        offsets = torch.arange(n_utt, device=top_ids.device).unsqueeze(1) * n_hyps
+        prev_hyp_ids = (
+            torch.div(top_ids, self.n_vocab, rounding_mode='trunc') + offsets
+        ).view(-1)
+        new_token_ids = (top_ids % self.n_vocab).view(-1)
         return prev_hyp_ids, new_token_ids, prev_hyp_ids, new_token_ids
 
     def init_hyp(self, x: torch.Tensor) -> BatchHypothesis:
@@ -123,16 +129,45 @@ class BatchBeamSearch(BeamSearch):
         init_scores = dict()
         for k, d in self.scorers.items():
             init_states[k] = d.batch_init_state(x)
-            init_scores[k] = 0.0
-        return self.batchfy(
-            [
-                Hypothesis(
-                    score=0.0,
-                    scores=init_scores,
-                    states=init_states,
-                    yseq=torch.tensor([self.sos], device=x.device),
-                )
-            ]
+            init_scores[k] = torch.zeros(1, dtype=x.dtype, device=x.device)
+        # sos + one token per input frame + the final eos
+        yseq = torch.full((1, x.size(0) + 2), self.eos, dtype=torch.int64, device=x.device)
+        yseq[0, 0] = self.sos
+        return BatchHypothesis(
+            yseq=yseq,
+            score=torch.zeros(1, dtype=x.dtype, device=x.device),
+            length=torch.ones(1, dtype=torch.int64, device=x.device),
+            scores=init_scores,
+            states=init_states,
+        )
+
+    def batch_init_hyp(self, xs: torch.Tensor, xlens: torch.Tensor) -> BatchHypothesis:
+        """Get the initial hypotheses of several utterances.
+
+        Args:
+            xs (torch.Tensor): The padded encoder output features (n_utt, T, D)
+            xlens (torch.Tensor): The lengths of the encoder outputs (n_utt,)
+
+        Returns:
+            BatchHypothesis: The initial hypotheses, one per utterance.
+
+        """
+        n_utt = xs.size(0)
+        init_states = dict()
+        init_scores = dict()
+        for k, d in self.scorers.items():
+            init_states[k] = d.batch_init_state_padded(xs, xlens)
+            init_scores[k] = torch.zeros(n_utt, dtype=xs.dtype, device=xs.device)
+        yseq = torch.full(
+            (n_utt, xs.size(1) + 2), self.eos, dtype=torch.int64, device=xs.device
+        )
+        yseq[:, 0] = self.sos
+        return BatchHypothesis(
+            yseq=yseq,
+            score=torch.zeros(n_utt, dtype=xs.dtype, device=xs.device),
+            length=torch.ones(n_utt, dtype=torch.int64, device=xs.device),
+            scores=init_scores,
+            states=init_states,
         )
 
     def score_full(
@@ -154,8 +189,9 @@ class BatchBeamSearch(BeamSearch):
         """
         scores = dict()
         states = dict()
+        yseq = self._prefix(hyp)
         for k, d in self.full_scorers.items():
-            scores[k], states[k] = d.batch_score(hyp.yseq, hyp.states[k], x)
+            scores[k], states[k] = d.batch_score(yseq, hyp.states[k], x)
         return scores, states
 
     def score_partial(
@@ -178,32 +214,61 @@ class BatchBeamSearch(BeamSearch):
         """
         scores = dict()
         states = dict()
+        yseq = self._prefix(hyp)
         for k, d in self.part_scorers.items():
             scores[k], states[k] = d.batch_score_partial(
-                hyp.yseq, ids, hyp.states[k], x
+                yseq, ids, hyp.states[k], x
             )
         return scores, states
 
-    def merge_states(self, states: Any, part_states: Any, part_idx: int) -> Any:
-        """Merge states for new hypothesis.
+    def force_tokens(
+        self, running_hyps: BatchHypothesis, x: torch.Tensor, tokens: List[int]
+    ) -> BatchHypothesis:
+        """Append given tokens to running hypotheses, scored as in the search.
 
         Args:
-            states: states of `self.full_scorers`
-            part_states: states of `self.part_scorers`
-            part_idx (int): The new token id for `part_scores`
+            running_hyps (BatchHypothesis): Running hypotheses on beam
+            x (torch.Tensor): Encoded speech feature (T, D)
+            tokens (List[int]): The tokens to append
 
         Returns:
-            Dict[str, torch.Tensor]: The new score dict.
-                Its keys are names of `self.full_scorers` and `self.part_scorers`.
-                Its values are states of the scorers.
+            BatchHypothesis: The hypotheses followed by `tokens`
 
         """
-        new_states = dict()
-        for k, v in states.items():
-            new_states[k] = v
-        for k, v in part_states.items():
-            new_states[k] = v
-        return new_states
+        n_batch = len(running_hyps)
+        xs = x.expand(n_batch, *x.shape)
+        ids = torch.arange(n_batch, device=x.device)
+        for token in tokens:
+            token_ids = torch.full_like(ids, token)
+            scores, states = self.score_full(running_hyps, xs)
+            part_scores, part_states = self.score_partial(
+                running_hyps, token_ids.unsqueeze(1), xs
+            )
+            score = running_hyps.score
+            new_scores = dict()
+            for k, v in scores.items():
+                score = score + self.weights[k] * v[ids, token_ids]
+                new_scores[k] = running_hyps.scores[k] + v[ids, token_ids]
+            for k, v in part_scores.items():
+                score = score + self.weights[k] * v[ids, token_ids]
+                new_scores[k] = running_hyps.scores[k] + v[ids, token_ids]
+            new_states = dict()
+            for k, v in states.items():
+                new_states[k] = self.full_scorers[k].batch_select_state(v, ids)
+            for k, v in part_states.items():
+                new_states[k] = self.part_scorers[k].batch_select_state(
+                    v, ids, token_ids
+                )
+            running_hyps = BatchHypothesis(
+                yseq=self._append_token(
+                    running_hyps.yseq, running_hyps.length, token_ids
+                ),
+                score=score,
+                length=running_hyps.length + 1,
+                scores=new_scores,
+                states=new_states,
+            )
+        return running_hyps
 
     def search(self, running_hyps: BatchHypothesis, x: torch.Tensor) -> BatchHypothesis:
         """Search new tokens for running hypotheses and encoded speech x.
@@ -216,13 +281,34 @@ class BatchBeamSearch(BeamSearch):
             BatchHypothesis: Best sorted hypotheses
 
         """
+        return self.batch_search(
+            running_hyps, x.expand(len(running_hyps), *x.shape), n_utt=1
+        )
+
+    def batch_search(
+        self, running_hyps: BatchHypothesis, xs: torch.Tensor, n_utt: int
+    ) -> BatchHypothesis:
+        """Search new tokens for running hypotheses of several utterances.
+
+        Args:
+            running_hyps (BatchHypothesis): Running hypotheses on beam,
+                `n_utt` consecutive groups of the same size, one per utterance
+            xs (torch.Tensor): Encoded speech feature of each hypothesis (n_batch, T, D),
+                or of each utterance (n_utt, T, D), shared by its hypotheses
+            n_utt (int): The number of utterances
+
+        Returns:
+            BatchHypothesis: Best sorted hypotheses, `self.beam_size` per utterance
+
+        """
+        x = xs[0]
         n_batch = len(running_hyps)
         part_ids = None  # no pre-beam
         # batch scoring
         weighted_scores = torch.zeros(
             n_batch, self.n_vocab, dtype=x.dtype, device=x.device
         )
-        scores, states = self.score_full(running_hyps, x.expand(n_batch, *x.shape))
+        scores, states = self.score_full(running_hyps, xs)
         for k in self.full_scorers:
             weighted_scores += self.weights[k] * scores[k]
         # partial scoring
@@ -236,7 +322,7 @@ class BatchBeamSearch(BeamSearch):
         # NOTE(takaaki-hori): Unlike BeamSearch, we assume that score_partial returns
         # full-size score matrices, which has non-zero scores for part_ids and zeros
         # for others.
-        part_scores, part_states = self.score_partial(running_hyps, part_ids, x)
+        part_scores, part_states = self.score_partial(running_hyps, part_ids, xs)
         for k in self.part_scorers:
             weighted_scores += self.weights[k] * part_scores[k]
         # add previous hyp scores
@@ -244,45 +330,44 @@ class BatchBeamSearch(BeamSearch):
             dtype=x.dtype, device=x.device
         ).unsqueeze(1)
 
-        # TODO(karita): do not use list. use batch instead
-        # see also https://github.com/espnet/espnet/pull/1402#discussion_r354561029
         # update hyps
-        best_hyps = []
-        prev_hyps = self.unbatchfy(running_hyps)
-        for (
+        (
             full_prev_hyp_id,
             full_new_token_id,
             part_prev_hyp_id,
             part_new_token_id,
-        ) in zip(*self.batch_beam(weighted_scores, part_ids)):
-            prev_hyp = prev_hyps[full_prev_hyp_id]
-            best_hyps.append(
-                Hypothesis(
-                    score=weighted_scores[full_prev_hyp_id, full_new_token_id],
-                    yseq=self.append_token(prev_hyp.yseq, full_new_token_id),
-                    scores=self.merge_scores(
-                        prev_hyp.scores,
-                        {k: v[full_prev_hyp_id] for k, v in scores.items()},
-                        full_new_token_id,
-                        {k: v[part_prev_hyp_id] for k, v in part_scores.items()},
-                        part_new_token_id,
-                    ),
-                    states=self.merge_states(
-                        {
-                            k: self.full_scorers[k].select_state(v, full_prev_hyp_id)
-                            for k, v in states.items()
-                        },
-                        {
-                            k: self.part_scorers[k].select_state(
-                                v, part_prev_hyp_id, part_new_token_id
-                            )
-                            for k, v in part_states.items()
-                        },
-                        part_new_token_id,
-                    ),
-                )
+        ) = self.batch_beam(weighted_scores, part_ids, n_utt)
+        length = running_hyps.length.index_select(0, full_prev_hyp_id)
+        yseq = self._append_token(
+            running_hyps.yseq.index_select(0, full_prev_hyp_id),
+            length,
+            full_new_token_id,
+        )
+        new_scores = dict()
+        for k, v in scores.items():
+            new_scores[k] = (
+                running_hyps.scores[k][full_prev_hyp_id]
+                + v[full_prev_hyp_id, full_new_token_id]
+            )
+        for k, v in part_scores.items():
+            new_scores[k] = (
+                running_hyps.scores[k][part_prev_hyp_id]
+                + v[part_prev_hyp_id, part_new_token_id]
             )
-        return self.batchfy(best_hyps)
+        new_states = dict()
+        for k, v in states.items():
+            new_states[k] = self.full_scorers[k].batch_select_state(v, full_prev_hyp_id)
+        for k, v in part_states.items():
+            new_states[k] = self.part_scorers[k].batch_select_state(
+                v, part_prev_hyp_id, part_new_token_id
+            )
+        return BatchHypothesis(
+            yseq=yseq,
+            score=weighted_scores[full_prev_hyp_id, full_new_token_id],
+            length=length + 1,
+            scores=new_scores,
+            states=new_states,
+        )
 
     def post_process(
         self,
@@ -307,7 +392,9 @@ class BatchBeamSearch(BeamSearch):
         """
         n_batch = running_hyps.yseq.shape[0]
         logging.debug(f"the number of running hypothes: {n_batch}")
-        if self.token_list is not None:
+        if self.token_list is not None and logging.getLogger().isEnabledFor(
+            logging.DEBUG
+        ):
             logging.debug(
                 "best hypo: "
                 + "".join(
@@ -320,21 +407,18 @@ class BatchBeamSearch(BeamSearch):
         # add eos in the final loop to avoid that there are no ended hyps
         if i == maxlen - 1:
             logging.info("adding <eos> in the last position in the loop")
-            yseq_eos = torch.cat(
-                (
-                    running_hyps.yseq,
-                    torch.full(
-                        (n_batch, 1),
-                        self.eos,
-                        device=running_hyps.yseq.device,
-                        dtype=torch.int64,
-                    ),
-                ),
-                1,
+            yseq_eos = self._append_token(
+                running_hyps.yseq,
+                running_hyps.length,
+                torch.full_like(running_hyps.length, self.eos),
+            )
+            running_hyps = BatchHypothesis(
+                yseq=yseq_eos,
+                score=running_hyps.score,
+                length=running_hyps.length + 1,
+                scores=running_hyps.scores,
+                states=running_hyps.states,
             )
-            running_hyps.yseq.resize_as_(yseq_eos)
-            running_hyps.yseq[:] = yseq_eos
-            running_hyps.length[:] = yseq_eos.shape[1]
 
         # add ended hypotheses to a final list, and removed them from current hypotheses
         # (this will be a probmlem, number of hyps < beam)
@@ -342,8 +426,160 @@ class BatchBeamSearch(BeamSearch):
             running_hyps.yseq[torch.arange(n_batch), running_hyps.length - 1]
             == self.eos
         )
-        for b in torch.nonzero(is_eos, as_tuple=False).view(-1):
+        for b in torch.nonzero(is_eos, as_tuple=False).view(-1).tolist():
             hyp = self._select(running_hyps, b)
             ended_hyps.append(hyp)
         remained_ids = torch.nonzero(is_eos == 0, as_tuple=False).view(-1)
         return self._batch_select(running_hyps, remained_ids)
+
+    def batch_forward(
+        self,
+        xs: torch.Tensor,
+        xlens: torch.Tensor,
+        maxlenratio: float = 0.0,
+        minlenratio: float = 0.0,
+    ) -> List[List[Hypothesis]]:
+        """Perform beam search over a padded batch of utterances.
+
+        Every utterance keeps its own beam of `self.beam_size` hypotheses
+        and its own end detection, but all of them are scored together.
+        The hypotheses are kept as `n_utt` groups of the same size:
+        ended hypotheses and the hypotheses of finished utterances stay
+        in place with a score of -inf, so that they are never expanded.
+
+        Args:
+            xs (torch.Tensor): Padded encoded speech features (n_utt, T, D)
+            xlens (torch.Tensor): Lengths of the encoded speech features (n_utt,)
+            maxlenratio (float): Input length ratio to obtain max output length.
+                If maxlenratio=0.0 (default), it uses a end-detect function
+                to automatically find maximum hypothesis lengths
+                If maxlenratio<0.0, its absolute value is interpreted
+                as a constant max output length.
+            minlenratio (float): Input length ratio to obtain min output length.
+
+        Returns:
+            list[list[Hypothesis]]: N-best decoding results of each utterance
+
+        """
+        n_utt = xs.size(0)
+        xlens = torch.as_tensor(xlens)
+        # set length bounds
+        if maxlenratio == 0:
+            maxlens = xlens.tolist()
+        elif maxlenratio < 0:
+            maxlens = [-1 * int(maxlenratio)] * n_utt
+        else:
+            maxlens = [max(1, int(maxlenratio * xlen)) for xlen in xlens.tolist()]
+        logging.info("decoder input lengths: " + str(xlens.tolist()))
+        logging.info("max output lengths: " + str(maxlens))
+
+        # main loop of prefix search
+        running_hyps = self.batch_init_hyp(xs, xlens)
+        ended_hyps = [[] for _ in range(n_utt)]
+        finished = [False] * n_utt
+        for i in range(max(maxlens)):
+            logging.debug("position " + str(i))
+            # the hypotheses of an utterance share its features, which are never copied
+            best = self.batch_search(running_hyps, xs, n_utt)
+            running_hyps = self.batch_post_process(
+                i, maxlens, best, ended_hyps, finished
+            )
+            # end detection
+            for u in range(n_utt):
+                if (
+                    not finished[u]
+                    and maxlenratio == 0.0
+                    and end_detect([h.asdict() for h in ended_hyps[u]], i)
+                ):
+                    logging.info(f"end detected at {i} for utterance {u}")
+                    finished[u] = True
+            if all(finished):
+                break
+            running_hyps = self._mask_finished(running_hyps, finished)
+
+        nbest_hyps = []
+        for u in range(n_utt):
+            hyps = sorted(ended_hyps[u], key=lambda x: x.score, reverse=True)
+            if len(hyps) == 0:
+                logging.warning(f"there is no N-best results for utterance {u}")
+                hyps = (
+                    []
+                    if minlenratio < 0.1
+                    else self.forward(
+                        xs[u, : xlens[u]], maxlenratio, max(0.0, minlenratio - 0.1)
+                    )
+                )
+            nbest_hyps.append(hyps)
+        return nbest_hyps
+
+    def _mask_finished(
+        self, running_hyps: BatchHypothesis, finished: List[bool]
+    ) -> BatchHypothesis:
+        """Set the scores of hypotheses of finished utterances to -inf."""
+        if not any(finished):
+            return running_hyps
+        n_hyps = len(running_hyps) // len(finished)
+        finished = torch.tensor(finished, device=running_hyps.score.device)
+        return self._kill(running_hyps, finished.repeat_interleave(n_hyps))
+
+    def batch_post_process(
+        self,
+        i: int,
+        maxlens: List[int],
+        running_hyps: BatchHypothesis,
+        ended_hyps: List[List[Hypothesis]],
+        finished: List[bool],
+    ) -> BatchHypothesis:
+        """Perform post-processing of beam search iterations of several utterances.
+
+        Args:
+            i (int): The length of hypothesis tokens.
+            maxlens (List[int]): The maximum length of tokens of each utterance.
+            running_hyps (BatchHypothesis): The running hypotheses in beam search.
+            ended_hyps (List[List[Hypothesis]]): The ended hypotheses of each
+                utterance.
+            finished (List[bool]): Whether each utterance is finished,
+                updated in place.
+
+        Returns:
+            BatchHypothesis: The new running hypotheses, where ended ones
+                have a score of -inf.
+
+        """
+        n_batch = len(running_hyps)
+        n_utt = len(maxlens)
+        n_hyps = n_batch // n_utt
+        alive = running_hyps.score > float("-inf")
+        is_eos = (
+            running_hyps.yseq[torch.arange(n_batch), running_hyps.length - 1]
+            == self.eos
+        )
+        # add eos in the final loop to avoid that there are no ended hyps
+        is_last = torch.tensor(
+            [i == maxlen - 1 for maxlen in maxlens], device=alive.device
+        ).repeat_interleave(n_hyps)
+        ended = alive & (is_eos | is_last)
+        for b in torch.nonzero(ended, as_tuple=False).view(-1).tolist():
+            hyp = self._select(running_hyps, b)
+            # as `post_process` does, the last position gets <eos> even after an <eos>
+            if is_last[b]:
+                hyp = hyp._replace(yseq=self.append_token(hyp.yseq, self.eos))
+            ended_hyps[b // n_hyps].append(hyp)
+        for u in range(n_utt):
+            if i >= maxlens[u] - 1 or not bool(
+                (alive & ~ended)[u * n_hyps : (u + 1) * n_hyps].any()
+            ):
+                finished[u] = True
+        return self._kill(running_hyps, ended)
+
+    @staticmethod
+    def _kill(hyps: BatchHypothesis, mask: torch.Tensor) -> BatchHypothesis:
+        """Set the scores of hypotheses in `mask` to -inf."""
+        # NOTE: BatchHypothesis._replace does not work because of its __len__
+        return BatchHypothesis(
+            yseq=hyps.yseq,
+            score=hyps.score.masked_fill(mask, float("-inf")),
+            length=hyps.length,
+            scores=hyps.scores,
+            states=hyps.states,
+        )
@@ -0,0 +1,175 @@
+"""Parallel beam search module for online decoding."""
+
+import logging
+from typing import List
+
+import torch
+
+from espnet.nets.batch_beam_search import BatchBeamSearch
+from espnet.nets.batch_beam_search import BatchHypothesis
+from espnet.nets.beam_search import Hypothesis
+from espnet.nets.e2e_asr_common import end_detect
+
+
+class BatchBeamSearchOnline(BatchBeamSearch):
+    """Online beam search implementation.
+
+    This is the blockwise synchronous beam search of
+    https://arxiv.org/abs/2006.14941. The encoder output arrives block by
+    block through :meth:`process_block`. The running hypotheses and the
+    states of their scorers are kept from one block to the next and are
+    extended to the new frames (see :meth:`BatchScorerInterface.batch_extend_state`),
+    so every block only searches the tokens the new frames allow instead of
+    decoding the whole input again.
+
+    Within a block that is not the last one, the search stops as soon as a
+    hypothesis reaches <eos> or repeats a token it already has, which is when
+    it runs ahead of the frames available (Eq. (11) in the paper). The last
+    token searched before that is held back and searched again in the next
+    block with more frames.
+
+    """
+
+    def __init__(self, *args, **kwargs):
+        """Initialize beam search."""
+        super().__init__(*args, **kwargs)
+        self.reset()
+
+    def reset(self):
+        """Reset the states for a new utterance."""
+        self.encbuffer = None
+        self.running_hyps = None
+        self.prev_hyps = None
+        self.ended_hyps = []
+        self.process_idx = 0
+
+    def process_block(
+        self,
+        h: torch.Tensor,
+        is_final: bool = False,
+        maxlenratio: float = 0.0,
+        minlenratio: float = 0.0,
+    ) -> List[Hypothesis]:
+        """Search the tokens of the next block of the encoder output.
+
+        Args:
+            h (torch.Tensor): Encoded speech feature of the new block (T, D)
+            is_final (bool): Whether the utterance ends with this block
+            maxlenratio (float): Input length ratio to obtain max output length.
+                See :meth:`BeamSearch.forward`
+            minlenratio (float): Input length ratio to obtain min output length.
+
+        Returns:
+            list[Hypothesis]: The running hypotheses so far, best first, or
+                the N-best decoding results if `is_final`
+
+        """
+        self.encbuffer = h if self.encbuffer is None else torch.cat([self.encbuffer, h])
+        x = self.encbuffer
+        if x.size(0) == 0:
+            return []
+        # set length bounds
+        if maxlenratio == 0:
+            maxlen = x.shape[0]
+        elif maxlenratio < 0:
+            maxlen = -1 * int(maxlenratio)
+        else:
+            maxlen = max(1, int(maxlenratio * x.size(0)))
+        logging.debug("decoder input length: " + str(x.shape[0]))
+
+        if self.running_hyps is None:
+            self.running_hyps = self.init_hyp(x)
+        else:
+            self.running_hyps = self.extend(x, self.running_hyps)
+        # hypotheses before the last step searched in this block
+        self.prev_hyps = None
+
+        # main loop of prefix search
+        while self.process_idx < maxlen:
+            logging.debug("position " + str(self.process_idx))
+            if not is_final and self.process_idx == maxlen - 1:
+                # <eos> would be added in the last position
+                break
+            best = self.search(self.running_hyps, x)
+            if not is_final and self.runs_ahead(best):
+                logging.debug(f"block ends at position {self.process_idx}")
+                break
+            self.prev_hyps = self.running_hyps
+            self.running_hyps = self.post_process(
+                self.process_idx, maxlen, maxlenratio, best, self.ended_hyps
+            )
+            self.process_idx += 1
+            if is_final:
+                # end detection
+                if maxlenratio == 0.0 and end_detect(
+                    [h.asdict() for h in self.ended_hyps], self.process_idx - 1
+                ):
+                    logging.info(f"end detected at {self.process_idx - 1}")
+                    break
+                if len(self.running_hyps) == 0:
+                    logging.info("no hypothesis. Finish decoding.")
+                    break
+
+        if is_final:
+            nbest_hyps = sorted(self.ended_hyps, key=lambda x: x.score, reverse=True)
+            if len(nbest_hyps) == 0:
+                logging.warning(
+                    "there is no N-best results, perform recognition "
+                    "again with smaller minlenratio."
+                )
+                nbest_hyps = (
+                    []
+                    if minlenratio < 0.1
+                    else self.forward(x, maxlenratio, max(0.0, minlenratio - 0.1))
+                )
+            self.reset()
+            return nbest_hyps
+
+        hyps = [self._select(self.running_hyps, i) for i in range(len(self.running_hyps))]
+        # the last token is searched again with the next block
+        if self.prev_hyps is not None and self.process_idx > 1:
+            self.running_hyps = self.prev_hyps
+            self.process_idx -= 1
+        return hyps
+
+    def runs_ahead(self, hyps: BatchHypothesis) -> bool:
+        """Whether a hypothesis reached <eos> or repeated a token.
+
+        Args:
+            hyps (BatchHypothesis): The hypotheses of the last step
+
+        Returns:
+            bool: True if the search should wait for the next block
+
+        """
+        n_batch = len(hyps)
+        last = hyps.yseq[torch.arange(n_batch), hyps.length - 1]
+        if bool((last == self.eos).any()):
+            return True
+        # the last token in the tokens before it, after <sos>
+        prefix = hyps.yseq[:, 1 : int(hyps.length[0]) - 1]
+        return bool((prefix == last.unsqueeze(1)).any())
+
+    def extend(self, x: torch.Tensor, hyps: BatchHypothesis) -> BatchHypothesis:
+        """Extend the states of the running hypotheses to a longer encoder output.
+
+        Args:
+            x (torch.Tensor): The encoder output so far (T, D)
+            hyps (BatchHypothesis): The running hypotheses
+
+        Returns:
+            BatchHypothesis: The hypotheses with states for `x`
+
+        """
+        ys = self._prefix(hyps)
+        states = {
+            k: self.scorers[k].batch_extend_state(ys, v, x)
+            for k, v in hyps.states.items()
+        }
+        return BatchHypothesis(
+            yseq=hyps.yseq,
+            score=hyps.score,
+            length=hyps.length,
+            scores=hyps.scores,
+            states=states,
+        )
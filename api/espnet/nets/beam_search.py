@@ -278,6 +278,40 @@ class BeamSearch(torch.nn.Module):
             new_states[k] = d.select_state(part_states[k], part_idx)
         return new_states
 
+    def force_tokens(
+        self, running_hyps: List[Hypothesis], x: torch.Tensor, tokens: List[int]
+    ) -> List[Hypothesis]:
+        """Append given tokens to running hypotheses, scored as in the search.
+
+        Args:
+            running_hyps (List[Hypothesis]): Running hypotheses on beam
+            x (torch.Tensor): Encoded speech feature (T, D)
+            tokens (List[int]): The tokens to append
+
+        Returns:
+            List[Hypothesis]: The hypotheses followed by `tokens`
+
+        """
+        forced_hyps = []
+        for hyp in running_hyps:
+            for token in tokens:
+                scores, states = self.score_full(hyp, x)
+                part_ids = torch.tensor([token], device=x.device)
+                part_scores, part_states = self.score_partial(hyp, part_ids, x)
+                score = hyp.score
+                for k in self.full_scorers:
+                    score += self.weights[k] * scores[k][token]
+                for k in self.part_scorers:
+                    score += self.weights[k] * part_scores[k][0]
+                hyp = Hypothesis(
+                    score=score,
+                    yseq=self.append_token(hyp.yseq, token),
+                    scores=self.merge_scores(hyp.scores, scores, token, part_scores, 0),
+                    states=self.merge_states(states, part_states, 0),
+                )
+            forced_hyps.append(hyp)
+        return forced_hyps
+
     def search(
         self, running_hyps: List[Hypothesis], x: torch.Tensor
     ) -> List[Hypothesis]:
@@ -334,7 +368,11 @@ class BeamSearch(torch.nn.Module):
         return best_hyps
 
     def forward(
-        self, x: torch.Tensor, maxlenratio: float = 0.0, minlenratio: float = 0.0
+        self,
+        x: torch.Tensor,
+        maxlenratio: float = 0.0,
+        minlenratio: float = 0.0,
+        prefix: List[int] = None,
     ) -> List[Hypothesis]:
         """Perform beam search.
 
@@ -346,6 +384,8 @@ class BeamSearch(torch.nn.Module):
                 If maxlenratio<0.0, its absolute value is interpreted
                 as a constant max output length.
             minlenratio (float): Input length ratio to obtain min output length.
+            prefix (List[int]): Tokens every hypothesis starts with after <sos>,
+                only the tokens after them are searched
 
         Returns:
             list[Hypothesis]: N-best decoding results
@@ -359,14 +399,18 @@ class BeamSearch(torch.nn.Module):
         else:
             maxlen = max(1, int(maxlenratio * x.size(0)))
         minlen = int(minlenratio * x.size(0))
+        prefix = [] if prefix is None else list(prefix)
+        maxlen = max(maxlen, len(prefix) + 1)
         logging.info("decoder input length: " + str(x.shape[0]))
         logging.info("max output length: " + str(maxlen))
         logging.info("min output length: " + str(minlen))
 
         # main loop of prefix search
         running_hyps = self.init_hyp(x)
+        if prefix:
+            running_hyps = self.force_tokens(running_hyps, x, prefix)
         ended_hyps = []
-        for i in range(maxlen):
+        for i in range(len(prefix), maxlen):
             logging.debug("position " + str(i))
             best = self.search(running_hyps, x)
             # post process of one iteration
@@ -391,7 +435,7 @@ class BeamSearch(torch.nn.Module):
             return (
                 []
                 if minlenratio < 0.1
-                else self.forward(x, maxlenratio, max(0.0, minlenratio - 0.1))
+                else self.forward(x, maxlenratio, max(0.0, minlenratio - 0.1), prefix)
             )
 
         # report the best result
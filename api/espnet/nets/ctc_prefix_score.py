@@ -9,6 +9,56 @@ import numpy as np
 import six
 
 
+def ctc_forward_recursion(r, log_phi, x, start: int, end: int):
+    """Run the CTC forward recursion over frames [start, end) in place.
+
+    :param torch.Tensor r: forward probabilities log(r_t^n(h)), log(r_t^b(h))
+        (T, 2, BW, S), frame start - 1 must be filled
+    :param torch.Tensor log_phi: forward probabilities of the prefix (T, BW, S)
+    :param torch.Tensor x: label posteriors of non-blank and blank (2, T, BW, S)
+    :param int start: first frame to compute
+    :param int end: frame to stop at
+    :return r
+
+    `logaddexp` gives the same values as a `logsumexp` over the stacked
+    terms up to floating point rounding, not bit for bit, and so do the
+    other implementations (see test/test_ctc_prefix_score.py).
+    """
+    for t in range(start, end):
+        r[t, 0] = torch.logaddexp(r[t - 1, 0], log_phi[t - 1]) + x[0, t]
+        r[t, 1] = torch.logaddexp(r[t - 1, 0], r[t - 1, 1]) + x[1, t]
+    return r
+
+
+def ctc_forward_recursion_numpy(r, log_phi, x, start: int, end: int):
+    """Run `ctc_forward_recursion` with NumPy on CPU tensors.
+
+    NumPy has much less per-call overhead than torch for the small
+    (BW, S) arrays of every frame. The arrays share memory with `r`.
+    """
+    r_, log_phi, x = r.numpy(), log_phi.detach().numpy(), x.detach().numpy()
+    for t in range(start, end):
+        np.logaddexp(r_[t - 1, 0], log_phi[t - 1], out=r_[t, 0])
+        r_[t, 0] += x[0, t]
+        np.logaddexp(r_[t - 1, 0], r_[t - 1, 1], out=r_[t, 1])
+        r_[t, 1] += x[1, t]
+    return r
+
+
+_ctc_forward_recursion_script = None
+
+
+def ctc_forward_recursion_script(r, log_phi, x, start: int, end: int):
+    """Run `ctc_forward_recursion` compiled with TorchScript.
+
+    The function is scripted at its first call.
+    """
+    global _ctc_forward_recursion_script
+    if _ctc_forward_recursion_script is None:
+        _ctc_forward_recursion_script = torch.jit.script(ctc_forward_recursion)
+    return _ctc_forward_recursion_script(r, log_phi, x, start, end)
+
+
 class CTCPrefixScoreTH(object):
     """Batch processing of CTCPrefixScore
 
@@ -20,7 +70,9 @@ class CTCPrefixScoreTH(object):
     Speech Recognition," In INTERSPEECH (pp. 3825-3829), 2019.
     """
 
-    def __init__(self, x, xlens, blank, eos, margin=0):
+    forward_impls = ("python", "script", "numpy")
+
+    def __init__(self, x, xlens, blank, eos, margin=0, forward_impl="python"):
         """Construct CTC prefix scorer
 
         :param torch.Tensor x: input label posterior sequences (B, T, O)
@@ -28,12 +80,21 @@ class CTCPrefixScoreTH(object):
         :param int blank: blank label id
         :param int eos: end-of-sequence id
         :param int margin: margin parameter for windowing (0 means no windowing)
+        :param str forward_impl: implementation of the forward recursion over
+            frames, "python" (a loop of torch ops), "script" (TorchScript)
+            or "numpy" (CPU only), equal up to floating point rounding
         """
+        if forward_impl not in self.forward_impls:
+            raise ValueError(
+                "forward_impl must be one of %s: %s"
+                % (", ".join(self.forward_impls), forward_impl)
+            )
         # In the comment lines,
         # we assume T: input_length, B: batch size, W: beam width, O: output dim.
         self.logzero = -10000000000.0
         self.blank = blank
         self.eos = eos
+        self.forward_impl = forward_impl
         self.batch = x.size(0)
         self.input_length = x.size(1)
         self.odim = x.size(2)
@@ -44,16 +105,15 @@ class CTCPrefixScoreTH(object):
             else torch.device("cpu")
         )
         # Pad the rest of posteriors in the batch
-        # TODO(takaaki-hori): need a better way without for-loops
-        for i, l in enumerate(xlens):
-            if l < self.input_length:
-                x[i, l:, :] = self.logzero
-                x[i, l:, blank] = 0
+        xlens = torch.as_tensor(xlens, device=self.device)
+        pad = torch.arange(self.input_length, device=self.device) >= xlens.unsqueeze(1)
+        x = x.masked_fill(pad.unsqueeze(2), self.logzero)
+        x[:, :, blank] = x[:, :, blank].masked_fill(pad, 0)
         # Reshape input x
         xn = x.transpose(0, 1)  # (B, T, O) -> (T, B, O)
         xb = xn[:, :, self.blank].unsqueeze(2).expand(-1, -1, self.odim)
         self.x = torch.stack([xn, xb])  # (2, T, B, O)
-        self.end_frames = torch.as_tensor(xlens) - 1
+        self.end_frames = xlens - 1
 
         # Setup CTC windowing
         self.margin = margin
@@ -76,7 +136,10 @@ class CTCPrefixScoreTH(object):
         :return new_state, ctc_local_scores (BW, O)
         """
         output_length = len(y[0]) - 1  # ignore sos
-        last_ids = [yi[-1] for yi in y]  # last output label ids
+        if isinstance(y, torch.Tensor):
+            last_ids = y[:, -1].to(self.device)  # last output label ids
+        else:
+            last_ids = torch.as_tensor([yi[-1] for yi in y], device=self.device)
         n_bh = len(last_ids)  # batch * hyps
         n_hyps = n_bh // self.batch  # assuming each utterance has the same # of hyps
         self.scoring_num = scoring_ids.size(-1) if scoring_ids is not None else 0
@@ -132,14 +195,17 @@ class CTCPrefixScoreTH(object):
 
         r_sum = torch.logsumexp(r_prev, 1)
         log_phi = r_sum.unsqueeze(2).repeat(1, 1, snum)
+        # a repeated last label only extends from paths ending with blank
+        phi_src = r_prev[:, 1].unsqueeze(2)
         if scoring_ids is not None:
-            for idx in range(n_bh):
-                pos = scoring_idmap[idx, last_ids[idx]]
-                if pos >= 0:
-                    log_phi[:, idx, pos] = r_prev[:, 1, idx]
+            phi_ids = scoring_idmap[self.idx_bh[:n_bh, 0], last_ids]
+            phi_index = phi_ids.clamp(min=0).view(1, -1, 1).expand(r_sum.size(0), -1, 1)
+            phi_src = torch.where(
+                (phi_ids >= 0).view(1, -1, 1), phi_src, log_phi.gather(2, phi_index)
+            )
         else:
-            for idx in range(n_bh):
-                log_phi[:, idx, last_ids[idx]] = r_prev[:, 1, idx]
+            phi_index = last_ids.view(1, -1, 1).expand(r_sum.size(0), -1, 1)
+        log_phi.scatter_(2, phi_index, phi_src)
 
         # decide start and end frames based on attention weights
         if att_w is not None and self.margin > 0:
@@ -154,12 +220,12 @@ class CTCPrefixScoreTH(object):
             end = self.input_length
 
         # compute forward probabilities log(r_t^n(h)) and log(r_t^b(h))
-        for t in range(start, end):
-            rp = r[t - 1]
-            rr = torch.stack([rp[0], log_phi[t - 1], rp[0], rp[1]]).view(
-                2, 2, n_bh, snum
-            )
-            r[t] = torch.logsumexp(rr, 1) + x_[:, t]
+        if self.forward_impl == "script":
+            ctc_forward_recursion_script(r, log_phi, x_, start, end)
+        elif self.forward_impl == "numpy" and not r.is_cuda:
+            ctc_forward_recursion_numpy(r, log_phi, x_, start, end)
+        else:
+            ctc_forward_recursion(r, log_phi, x_, start, end)
 
         # compute log prefix probabilities log(psi)
         log_phi_x = torch.cat((log_phi[0].unsqueeze(0), log_phi[:-1]), dim=0) + x_[0]
@@ -171,16 +237,15 @@ class CTCPrefixScoreTH(object):
                 torch.cat((log_phi_x[start:end], r[start - 1, 0].unsqueeze(0)), dim=0),
                 dim=0,
             )
-            for si in range(n_bh):
-                log_psi[si, scoring_ids[si]] = log_psi_[si]
+            log_psi.scatter_(1, scoring_ids, log_psi_)
         else:
             log_psi = torch.logsumexp(
                 torch.cat((log_phi_x[start:end], r[start - 1, 0].unsqueeze(0)), dim=0),
                 dim=0,
             )
 
-        for si in range(n_bh):
-            log_psi[si, self.eos] = r_sum[self.end_frames[si // n_hyps], si]
+        end_frames = self.end_frames.repeat_interleave(n_hyps).unsqueeze(0)
+        log_psi[:, self.eos] = r_sum.gather(0, end_frames).squeeze(0)
 
         # exclude blank probs
         log_psi[:, self.blank] = self.logzero
@@ -240,13 +305,23 @@ class CTCPrefixScoreTH(object):
             self.x = torch.stack([xn, xb])  # (2, T, B, O)
             self.x[:, : tmp_x.shape[1], :, :] = tmp_x
             self.input_length = x.size(1)
-            self.end_frames = torch.as_tensor(xlens) - 1
+            self.end_frames = torch.as_tensor(xlens, device=self.device) - 1
+            if self.margin > 0:
+                self.frame_ids = torch.arange(
+                    self.input_length, dtype=self.dtype, device=self.device
+                )
 
-    def extend_state(self, state):
+    def extend_state(self, state, last_ids=None):
         """Compute CTC prefix state.
 
+        The forward probabilities of the new frames are those of paths that
+        already emitted the whole prefix, i.e. on the frames before them:
+        they stay on the last label or go through blanks.
 
-        :param state    : CTC state
+        :param state    : CTC state `(r, s, f_min, f_max)`, r is (T, 2, n_bh)
+            for batched hypotheses or (T, 2) for a single one
+        :param torch.Tensor last_ids: last label ids of the hypotheses (n_bh,),
+            without them the paths only go on through blanks
         :return ctc_state
         """
 
@@ -257,15 +332,33 @@ class CTCPrefixScoreTH(object):
             r_prev, s_prev, f_min_prev, f_max_prev = state
 
             r_prev_new = torch.full(
-                (self.input_length, 2),
+                (self.input_length, 2, *r_prev.shape[2:]),
                 self.logzero,
                 dtype=self.dtype,
                 device=self.device,
             )
             start = max(r_prev.shape[0], 1)
             r_prev_new[0:start] = r_prev
-            for t in six.moves.range(start, self.input_length):
-                r_prev_new[t, 1] = r_prev_new[t - 1, 1] + self.x[0, t, :, self.blank]
+            # (T, B, O) posteriors of the frames, one row per hypothesis
+            xn = self.x[0]
+            if r_prev.dim() == 3:
+                xn = xn.repeat_interleave(r_prev.size(2) // self.batch, dim=1)
+            else:
+                xn = xn[:, 0]
+            x_blank = xn[..., self.blank]
+            if last_ids is None:
+                for t in six.moves.range(start, self.input_length):
+                    r_prev_new[t, 1] = r_prev_new[t - 1, 1] + x_blank[t]
+            else:
+                last_ids = torch.as_tensor(last_ids, device=self.device)
+                x_last = xn.gather(-1, last_ids.view(1, -1, 1).expand(xn.size(0), -1, 1))
+                x_last = x_last.view(xn.size(0), *r_prev.shape[2:])
+                for t in six.moves.range(start, self.input_length):
+                    r_prev_new[t, 0] = r_prev_new[t - 1, 0] + x_last[t]
+                    r_prev_new[t, 1] = (
+                        torch.logaddexp(r_prev_new[t - 1, 0], r_prev_new[t - 1, 1])
+                        + x_blank[t]
+                    )
 
             return (r_prev_new, s_prev, f_min_prev, f_max_prev)
 
@@ -21,13 +21,15 @@ class Conv3dResNet(torch.nn.Module):
     """Conv3dResNet module
     """
 
-    def __init__(self, backbone_type="resnet", relu_type="swish"):
+    def __init__(self, backbone_type="resnet", relu_type="swish", chunk_size=0):
         """__init__.
 
         :param backbone_type: str, the type of a visual front-end.
         :param relu_type: str, activation function used in an audio front-end.
+        :param chunk_size: int, frames that go through the front-end at once, 0 for all.
         """
         super(Conv3dResNet, self).__init__()
+        self.chunk_size = chunk_size
         self.frontend_nout = 64
         self.trunk = ResNet(BasicBlock, [2, 2, 2, 2], relu_type=relu_type)
         self.frontend3D = nn.Sequential(
@@ -40,8 +42,74 @@ class Conv3dResNet(torch.nn.Module):
 
     def forward(self, xs_pad):
         B, C, T, H, W = xs_pad.size()
+        if 0 < self.chunk_size < T:
+            # the peak memory of a chunk does not depend on the length of the video,
+            # the chunks overlap by the temporal context of the 3D convolution
+            return torch.cat([
+                self.forward_range(xs_pad, start, min(start + self.chunk_size, T))
+                for start in range(0, T, self.chunk_size)
+            ], dim=1)
         xs_pad = self.frontend3D(xs_pad)
         Tnew = xs_pad.shape[2]
         xs_pad = threeD_to_2D_tensor(xs_pad)
         xs_pad = self.trunk(xs_pad)
         return xs_pad.view(B, Tnew, xs_pad.size(1))
+
+
+    def forward_range(self, xs_pad, start, stop):
+        """Features of the frames start to stop, the same as forward(xs_pad)[:, start:stop].
+
+        Only the frames the 3D convolution needs go through it, and only the
+        frames start to stop through the trunk.
+        """
+        context = self.frontend3D[0].padding[0]
+        first = max(start - context, 0)
+        xs_pad = self.frontend3D(xs_pad[:, :, first:stop + context])
+        xs_pad = xs_pad[:, :, start - first:stop - first]
+        B, Tnew = xs_pad.size(0), xs_pad.size(2)
+        xs_pad = self.trunk(threeD_to_2D_tensor(xs_pad))
+        return xs_pad.view(B, Tnew, xs_pad.size(1))
+
+
+class FrontendCache:
+    """Features of the last window of a stream, reused by the next window.
+
+    The front-end works on each frame alone but for its first 3D
+    convolution, whose kernel reaches `context` frames on each side and sees
+    zeros past the edges of the window. The feature of a frame is thus the
+    same in two windows unless it is within `context` frames of an edge that
+    the windows do not share, and only those frames and the new ones are
+    computed again.
+
+    :param Conv3dResNet frontend: the visual front-end
+    """
+
+    def __init__(self, frontend):
+        self.frontend = frontend
+        self.context = frontend.frontend3D[0].padding[0]
+        self.start = 0
+        self.stop = 0
+        self.feats = None
+
+    def __call__(self, xs_pad, start=0):
+        """Front-end features of a window, the same as frontend(xs_pad).
+
+        :param torch.Tensor xs_pad: frames of the window (B, C, T, H, W)
+        :param int start: index of the first frame of the window in the stream
+        :return: features (B, T, D)
+        """
+        stop = start + xs_pad.size(2)
+        # frames lo to hi are reused
+        lo = start if start == self.start else max(start, self.start) + self.context
+        hi = stop if stop == self.stop else min(stop, self.stop) - self.context
+        if self.feats is None or lo >= hi:
+            feats = self.frontend(xs_pad)
+        else:
+            parts = [self.feats[:, lo - self.start:hi - self.start]]
+            if lo > start:
+                parts.insert(0, self.frontend.forward_range(xs_pad, 0, lo - start))
+            if hi < stop:
+                parts.append(self.frontend.forward_range(xs_pad, hi - start, stop - start))
+            feats = torch.cat(parts, dim=1)
+        self.start, self.stop, self.feats = start, stop, feats
+        return feats
@@ -14,6 +14,8 @@ import torch
 from espnet.nets.ctc_prefix_score import CTCPrefixScore
 from espnet.nets.e2e_asr_common import end_detect
 from espnet.nets.e2e_asr_common import ErrorCalculator
+from espnet.nets.pytorch_backend.backbones.conv3d_extractor import Conv3dResNet
+from espnet.nets.pytorch_backend.backbones.conv3d_extractor import FrontendCache
 from espnet.nets.pytorch_backend.ctc import CTC
 from espnet.nets.pytorch_backend.nets_utils import get_subsample
 from espnet.nets.pytorch_backend.nets_utils import make_non_pad_mask
@@ -30,6 +32,7 @@ from espnet.nets.pytorch_backend.transformer.label_smoothing_loss import (
 )
 from espnet.nets.pytorch_backend.transformer.mask import subsequent_mask
 from espnet.nets.pytorch_backend.transformer.mask import target_mask
+from espnet.nets.pytorch_backend.transformer.streaming_encoder import StreamingEncoder
 from espnet.nets.scorers.ctc import CTCPrefixScorer
 
 
@@ -299,10 +302,13 @@ class E2E(torch.nn.Module):
         """Scorers."""
         return dict(decoder=self.decoder, ctc=CTCPrefixScorer(self.ctc, self.eos))
 
-    def encode(self, x, extract_resnet_feats=False):
+    def encode(self, x, extract_resnet_feats=False, frontend_cache=None, start=0):
         """Encode acoustic features.
 
         :param ndarray x: source acoustic feature (T, D)
+        :param FrontendCache frontend_cache: front-end features of the last
+            window of the stream x is a window of, see frontend_cache
+        :param int start: index of the first frame of x in that stream
         :return: encoder outputs
         :rtype: torch.Tensor
         """
@@ -313,8 +319,49 @@ class E2E(torch.nn.Module):
                 x,
                 None,
                 extract_resnet_feats=extract_resnet_feats,
+                frontend_cache=frontend_cache,
+                start=start,
             )
             return resnet_feats.squeeze(0)
         else:
-            enc_output, _ = self.encoder(x, None)
+            enc_output, _ = self.encoder(x, None, frontend_cache=frontend_cache, start=start)
             return enc_output.squeeze(0)
+
+    def frontend_cache(self):
+        """Front-end features shared by the overlapping windows of a video stream.
+
+        :return: FrontendCache to pass to encode with each window
+        """
+        assert isinstance(self.encoder.frontend, Conv3dResNet), (
+            "the front-end cache is only supported with the visual front-end"
+        )
+        return FrontendCache(self.encoder.frontend)
+
+    def streaming_encoder(self, chunk_size=16, left_context=64, right_context=0):
+        """Encoder of a video stream, fed with its frames as they arrive.
+
+        :param int chunk_size: frames encoded at once
+        :param int left_context: frames before a chunk its layers attend to
+        :param int right_context: frames after a chunk it is encoded with
+        :return: StreamingEncoder of the stream
+        """
+        self.eval()
+        return StreamingEncoder(self.encoder, chunk_size, left_context, right_context)
+
+    def encode_batch(self, xs_pad, ilens):
+        """Encode a padded batch of acoustic features.
+
+        :param torch.Tensor xs_pad: padded input features (B, 1, Tmax, H, W)
+        :param torch.Tensor ilens: input lengths (B,)
+        :return: padded encoder outputs (B, Tmax, adim) and output lengths (B,)
+        :rtype: Tuple[torch.Tensor, torch.Tensor]
+        """
+        self.eval()
+        assert self.transformer_input_layer == "conv3d", (
+            "batched encoding is only exact for the per-frame visual front-end"
+        )
+        xs_pad = torch.as_tensor(xs_pad)
+        ilens = torch.as_tensor(ilens, device=xs_pad.device)
+        masks = make_non_pad_mask(ilens.tolist()).to(xs_pad.device).unsqueeze(-2)
+        enc_output, _ = self.encoder(xs_pad, masks)
+        return enc_output, ilens
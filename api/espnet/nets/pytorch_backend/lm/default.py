@@ -1,7 +1,6 @@
 """Default Recurrent Neural Network Languge Model in `lm_train.py`."""
 
 from typing import Any
-from typing import List
 from typing import Tuple
 
 import logging
@@ -167,52 +166,41 @@ class DefaultRNNLM(BatchScorerInterface, LMInterface, nn.Module):
         return self.model.final(state)
 
     # batch beam search API (see BatchScorerInterface)
+    def batch_init_state(self, x):
+        """Get an initial batched state (zero RNN states are created lazily)."""
+        return None
+
+    def batch_init_state_padded(self, xs, xlens):
+        """Get an initial state for several utterances (see `batch_init_state`)."""
+        return None
+
     def batch_score(
-        self, ys: torch.Tensor, states: List[Any], xs: torch.Tensor
-    ) -> Tuple[torch.Tensor, List[Any]]:
+        self, ys: torch.Tensor, states: Any, xs: torch.Tensor
+    ) -> Tuple[torch.Tensor, Any]:
         """Score new token batch.
 
         Args:
             ys (torch.Tensor): torch.int64 prefix tokens (n_batch, ylen).
-            states (List[Any]): Scorer states for prefix tokens.
+            states (dict): RNN states keyed by "h" (and "c" for LSTM),
+                each a list of (n_batch, n_units) tensors per layer,
+                or None for the first step.
             xs (torch.Tensor):
                 The encoder feature that generates ys (n_batch, xlen, n_feat).
 
         Returns:
-            tuple[torch.Tensor, List[Any]]: Tuple of
+            tuple[torch.Tensor, dict]: Tuple of
                 batchfied scores for next token with shape of `(n_batch, n_vocab)`
-                and next state list for ys.
+                and next RNN states for ys.
 
         """
-        # merge states
-        n_batch = len(ys)
-        n_layers = self.model.predictor.n_layers
-        if self.model.predictor.typ == "lstm":
-            keys = ("c", "h")
-        else:
-            keys = ("h",)
-
-        if states[0] is None:
-            states = None
-        else:
-            # transpose state of [batch, key, layer] into [key, layer, batch]
-            states = {
-                k: [
-                    torch.stack([states[b][k][i] for b in range(n_batch)])
-                    for i in range(n_layers)
-                ]
-                for k in keys
-            }
         states, logp = self.model.predict(states, ys[:, -1])
+        return logp, states
 
-        # transpose state of [key, layer, batch] into [batch, key, layer]
-        return (
-            logp,
-            [
-                {k: [states[k][i][b] for i in range(n_layers)] for k in keys}
-                for b in range(n_batch)
-            ],
-        )
+    def batch_select_state(self, states, ids, new_ids=None):
+        """Select the RNN states of hypotheses `ids`."""
+        if states is None:
+            return None
+        return {k: [h.index_select(0, ids) for h in v] for k, v in states.items()}
 
 
 class ClassifierWithState(nn.Module):
@@ -206,35 +206,32 @@ class TransformerLM(nn.Module, LMInterface, BatchScorerInterface):
         return logp, cache
 
     # batch beam search API (see BatchScorerInterface)
+    def batch_init_state(self, x: torch.Tensor) -> Any:
+        """Get an initial batched state (no cached layer outputs yet)."""
+        return None
+
+    def batch_init_state_padded(self, xs: torch.Tensor, xlens: torch.Tensor) -> Any:
+        """Get an initial state for several utterances (see `batch_init_state`)."""
+        return None
+
     def batch_score(
-        self, ys: torch.Tensor, states: List[Any], xs: torch.Tensor
-    ) -> Tuple[torch.Tensor, List[Any]]:
+        self, ys: torch.Tensor, states: List[torch.Tensor], xs: torch.Tensor
+    ) -> Tuple[torch.Tensor, List[torch.Tensor]]:
         """Score new token batch (required).
 
         Args:
             ys (torch.Tensor): torch.int64 prefix tokens (n_batch, ylen).
-            states (List[Any]): Scorer states for prefix tokens.
+            states (List[torch.Tensor]): Cached outputs of each encoder layer,
+                (n_batch, ylen - 1, att_unit), or None for the first step.
             xs (torch.Tensor):
                 The encoder feature that generates ys (n_batch, xlen, n_feat).
 
         Returns:
-            tuple[torch.Tensor, List[Any]]: Tuple of
+            tuple[torch.Tensor, List[torch.Tensor]]: Tuple of
                 batchfied scores for next token with shape of `(n_batch, n_vocab)`
-                and next state list for ys.
+                and next cache of each encoder layer.
 
         """
-        # merge states
-        n_batch = len(ys)
-        n_layers = len(self.encoder.encoders)
-        if states[0] is None:
-            batch_state = None
-        else:
-            # transpose state of [batch, layer] into [layer, batch]
-            batch_state = [
-                torch.stack([states[b][i] for b in range(n_batch)])
-                for i in range(n_layers)
-            ]
-
         if self.embed_drop is not None:
             emb = self.embed_drop(self.embed(ys))
         else:
@@ -242,11 +239,16 @@ class TransformerLM(nn.Module, LMInterface, BatchScorerInterface):
 
         # batch decoding
         h, _, states = self.encoder.forward_one_step(
-            emb, self._target_mask(ys), cache=batch_state
+            emb, self._target_mask(ys), cache=states
         )
         h = self.decoder(h[:, -1])
         logp = h.log_softmax(dim=-1)
-
-        # transpose state of [layer, batch] into [batch, layer]
-        state_list = [[states[i][b] for i in range(n_layers)] for b in range(n_batch)]
-        return logp, state_list
+        return logp, states
+
+    def batch_select_state(
+        self, states: List[torch.Tensor], ids: torch.Tensor, new_ids=None
+    ) -> List[torch.Tensor]:
+        """Select the layer caches of hypotheses `ids`."""
+        if states is None:
+            return None
+        return [c.index_select(0, ids) for c in states]
@@ -56,6 +56,20 @@ class MultiHeadedAttention(nn.Module):
 
         return q, k, v
 
+    def forward_kv(self, key, value):
+        """Transform key and value only.
+        Args:
+            key (torch.Tensor): Key tensor (#batch, time2, size).
+            value (torch.Tensor): Value tensor (#batch, time2, size).
+        Returns:
+            torch.Tensor: Transformed key tensor (#batch, n_head, time2, d_k).
+            torch.Tensor: Transformed value tensor (#batch, n_head, time2, d_k).
+        """
+        n_batch = key.size(0)
+        k = self.linear_k(key).view(n_batch, -1, self.h, self.d_k)
+        v = self.linear_v(value).view(n_batch, -1, self.h, self.d_k)
+        return k.transpose(1, 2), v.transpose(1, 2)
+
     def forward_attention(self, value, scores, mask, rtn_attn=False):
         """Compute attention context vector.
         Args:
@@ -67,7 +81,7 @@ class MultiHeadedAttention(nn.Module):
             torch.Tensor: Transformed value (#batch, time1, d_model)
                 weighted by the attention score (#batch, time1, time2).
         """
-        n_batch = value.size(0)
+        n_batch = scores.size(0)  # value may be broadcast over the batch
         if mask is not None:
             mask = mask.unsqueeze(1).eq(0)  # (batch, 1, *, time2)
             min_value = float(
@@ -105,6 +119,23 @@ class MultiHeadedAttention(nn.Module):
         scores = torch.matmul(q, k.transpose(-2, -1)) / math.sqrt(self.d_k)
         return self.forward_attention(v, scores, mask, rtn_attn)
 
+    def forward_cached_kv(self, query, k, v, mask, rtn_attn=False):
+        """Compute scaled dot product attention with transformed key and value.
+        Args:
+            query (torch.Tensor): Query tensor (#batch, time1, size).
+            k (torch.Tensor): Transformed key tensor (#batch, n_head, time2, d_k).
+            v (torch.Tensor): Transformed value tensor (#batch, n_head, time2, d_k).
+            mask (torch.Tensor): Mask tensor (#batch, 1, time2) or
+                (#batch, time1, time2).
+            rtn_attn (boolean): Flag of return attention score
+        Returns:
+            torch.Tensor: Output tensor (#batch, time1, d_model).
+        """
+        n_batch = query.size(0)
+        q = self.linear_q(query).view(n_batch, -1, self.h, self.d_k).transpose(1, 2)
+        scores = torch.matmul(q, k.transpose(-2, -1)) / math.sqrt(self.d_k)
+        return self.forward_attention(v, scores, mask, rtn_attn)
+
 
 class LegacyRelPositionMultiHeadedAttention(MultiHeadedAttention):
     """Multi-Head Attention layer with relative position encoding (old version).
@@ -218,8 +249,9 @@ class RelPositionMultiHeadedAttention(MultiHeadedAttention):
     def rel_shift(self, x):
         """Compute relative positional encoding.
         Args:
-            x (torch.Tensor): Input tensor (batch, head, time1, 2*time1-1).
-            time1 means the length of query vector.
+            x (torch.Tensor): Input tensor (batch, head, time1, time2+time1-1).
+            time1 means the length of query vector, the queries being the
+            last time1 of the time2 keys (time2 == time1 without a cache).
         Returns:
             torch.Tensor: Output tensor.
         """
@@ -228,7 +260,7 @@ class RelPositionMultiHeadedAttention(MultiHeadedAttention):
 
         x_padded = x_padded.view(*x.size()[:2], x.size(3) + 1, x.size(2))
         x = x_padded[:, :, 1:].view_as(x)[
-            :, :, :, : x.size(-1) // 2 + 1
+            :, :, :, : x.size(-1) - x.size(-2) + 1
         ]  # only keep the positions from 0 to time2
 
         if self.zero_triu:
@@ -250,12 +282,29 @@ class RelPositionMultiHeadedAttention(MultiHeadedAttention):
         Returns:
             torch.Tensor: Output tensor (#batch, time1, d_model).
         """
-        q, k, v = self.forward_qkv(query, key, value)
-        q = q.transpose(1, 2)  # (batch, time1, head, d_k)
+        k, v = self.forward_kv(key, value)
+        return self.forward_cached_kv(query, k, v, pos_emb, mask)
+
+    def forward_cached_kv(self, query, k, v, pos_emb, mask):
+        """Compute rel. position attention with transformed key and value.
+        Args:
+            query (torch.Tensor): Query tensor (#batch, time1, size), the
+                last time1 frames of the keys.
+            k (torch.Tensor): Transformed key tensor (#batch, n_head, time2, d_k).
+            v (torch.Tensor): Transformed value tensor (#batch, n_head, time2, d_k).
+            pos_emb (torch.Tensor): Positional embedding tensor of the relative
+                positions time2-1 to -(time1-1) (#batch, time2+time1-1, size).
+            mask (torch.Tensor): Mask tensor (#batch, 1, time2) or
+                (#batch, time1, time2).
+        Returns:
+            torch.Tensor: Output tensor (#batch, time1, d_model).
+        """
+        n_batch = query.size(0)
+        q = self.linear_q(query).view(n_batch, -1, self.h, self.d_k)  # (batch, time1, head, d_k)
 
         n_batch_pos = pos_emb.size(0)
         p = self.linear_pos(pos_emb).view(n_batch_pos, -1, self.h, self.d_k)
-        p = p.transpose(1, 2)  # (batch, head, 2*time1-1, d_k)
+        p = p.transpose(1, 2)  # (batch, head, time2+time1-1, d_k)
 
         # (batch, head, time1, d_k)
         q_with_bias_u = (q + self.pos_bias_u).transpose(1, 2)
@@ -269,7 +318,7 @@ class RelPositionMultiHeadedAttention(MultiHeadedAttention):
         matrix_ac = torch.matmul(q_with_bias_u, k.transpose(-2, -1))
 
         # compute matrix b and matrix d
-        # (batch, head, time1, 2*time1-1)
+        # (batch, head, time1, time2+time1-1)
         matrix_bd = torch.matmul(q_with_bias_v, p.transpose(-2, -1))
         matrix_bd = self.rel_shift(matrix_bd)
 
@@ -43,10 +43,11 @@ class ConvolutionModule(nn.Module):
         )
         self.activation = Swish()
 
-    def forward(self, x):
+    def forward(self, x, mask=None):
         """Compute covolution module.
 
         :param torch.Tensor x: (batch, time, size)
+        :param torch.Tensor mask: non-padded frame mask (batch, 1, time)
         :return torch.Tensor: convoluted `value` (batch, time, d_model)
         """
         # exchange the temporal dimension and the feature dimension
@@ -56,6 +57,11 @@ class ConvolutionModule(nn.Module):
         x = self.pointwise_cov1(x)  # (batch, 2*channel, dim)
         x = nn.functional.glu(x, dim=1)  # (batch, channel, dim)
 
+        # zero padded frames so that they act like the 'SAME' padding of a
+        # shorter, unpadded sequence in the depthwise convolution
+        if mask is not None:
+            x = x.masked_fill(~mask, 0.0)
+
         # 1D Depthwise Conv
         x = self.depthwise_conv(x)
         x = self.activation(self.norm(x))
@@ -64,6 +70,39 @@ class ConvolutionModule(nn.Module):
 
         return x.transpose(1, 2)
 
+    def forward_chunk(self, x, cache=None, num_cached=None):
+        """Compute convolution module on the next chunk of a stream.
+
+        The frames before the chunk come from the cache, the frames after it
+        are zero padded as at the end of an utterance.
+
+        :param torch.Tensor x: (batch, time, size)
+        :param torch.Tensor cache: GLU outputs of the (kernel_size - 1) // 2
+            frames before the chunk (batch, channel, (kernel_size - 1) // 2),
+            None at the start of the stream
+        :param int num_cached: frames of x the next chunk follows, all by default
+        :return torch.Tensor: convoluted `value` (batch, time, d_model)
+        :return torch.Tensor: cache for the next chunk
+        """
+        x = x.transpose(1, 2)
+        x = self.pointwise_cov1(x)
+        x = nn.functional.glu(x, dim=1)  # (batch, channel, time)
+
+        padding = self.depthwise_conv.padding[0]
+        if cache is None:
+            cache = x.new_zeros(x.size(0), x.size(1), padding)
+        x = torch.cat([cache, x], dim=2)
+        num_cached = x.size(2) if num_cached is None else padding + num_cached
+        new_cache = x[:, :, num_cached - padding : num_cached]
+
+        # the outputs centered on the cached frames are dropped
+        x = self.depthwise_conv(x)[:, :, padding:]
+        x = self.activation(self.norm(x))
+
+        x = self.pointwise_cov2(x)
+
+        return x.transpose(1, 2), new_cache
+
 
 class Swish(nn.Module):
     """Construct an Swish object."""
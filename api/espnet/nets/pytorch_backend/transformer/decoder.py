@@ -7,17 +7,17 @@
 """Decoder definition."""
 
 from typing import Any
-from typing import List
+from typing import Dict
 from typing import Tuple
 
 import torch
 
+from espnet.nets.pytorch_backend.nets_utils import make_non_pad_mask
 from espnet.nets.pytorch_backend.nets_utils import rename_state_dict
 from espnet.nets.pytorch_backend.transformer.attention import MultiHeadedAttention
 from espnet.nets.pytorch_backend.transformer.decoder_layer import DecoderLayer
 from espnet.nets.pytorch_backend.transformer.embedding import PositionalEncoding
 from espnet.nets.pytorch_backend.transformer.layer_norm import LayerNorm
-from espnet.nets.pytorch_backend.transformer.mask import subsequent_mask
 from espnet.nets.pytorch_backend.transformer.positionwise_feed_forward import (
     PositionwiseFeedForward,  # noqa: H301
 )
@@ -152,28 +152,56 @@ class Decoder(BatchScorerInterface, torch.nn.Module):
             x = self.output_layer(x)
         return x, tgt_mask
 
-    def forward_one_step(self, tgt, tgt_mask, memory, memory_mask=None, cache=None):
+    def embed_one_step(self, tgt):
+        """Embed the newest token of the prefix only.
+        :param torch.Tensor tgt: input token ids, int64 (batch, maxlen_out)
+        :return: embedded newest position (batch, 1, attention_dim)
+        :rtype: torch.Tensor
+        """
+        *layers, pos_enc = self.embed
+        if not isinstance(layers[0], (torch.nn.Embedding, torch.nn.Linear)):
+            # a custom input layer may mix positions, embed the whole prefix
+            return self.embed(tgt)[:, -1:]
+        x = tgt[:, -1:]
+        for layer in layers:
+            x = layer(x)
+        return pos_enc(x, offset=tgt.size(1) - 1)
+
+    def forward_one_step(
+        self, tgt, tgt_mask, memory, memory_mask=None, cache=None, memory_cache=None
+    ):
         """Forward one step.
+
+        Only the newest token is embedded and decoded; the self-attention
+        keys and values of the previous tokens are taken from `cache`.
+
         :param torch.Tensor tgt: input token ids, int64 (batch, maxlen_out)
-        :param torch.Tensor tgt_mask: input token mask,  (batch, maxlen_out)
-                                      dtype=torch.uint8 in PyTorch 1.2-
-                                      dtype=torch.bool in PyTorch 1.2+ (include 1.2)
+        :param torch.Tensor tgt_mask: unused, kept for compatibility
+            (the newest token attends to the whole prefix)
         :param torch.Tensor memory: encoded memory, float32  (batch, maxlen_in, feat)
-        :param List[torch.Tensor] cache:
-            cached output list of (batch, max_time_out-1, size)
+        :param List[Tuple[torch.Tensor, torch.Tensor]] cache:
+            projected self-attention key and value per `self.decoders`,
+            each (batch, head, maxlen_out-1, d_k)
+        :param List[Tuple[torch.Tensor, torch.Tensor]] memory_cache:
+            source-attention key and value per `self.decoders` computed by
+            `project_memory` for n_utt utterances, where the batch is made of
+            n_utt consecutive groups of hypotheses of each utterance;
+            `memory_mask` is then (n_utt, 1, maxlen_in)
         :return y, cache: NN output value and cache per `self.decoders`.
-            `y.shape` is (batch, maxlen_out, token)
-        :rtype: Tuple[torch.Tensor, List[torch.Tensor]]
+            `y.shape` is (batch, token)
+        :rtype: Tuple[torch.Tensor, List[Tuple[torch.Tensor, torch.Tensor]]]
         """
-        x = self.embed(tgt)
+        x = self.embed_one_step(tgt)
         if cache is None:
             cache = [None] * len(self.decoders)
+        if memory_cache is None:
+            memory_cache = [None] * len(self.decoders)
         new_cache = []
-        for c, decoder in zip(cache, self.decoders):
-            x, tgt_mask, memory, memory_mask = decoder(
-                x, tgt_mask, memory, memory_mask, cache=c
+        for c, m, decoder in zip(cache, memory_cache, self.decoders):
+            x, c = decoder.forward_one_step(
+                x, memory, memory_mask, cache=c, memory_cache=m
             )
-            new_cache.append(x)
+            new_cache.append(c)
 
         if self.normalize_before:
             y = self.after_norm(x[:, -1])
@@ -184,46 +212,140 @@ class Decoder(BatchScorerInterface, torch.nn.Module):
 
         return y, new_cache
 
+    def project_memory(self, memory):
+        """Project encoded memory into the source-attention key and value.
+        :param torch.Tensor memory: encoded memory, float32  (batch, maxlen_in, feat)
+        :return: key and value per `self.decoders`, each (batch, head, maxlen_in, d_k)
+        :rtype: List[Tuple[torch.Tensor, torch.Tensor]]
+        """
+        return [
+            decoder.src_attn.forward_kv(memory, memory) for decoder in self.decoders
+        ]
+
     # beam search API (see ScorerInterface)
     def score(self, ys, state, x):
         """Score."""
-        ys_mask = subsequent_mask(len(ys), device=x.device).unsqueeze(0)
         logp, state = self.forward_one_step(
-            ys.unsqueeze(0), ys_mask, x.unsqueeze(0), cache=state
+            ys.unsqueeze(0), None, x.unsqueeze(0), cache=state
         )
         return logp.squeeze(0), state
 
     # batch beam search API (see BatchScorerInterface)
+    def batch_init_state(self, x: torch.Tensor) -> Any:
+        """Get an initial batched state.
+
+        The source-attention key and value of `x` are projected here once
+        and shared by all the hypotheses during the search.
+
+        Args:
+            x (torch.Tensor): The encoded feature tensor (xlen, n_feat)
+
+        Returns: dict of the self-attention cache (None until the first step),
+            the source-attention key and value with batch size 1
+            and the memory mask (None)
+
+        """
+        return dict(
+            cache=None,
+            memory_cache=self.project_memory(x.unsqueeze(0)),
+            memory_mask=None,
+        )
+
+    def batch_init_state_padded(self, xs: torch.Tensor, xlens: torch.Tensor) -> Any:
+        """Get an initial batched state for decoding several utterances.
+
+        Args:
+            xs (torch.Tensor): The padded encoded feature tensor (n_utt, xlen, n_feat)
+            xlens (torch.Tensor): The lengths of the encoded features (n_utt,)
+
+        Returns: same as `batch_init_state` with n_utt utterances
+
+        """
+        return dict(
+            cache=None,
+            memory_cache=self.project_memory(xs),
+            memory_mask=make_non_pad_mask(xlens, xs[:, :, 0]).unsqueeze(-2),
+        )
+
+    def batch_extend_state(
+        self, ys: torch.Tensor, states: Dict[str, Any], x: torch.Tensor
+    ) -> Dict[str, Any]:
+        """Let the batched states attend to a longer encoder output.
+
+        The memory is projected again, and the self-attention cache of the
+        prefix is recomputed with it, one position at a time as in decoding.
+
+        Args:
+            ys (torch.Tensor): torch.int64 prefix tokens (n_batch, ylen).
+            states (Dict[str, Any]): states from `batch_score`.
+            x (torch.Tensor): The encoder output so far (xlen, n_feat).
+
+        Returns: states for ys and x, as from `batch_score`
+
+        """
+        new_states = self.batch_init_state(x)
+        if states["cache"] is None:
+            return new_states
+        xs = x.expand(ys.size(0), *x.shape)
+        cache = None
+        for i in range(1, ys.size(1)):
+            _, cache = self.forward_one_step(
+                ys[:, :i],
+                None,
+                xs,
+                cache=cache,
+                memory_cache=new_states["memory_cache"],
+            )
+        return dict(new_states, cache=cache)
+
     def batch_score(
-        self, ys: torch.Tensor, states: List[Any], xs: torch.Tensor
-    ) -> Tuple[torch.Tensor, List[Any]]:
+        self, ys: torch.Tensor, states: Dict[str, Any], xs: torch.Tensor
+    ) -> Tuple[torch.Tensor, Dict[str, Any]]:
         """Score new token batch (required).
         Args:
             ys (torch.Tensor): torch.int64 prefix tokens (n_batch, ylen).
-            states (List[Any]): Scorer states for prefix tokens.
+            states (Dict[str, Any]): "cache" is the self-attention key and value
+                of each decoder layer, (n_batch, head, ylen - 1, d_k),
+                or None for the first step, and "memory_cache" and "memory_mask"
+                the source-attention key and value of each decoder layer
+                and their mask from `batch_init_state`.
             xs (torch.Tensor):
-                The encoder feature that generates ys (n_batch, xlen, n_feat).
+                The encoder feature that generates ys (n_batch, xlen, n_feat),
+                unused when the state holds a "memory_cache".
         Returns:
-            tuple[torch.Tensor, List[Any]]: Tuple of
+            tuple[torch.Tensor, Dict[str, Any]]: Tuple of
                 batchfied scores for next token with shape of `(n_batch, n_vocab)`
-                and next state list for ys.
+                and next states.
         """
-        # merge states
-        n_batch = len(ys)
-        n_layers = len(self.decoders)
-        if states[0] is None:
-            batch_state = None
-        else:
-            # transpose state of [batch, layer] into [layer, batch]
-            batch_state = [
-                torch.stack([states[b][l] for b in range(n_batch)])
-                for l in range(n_layers)
-            ]
-
-        # batch decoding
-        ys_mask = subsequent_mask(ys.size(-1), device=xs.device).unsqueeze(0)
-        logp, states = self.forward_one_step(ys, ys_mask, xs, cache=batch_state)
-
-        # transpose state of [layer, batch] into [batch, layer]
-        state_list = [[states[l][b] for l in range(n_layers)] for b in range(n_batch)]
-        return logp, state_list
+        logp, cache = self.forward_one_step(
+            ys,
+            None,
+            xs,
+            memory_mask=states["memory_mask"],
+            cache=states["cache"],
+            memory_cache=states["memory_cache"],
+        )
+        return logp, dict(states, cache=cache)
+
+    def batch_src_attention(self) -> torch.Tensor:
+        """Get the source attention weights of the last `batch_score` call.
+
+        Returns:
+            torch.Tensor: The attention weights of the last decoder layer
+                averaged over the heads (n_batch, xlen).
+
+        """
+        attn = self.decoders[-1].src_attn.attn
+        return attn.mean(1).reshape(-1, attn.size(-1))
+
+    def batch_select_state(
+        self, states: Dict[str, Any], ids: torch.Tensor, new_ids=None
+    ) -> Dict[str, Any]:
+        """Select the cached keys and values of hypotheses `ids`."""
+        if states["cache"] is None:
+            return states
+        cache = [
+            (k.index_select(0, ids), v.index_select(0, ids))
+            for k, v in states["cache"]
+        ]
+        return dict(states, cache=cache)
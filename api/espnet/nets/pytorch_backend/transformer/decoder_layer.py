@@ -119,3 +119,73 @@ class DecoderLayer(nn.Module):
             x = torch.cat([cache, x], dim=1)
 
         return x, tgt_mask, memory, memory_mask
+
+    def forward_one_step(
+        self, tgt, memory, memory_mask=None, cache=None, memory_cache=None
+    ):
+        """Compute decoded features of the newest position only.
+        Args:
+            tgt (torch.Tensor): decoded features of the newest position (batch, 1, size)
+            memory (torch.Tensor): encoded source features (batch, max_time_in, size)
+            memory_mask (torch.Tensor): mask for memory (batch, 1, max_time_in)
+            cache (Tuple[torch.Tensor, torch.Tensor]): projected self-attention
+                key and value of the previous positions
+                (batch, head, max_time_out-1, d_k)
+            memory_cache (Tuple[torch.Tensor, torch.Tensor]): source-attention key
+                and value projected from memory once per utterance,
+                (n_utt, head, max_time_in, d_k); memory is unused if given,
+                and the batch is taken as n_utt consecutive groups of hypotheses
+                sharing the memory of one utterance
+        Returns:
+            torch.Tensor: decoded features of the newest position (batch, 1, size)
+            Tuple[torch.Tensor, torch.Tensor]: projected self-attention key and
+                value including the newest position (batch, head, max_time_out, d_k)
+        """
+        residual = tgt
+        if self.normalize_before:
+            tgt = self.norm1(tgt)
+
+        k, v = self.self_attn.forward_kv(tgt, tgt)
+        if cache is not None:
+            k = torch.cat([cache[0], k], dim=2)
+            v = torch.cat([cache[1], v], dim=2)
+        # the newest position attends to the whole prefix, so no mask is needed
+        if self.concat_after:
+            tgt_concat = torch.cat(
+                (tgt, self.self_attn.forward_cached_kv(tgt, k, v, None)), dim=-1
+            )
+            x = residual + self.concat_linear1(tgt_concat)
+        else:
+            x = residual + self.dropout(
+                self.self_attn.forward_cached_kv(tgt, k, v, None)
+            )
+        if not self.normalize_before:
+            x = self.norm1(x)
+
+        residual = x
+        if self.normalize_before:
+            x = self.norm2(x)
+        if memory_cache is None:
+            src_attn = self.src_attn(x, memory, memory, memory_mask)
+        else:
+            # attend with all the hypotheses of an utterance at once
+            n_utt = memory_cache[0].size(0)
+            src_attn = self.src_attn.forward_cached_kv(
+                x.reshape(n_utt, -1, self.size), *memory_cache, memory_mask
+            ).view(x.shape)
+        if self.concat_after:
+            x_concat = torch.cat((x, src_attn), dim=-1)
+            x = residual + self.concat_linear2(x_concat)
+        else:
+            x = residual + self.dropout(src_attn)
+        if not self.normalize_before:
+            x = self.norm2(x)
+
+        residual = x
+        if self.normalize_before:
+            x = self.norm3(x)
+        x = residual + self.dropout(self.feed_forward(x))
+        if not self.normalize_before:
+            x = self.norm3(x)
+
+        return x, (k, v)
@@ -52,20 +52,21 @@ class PositionalEncoding(torch.nn.Module):
         self.extend_pe(torch.tensor(0.0).expand(1, max_len))
         self._register_load_state_dict_pre_hook(_pre_hook)
 
-    def extend_pe(self, x):
+    def extend_pe(self, x, offset=0):
         """Reset the positional encodings."""
+        length = x.size(1) + offset
         if self.pe is not None:
-            if self.pe.size(1) >= x.size(1):
+            if self.pe.size(1) >= length:
                 if self.pe.dtype != x.dtype or self.pe.device != x.device:
                     self.pe = self.pe.to(dtype=x.dtype, device=x.device)
                 return
-        pe = torch.zeros(x.size(1), self.d_model)
+        pe = torch.zeros(length, self.d_model)
         if self.reverse:
             position = torch.arange(
-                x.size(1) - 1, -1, -1.0, dtype=torch.float32
+                length - 1, -1, -1.0, dtype=torch.float32
             ).unsqueeze(1)
         else:
-            position = torch.arange(0, x.size(1), dtype=torch.float32).unsqueeze(1)
+            position = torch.arange(0, length, dtype=torch.float32).unsqueeze(1)
         div_term = torch.exp(
             torch.arange(0, self.d_model, 2, dtype=torch.float32)
             * -(math.log(10000.0) / self.d_model)
@@ -75,15 +76,16 @@ class PositionalEncoding(torch.nn.Module):
         pe = pe.unsqueeze(0)
         self.pe = pe.to(device=x.device, dtype=x.dtype)
 
-    def forward(self, x: torch.Tensor):
+    def forward(self, x: torch.Tensor, offset: int = 0):
         """Add positional encoding.
         Args:
             x (torch.Tensor): Input tensor (batch, time, `*`).
+            offset (int): Position of the first frame of x.
         Returns:
             torch.Tensor: Encoded tensor (batch, time, `*`).
         """
-        self.extend_pe(x)
-        x = x * self.xscale + self.pe[:, : x.size(1)]
+        self.extend_pe(x, offset)
+        x = x * self.xscale + self.pe[:, offset : offset + x.size(1)]
         return self.dropout(x)
 
 
@@ -105,15 +107,16 @@ class ScaledPositionalEncoding(PositionalEncoding):
         """Reset parameters."""
         self.alpha.data = torch.tensor(1.0)
 
-    def forward(self, x):
+    def forward(self, x, offset=0):
         """Add positional encoding.
         Args:
             x (torch.Tensor): Input tensor (batch, time, `*`).
+            offset (int): Position of the first frame of x.
         Returns:
             torch.Tensor: Encoded tensor (batch, time, `*`).
         """
-        self.extend_pe(x)
-        x = x + self.alpha * self.pe[:, : x.size(1)]
+        self.extend_pe(x, offset)
+        x = x + self.alpha * self.pe[:, offset : offset + x.size(1)]
         return self.dropout(x)
 
 
@@ -201,17 +204,21 @@ class RelPositionalEncoding(torch.nn.Module):
         pe = torch.cat([pe_positive, pe_negative], dim=1)
         self.pe = pe.to(device=x.device, dtype=x.dtype)
 
-    def forward(self, x: torch.Tensor):
+    def forward(self, x: torch.Tensor, cache_len: int = 0):
         """Add positional encoding.
         Args:
             x (torch.Tensor): Input tensor (batch, time, `*`).
+            cache_len (int): Number of cached frames before x that are
+                attended to as well, e.g. when encoding a stream chunk by chunk.
         Returns:
             torch.Tensor: Encoded tensor (batch, time, `*`).
+            torch.Tensor: Positional embedding tensor of the relative positions
+                cache_len+time-1 to -(time-1) (1, cache_len+2*time-1, `*`).
         """
-        self.extend_pe(x)
+        self.extend_pe(x.new_empty(1, cache_len + x.size(1)))
         x = x * self.xscale
         pos_emb = self.pe[
             :,
-            self.pe.size(1) // 2 - x.size(1) + 1 : self.pe.size(1) // 2 + x.size(1),
+            self.pe.size(1) // 2 - cache_len - x.size(1) + 1 : self.pe.size(1) // 2 + x.size(1),
         ]
         return self.dropout(x), self.dropout(pos_emb)
@@ -227,16 +227,21 @@ class Encoder(torch.nn.Module):
         if self.normalize_before:
             self.after_norm = LayerNorm(attention_dim)
 
-    def forward(self, xs, masks, extract_resnet_feats=False):
+    def forward(self, xs, masks, extract_resnet_feats=False, frontend_cache=None, start=0):
         """Encode input sequence.
 
         :param torch.Tensor xs: input tensor
         :param torch.Tensor masks: input mask
         :param str extract_features: the position for feature extraction
+        :param FrontendCache frontend_cache: front-end features of the last
+            window of the stream xs is a window of, see FrontendCache
+        :param int start: index of the first frame of xs in that stream
         :return: position embedded tensor and mask
         :rtype Tuple[torch.Tensor, torch.Tensor]:
         """
-        if isinstance(self.frontend, (Conv1dResNet, Conv3dResNet)):
+        if frontend_cache is not None:
+            xs = frontend_cache(xs, start)
+        elif isinstance(self.frontend, (Conv1dResNet, Conv3dResNet)):
             xs = self.frontend(xs)
         if extract_resnet_feats:
             return xs
@@ -281,3 +286,42 @@ class Encoder(torch.nn.Module):
         if self.normalize_before:
             xs = self.after_norm(xs)
         return xs, masks, new_cache
+
+    def forward_chunk(self, xs, cache=None, left_context=64, num_cached=None):
+        """Encode the next chunk of a stream with the cached left context.
+
+        Every layer attends to the keys and values it cached for the last
+        `left_context` frames before the chunk, so the cost of a chunk does not
+        grow with the length of the stream.
+
+        :param torch.Tensor xs: front-end features of the chunk (batch, time, idim)
+        :param dict cache: cache returned for the previous chunk, None at the start
+        :param int left_context: frames before the chunk every layer attends to
+        :param int num_cached: frames of xs the next chunk follows, all by
+            default, the others are the lookahead of this chunk
+        :return: encoded chunk (batch, time, attention_dim) and the new cache
+        :rtype Tuple[torch.Tensor, dict]:
+        """
+        assert isinstance(self.embed, torch.nn.Sequential), (
+            "streaming is only supported after a per-frame front-end"
+        )
+        pos_enc = self.embed[-1]
+        if isinstance(pos_enc, LegacyRelPositionalEncoding):
+            raise NotImplementedError("streaming does not support legacy_rel_mha")
+        num_cached = xs.size(1) if num_cached is None else num_cached
+        if cache is None:
+            cache = {"offset": 0, "layers": [None] * len(self.encoders)}
+        xs = self.embed[:-1](xs)
+        if isinstance(pos_enc, RelPositionalEncoding):
+            layer_cache = cache["layers"][0]
+            xs, pos_emb = pos_enc(xs, 0 if layer_cache is None else layer_cache[0].size(2))
+        else:
+            xs, pos_emb = pos_enc(xs, cache["offset"]), None
+
+        new_cache = {"offset": cache["offset"] + num_cached, "layers": []}
+        for c, e in zip(cache["layers"], self.encoders):
+            xs, c = e.forward_chunk(xs, pos_emb, c, left_context, num_cached)
+            new_cache["layers"].append(c)
+        if self.normalize_before:
+            xs = self.after_norm(xs)
+        return xs, new_cache
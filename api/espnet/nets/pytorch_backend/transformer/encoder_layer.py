@@ -125,7 +125,9 @@ class EncoderLayer(nn.Module):
             residual = x
             if self.normalize_before:
                 x = self.norm_conv(x)
-            x = residual + self.dropout(self.conv_module(x))
+            x = residual + self.dropout(
+                self.conv_module(x, mask if cache is None else None)
+            )
             if not self.normalize_before:
                 x = self.norm_conv(x)
 
@@ -147,3 +149,84 @@ class EncoderLayer(nn.Module):
             return (x, pos_emb), mask
         else:
             return x, mask
+
+    def forward_chunk(self, x, pos_emb=None, cache=None, left_context=0, num_cached=None):
+        """Compute encoded features of the next chunk of a stream.
+
+        The chunk attends to the keys and values of the last `left_context`
+        frames before it, and to itself.
+
+        :param torch.Tensor x: encoded source features of the chunk (batch, time, size)
+        :param torch.Tensor pos_emb: relative positional embedding of the
+            chunk and its left context, None with absolute positions
+        :param tuple cache: transformed keys and values of the frames before
+            the chunk (batch, head, cached, d_k) and the cache of the
+            convolution module, None at the start of the stream
+        :param int left_context: frames whose keys and values are kept
+        :param int num_cached: frames of x the next chunk follows, all by
+            default, the others are its lookahead and are encoded again
+        :return torch.Tensor: encoded features (batch, time, size)
+        :return tuple: cache for the next chunk
+        """
+        num_cached = x.size(1) if num_cached is None else num_cached
+
+        # whether to use macaron style
+        if self.macaron_style:
+            residual = x
+            if self.normalize_before:
+                x = self.norm_ff_macaron(x)
+            x = residual + self.ff_scale * self.dropout(self.feed_forward_macaron(x))
+            if not self.normalize_before:
+                x = self.norm_ff_macaron(x)
+
+        # multi-headed self-attention module over the cached keys and values
+        residual = x
+        if self.normalize_before:
+            x = self.norm_mha(x)
+
+        k, v = self.self_attn.forward_kv(x, x)
+        if cache is not None:
+            k = torch.cat([cache[0], k], dim=2)
+            v = torch.cat([cache[1], v], dim=2)
+        num_keys = k.size(2) - x.size(1) + num_cached
+        new_k = k[:, :, max(num_keys - left_context, 0) : num_keys]
+        new_v = v[:, :, max(num_keys - left_context, 0) : num_keys]
+
+        if pos_emb is not None:
+            x_att = self.self_attn.forward_cached_kv(x, k, v, pos_emb, None)
+        else:
+            x_att = self.self_attn.forward_cached_kv(x, k, v, None)
+
+        if self.concat_after:
+            x_concat = torch.cat((x, x_att), dim=-1)
+            x = residual + self.concat_linear(x_concat)
+        else:
+            x = residual + self.dropout(x_att)
+        if not self.normalize_before:
+            x = self.norm_mha(x)
+
+        # convolution module
+        conv_cache = None
+        if self.conv_module is not None:
+            residual = x
+            if self.normalize_before:
+                x = self.norm_conv(x)
+            x_conv, conv_cache = self.conv_module.forward_chunk(
+                x, None if cache is None else cache[2], num_cached
+            )
+            x = residual + self.dropout(x_conv)
+            if not self.normalize_before:
+                x = self.norm_conv(x)
+
+        # feed forward module
+        residual = x
+        if self.normalize_before:
+            x = self.norm_ff(x)
+        x = residual + self.ff_scale * self.dropout(self.feed_forward(x))
+        if not self.normalize_before:
+            x = self.norm_ff(x)
+
+        if self.conv_module is not None:
+            x = self.norm_final(x)
+
+        return x, (new_k, new_v, conv_cache)
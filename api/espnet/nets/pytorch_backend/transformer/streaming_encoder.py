@@ -0,0 +1,101 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+#  Apache 2.0  (http://www.apache.org/licenses/LICENSE-2.0)
+
+"""Chunk-wise streaming of the visual transformer encoder."""
+
+import torch
+
+from espnet.nets.pytorch_backend.backbones.conv3d_extractor import Conv3dResNet
+
+
+class StreamingEncoder(object):
+    """Encode a video stream chunk by chunk with a bounded left context.
+
+    New frames go through the visual front-end as they arrive. Its only
+    temporal operation is the first 3D convolution, so a frame is final once
+    the frames its kernel reaches are known, and the last few raw frames are
+    kept to compute the next ones exactly. The front-end features are then
+    encoded in chunks of `chunk_size` frames, each seeing `right_context`
+    frames ahead of it and, in every layer, the cached keys, values and
+    convolution inputs of the `left_context` frames before it. Memory and
+    compute per frame are bounded by these three sizes, not by the length
+    of the stream.
+
+    :param Encoder encoder: encoder with a Conv3dResNet front-end
+    :param int chunk_size: frames encoded at once
+    :param int left_context: frames before a chunk its layers attend to
+    :param int right_context: frames after a chunk it is encoded with
+    """
+
+    def __init__(self, encoder, chunk_size=16, left_context=64, right_context=0):
+        """Construct a StreamingEncoder object."""
+        assert isinstance(encoder.frontend, Conv3dResNet), (
+            "streaming is only supported with the visual front-end"
+        )
+        self.encoder = encoder
+        self.chunk_size = chunk_size
+        self.left_context = left_context
+        self.right_context = right_context
+        # frames on each side of a frame the front-end looks at
+        self.frontend_context = encoder.frontend.frontend3D[0].padding[0]
+        self.frames = None  # raw frames from `num_frames - len(frames)` on
+        self.num_frames = 0
+        self.num_features = 0  # front-end features computed so far
+        self.features = None  # front-end features not encoded yet
+        self.cache = None
+
+    def __call__(self, xs, is_final=False):
+        """Encode new frames.
+
+        :param torch.Tensor xs: new frames of the stream (C, T, H, W), None if
+            the stream ends without new frames
+        :param bool is_final: whether the stream ends with them
+        :return: encoder outputs of the frames that became final (T', attention_dim)
+        :rtype: torch.Tensor
+        """
+        adim = self.encoder.embed[0].out_features
+        if xs is not None:
+            xs = torch.as_tensor(xs).unsqueeze(0)
+            self.frames = xs if self.frames is None else torch.cat([self.frames, xs], dim=2)
+            self.num_frames += xs.size(2)
+        if self.frames is None:
+            return torch.zeros(0, adim)
+        feats = self.frontend(is_final)
+        if feats is not None:
+            self.features = feats if self.features is None else torch.cat([self.features, feats], dim=1)
+
+        outputs = []
+        while self.features is not None and self.features.size(1) > 0:
+            if self.features.size(1) >= self.chunk_size + self.right_context:
+                num_ready = self.chunk_size
+            elif is_final:
+                # the last chunks get the lookahead that is left
+                num_ready = min(self.chunk_size, self.features.size(1))
+            else:
+                break
+            xs_chunk = self.features[:, : num_ready + self.right_context]
+            ys, self.cache = self.encoder.forward_chunk(
+                xs_chunk, self.cache, self.left_context, num_ready
+            )
+            outputs.append(ys[:, :num_ready])
+            self.features = self.features[:, num_ready:]
+        if not outputs:
+            return self.frames.new_zeros(0, adim)
+        return torch.cat(outputs, dim=1).squeeze(0)
+
+    def frontend(self, is_final=False):
+        """Front-end features of the frames whose temporal context is complete."""
+        context = self.frontend_context
+        first = self.num_frames - self.frames.size(2)
+        # features of frames from `num_features` to `stop`
+        stop = self.num_frames if is_final else self.num_frames - context
+        if stop <= self.num_features:
+            return None
+        # the convolution zero pads the frames before the first and after the last one
+        feats = self.encoder.frontend(self.frames)
+        feats = feats[:, self.num_features - first : stop - first]
+        self.num_features = stop
+        self.frames = self.frames[:, :, max(stop - context, 0) - first :]
+        return feats
@@ -86,15 +86,71 @@ class BatchScorerInterface(ScorerInterface):
     """Batch scorer interface."""
 
     def batch_init_state(self, x: torch.Tensor) -> Any:
-        """Get an initial state for decoding (optional).
+        """Get an initial batched state for decoding (optional).
 
         Args:
             x (torch.Tensor): The encoded feature tensor
 
-        Returns: initial state
+        Returns: batched state of the single initial hypothesis
+
+        """
+        return [self.init_state(x)]
+
+    def batch_init_state_padded(self, xs: torch.Tensor, xlens: torch.Tensor) -> Any:
+        """Get an initial batched state for decoding several utterances (optional).
+
+        Args:
+            xs (torch.Tensor): The padded encoded feature tensor (n_utt, xlen, n_feat)
+            xlens (torch.Tensor): The lengths of the encoded features (n_utt,)
+
+        Returns: batched state of the initial hypotheses, one per utterance
 
         """
-        return self.init_state(x)
+        return [self.init_state(x[:xlen]) for x, xlen in zip(xs, xlens.tolist())]
+
+    def batch_select_state(
+        self, states: Any, ids: torch.Tensor, new_ids: torch.Tensor = None
+    ) -> Any:
+        """Select batched states with hypothesis ids in the batch beam search.
+
+        The default implementation handles a list of per-hypothesis states.
+        Scorers that keep their states as tensors should override it
+        with `index_select`/`gather` over the hypothesis dimension.
+
+        Args:
+            states: Batched scorer states returned by `batch_score`
+            ids (torch.Tensor): torch.int64 hypothesis ids to select (n_best,)
+            new_ids (torch.Tensor): torch.int64 new label ids (n_best,)
+                to select a state if necessary
+
+        Returns:
+            states: selected batched states
+
+        """
+        if new_ids is None:
+            return [self.select_state(states, i) for i in ids.tolist()]
+        return [
+            self.select_state(states, i, j)
+            for i, j in zip(ids.tolist(), new_ids.tolist())
+        ]
+
+    def batch_extend_state(self, ys: torch.Tensor, states: Any, x: torch.Tensor) -> Any:
+        """Extend batched states to a longer encoder output in streaming decoding.
+
+        The default implementation returns the states as they are, which is
+        right for scorers that do not look at the encoder output (e.g. LMs).
+
+        Args:
+            ys (torch.Tensor): torch.int64 prefix tokens (n_batch, ylen).
+            states: Batched scorer states for prefix tokens.
+            x (torch.Tensor): The encoder output so far (xlen, n_feat), whose
+                first frames are those the states were computed on.
+
+        Returns:
+            states: batched states for ys and x
+
+        """
+        return states
 
     def batch_score(
         self, ys: torch.Tensor, states: List[Any], xs: torch.Tensor
@@ -103,14 +159,16 @@ class BatchScorerInterface(ScorerInterface):
 
         Args:
             ys (torch.Tensor): torch.int64 prefix tokens (n_batch, ylen).
-            states (List[Any]): Scorer states for prefix tokens.
+            states (List[Any]): Batched scorer states for prefix tokens.
             xs (torch.Tensor):
-                The encoder feature that generates ys (n_batch, xlen, n_feat).
+                The encoder feature that generates ys (n_batch, xlen, n_feat),
+                or (n_utt, xlen, n_feat) when `n_batch // n_utt` consecutive
+                hypotheses share the feature of their utterance.
 
         Returns:
             tuple[torch.Tensor, List[Any]]: Tuple of
                 batchfied scores for next token with shape of `(n_batch, n_vocab)`
-                and next state list for ys.
+                and next batched states for ys.
 
         """
         warnings.warn(
@@ -120,8 +178,9 @@ class BatchScorerInterface(ScorerInterface):
         )
         scores = list()
         outstates = list()
-        for i, (y, state, x) in enumerate(zip(ys, states, xs)):
-            score, outstate = self.score(y, state, x)
+        n_hyps = len(ys) // len(xs)
+        for i, (y, state) in enumerate(zip(ys, states)):
+            score, outstate = self.score(y, state, xs[i // n_hyps])
             outstates.append(outstate)
             scores.append(score)
         scores = torch.cat(scores, 0).view(ys.shape[0], -1)
@@ -11,17 +11,37 @@ from espnet.nets.scorer_interface import BatchPartialScorerInterface
 class CTCPrefixScorer(BatchPartialScorerInterface):
     """Decoder interface wrapper for CTCPrefixScore."""
 
-    def __init__(self, ctc: torch.nn.Module, eos: int):
+    def __init__(
+        self,
+        ctc: torch.nn.Module,
+        eos: int,
+        forward_impl: str = "python",
+        margin: int = 0,
+        decoder: torch.nn.Module = None,
+    ):
         """Initialize class.
 
         Args:
             ctc (torch.nn.Module): The CTC implementation.
                 For example, :class:`espnet.nets.pytorch_backend.ctc.CTC`
             eos (int): The end-of-sequence id.
+            forward_impl (str): Implementation of the CTC forward recursion
+                in batch decoding, "python", "script" or "numpy".
+                See :class:`espnet.nets.ctc_prefix_score.CTCPrefixScoreTH`
+            margin (int): Margin in frames around the frames attended by
+                `decoder` to run the CTC forward recursion over in batch
+                decoding (0 means no windowing)
+            decoder (torch.nn.Module): The attention decoder scored before CTC,
+                which provides `batch_src_attention`. Required if margin > 0.
 
         """
+        if margin > 0 and decoder is None:
+            raise ValueError("CTC windowing requires the attention decoder")
         self.ctc = ctc
         self.eos = eos
+        self.forward_impl = forward_impl
+        self.margin = margin
+        self.decoder = decoder
         self.impl = None
 
     def init_state(self, x: torch.Tensor):
@@ -96,7 +116,25 @@ class CTCPrefixScorer(BatchPartialScorerInterface):
         """
         logp = self.ctc.log_softmax(x.unsqueeze(0))  # assuming batch_size = 1
         xlen = torch.tensor([logp.size(1)])
-        self.impl = CTCPrefixScoreTH(logp, xlen, 0, self.eos)
+        self.impl = CTCPrefixScoreTH(
+            logp, xlen, 0, self.eos, self.margin, forward_impl=self.forward_impl
+        )
+        return None
+
+    def batch_init_state_padded(self, xs: torch.Tensor, xlens: torch.Tensor):
+        """Get an initial state for decoding several utterances.
+
+        Args:
+            xs (torch.Tensor): The padded encoded feature tensor (n_utt, xlen, n_feat)
+            xlens (torch.Tensor): The lengths of the encoded features (n_utt,)
+
+        Returns: initial state
+
+        """
+        logp = self.ctc.log_softmax(xs)
+        self.impl = CTCPrefixScoreTH(
+            logp, xlens, 0, self.eos, self.margin, forward_impl=self.forward_impl
+        )
         return None
 
     def batch_score_partial(self, y, ids, state, x):
@@ -105,7 +143,8 @@ class CTCPrefixScorer(BatchPartialScorerInterface):
         Args:
             y (torch.Tensor): 1D prefix token
             ids (torch.Tensor): torch.int64 next token to score
-            state: decoder state for prefix tokens
+            state: batched decoder state for prefix tokens
+                `(r, s, f_min, f_max)`, or None for the first step
             x (torch.Tensor): 2D encoder feature that generates ys
 
         Returns:
@@ -114,17 +153,35 @@ class CTCPrefixScorer(BatchPartialScorerInterface):
                 and next state for ys
 
         """
-        batch_state = (
-            (
-                torch.stack([s[0] for s in state], dim=2),
-                torch.stack([s[1] for s in state]),
-                state[0][2],
-                state[0][3],
-            )
-            if state[0] is not None
-            else None
-        )
-        return self.impl(y, batch_state, ids)
+        att_w = self.decoder.batch_src_attention() if self.margin > 0 else None
+        return self.impl(y, state, ids, att_w)
+
+    def batch_select_state(self, state, ids, new_ids=None):
+        """Select batched CTC states with hypothesis ids.
+
+        Args:
+            state: CTC state `(r, log_psi, f_min, f_max, scoring_idmap)` returned
+                by `batch_score_partial` if `new_ids` is given,
+                otherwise an already selected state `(r, s, f_min, f_max)`
+            ids (torch.Tensor): torch.int64 hypothesis ids (n_best,)
+            new_ids (torch.Tensor): torch.int64 new label ids (n_best,)
+
+        Returns:
+            state: selected state `(r, s, f_min, f_max)`,
+                r: (T, 2, n_best), s: (n_best, O)
+
+        """
+        if state is None:
+            return None
+        if new_ids is None:
+            r, s, f_min, f_max = state
+            return r[:, :, ids], s[ids], f_min, f_max
+        r, log_psi, f_min, f_max, scoring_idmap = state
+        s = log_psi[ids, new_ids].unsqueeze(1).expand(-1, log_psi.size(1))
+        if scoring_idmap is not None:
+            return r[:, :, ids, scoring_idmap[ids, new_ids]], s, f_min, f_max
+        else:
+            return r[:, :, ids, new_ids], s, f_min, f_max
 
     def extend_prob(self, x: torch.Tensor):
         """Extend probs for decoding.
@@ -139,20 +196,38 @@ class CTCPrefixScorer(BatchPartialScorerInterface):
         logp = self.ctc.log_softmax(x.unsqueeze(0))
         self.impl.extend_prob(logp)
 
-    def extend_state(self, state):
+    def extend_state(self, state, last_ids=None):
         """Extend state for decoding.
 
         This extension is for streaming decoding
         as in Eq (14) in https://arxiv.org/abs/2006.14941
 
         Args:
-            state: The states of hyps
+            state: The states of hyps, a list of states of single hyps
+                or the batched state `(r, s, f_min, f_max)`
+            last_ids (torch.Tensor): last label ids of the batched hyps
 
         Returns: exteded state
 
         """
+        if state is None or isinstance(state, tuple):
+            return self.impl.extend_state(state, last_ids)
         new_state = []
         for s in state:
             new_state.append(self.impl.extend_state(s))
 
         return new_state
+
+    def batch_extend_state(self, ys, state, x):
+        """Extend the posteriors and the batched states to x.
+
+        Args:
+            ys (torch.Tensor): torch.int64 prefix tokens (n_batch, ylen)
+            state: batched state `(r, s, f_min, f_max)`, or None
+            x (torch.Tensor): The encoder output so far (xlen, n_feat)
+
+        Returns: extended state
+
+        """
+        self.extend_prob(x)
+        return self.extend_state(state, ys[:, -1])
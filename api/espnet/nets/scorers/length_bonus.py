@@ -36,6 +36,18 @@ class LengthBonus(BatchScorerInterface):
         """
         return torch.tensor([1.0], device=x.device, dtype=x.dtype).expand(self.n), None
 
+    def batch_init_state(self, x: torch.Tensor) -> Any:
+        """Get an initial batched state (length bonus is stateless)."""
+        return None
+
+    def batch_init_state_padded(self, xs: torch.Tensor, xlens: torch.Tensor) -> Any:
+        """Get an initial state for several utterances (see `batch_init_state`)."""
+        return None
+
+    def batch_select_state(self, states: Any, ids: torch.Tensor, new_ids=None) -> Any:
+        """Select batched states (length bonus is stateless)."""
+        return None
+
     def batch_score(
         self, ys: torch.Tensor, states: List[Any], xs: torch.Tensor
     ) -> Tuple[torch.Tensor, List[Any]]:
@@ -39,6 +39,9 @@ def benchmark_inference(inference_pipeline, data_dir, landmarks_dir, lines, data
         landmarks_filename = os.path.join(landmarks_dir, f"{basename}{landmarks_ext}") if landmarks_dir else None
         output = inference_pipeline(data_filename, landmarks_filename)
 
+        if inference_pipeline.long_form:
+            for segment in inference_pipeline.segments:
+                print(f"[{segment['start']:8.2f} - {segment['end']:8.2f}] {segment['text']}")
         print(f"hyp: {output}\nref: {groundtruth}" if groundtruth is not None else "")
         if groundtruth is not None:
             wer.update(get_wer(output, groundtruth), len(groundtruth.split()))
@@ -49,10 +52,12 @@ def benchmark_inference(inference_pipeline, data_dir, landmarks_dir, lines, data
 @hydra.main(version_base=None, config_path="hydra_configs", config_name="default")
 def main(cfg):
     device = torch.device(f"cuda:{cfg.gpu_idx}") if torch.cuda.is_available() and cfg.gpu_idx >= 0 else "cpu"
-    inference_pipeline = InferencePipeline(config_filename=cfg.config_filename, detector=cfg.detector, face_track=not cfg.landmarks_filename and not cfg.landmarks_dir, device=device)
+    inference_pipeline = InferencePipeline(config_filename=cfg.config_filename, detector=cfg.detector, face_track=not cfg.landmarks_filename and not cfg.landmarks_dir, device=device, keyframe_interval=cfg.keyframe_interval, downscale=cfg.downscale, roi_margin=cfg.roi_margin, lmeds_threshold=cfg.lmeds_threshold, gate=cfg.gate, min_motion=cfg.min_motion, long_form=cfg.long_form, max_segment_frames=cfg.max_segment_frames, min_segment_frames=cfg.min_segment_frames, segment_batch_size=cfg.segment_batch_size)
     assert os.path.isdir(cfg.data_dir), f"{cfg.data_dir} is not a directory."
     assert os.path.isfile(cfg.labels_filename), f"{cfg.labels_filename} does not exist."
     benchmark_inference(inference_pipeline, cfg.data_dir, cfg.landmarks_dir, open(cfg.labels_filename).read().splitlines(), cfg.data_ext, cfg.landmarks_ext)
+    if hasattr(inference_pipeline.landmarks_detector, "hit_rates"):
+        print("detector tier hit rates: " + "\t".join(f"{tier}: {rate*100:.2f}%" for tier, rate in inference_pipeline.landmarks_detector.hit_rates().items()))
 
 
 if __name__ == '__main__':
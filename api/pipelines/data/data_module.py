@@ -4,44 +4,82 @@
 # Copyright 2023 Imperial College London (Pingchuan Ma)
 # Apache 2.0  (http://www.apache.org/licenses/LICENSE-2.0)
 
+import numpy as np
 import torch
 import torchaudio
 import torchvision
+from .media import iter_video, read_media, silent_audio
 from .transforms import AudioTransform, VideoTransform
 
 
 class AVSRDataLoader:
-    def __init__(self, modality, speed_rate=1, transform=True, detector="retinaface", convert_gray=True):
+    def __init__(self, modality, speed_rate=1, transform=True, detector="retinaface", convert_gray=True, lmeds_threshold=None):
         self.modality = modality
+        # frame rate of the input over the frame rate of the model
+        self.speed_rate = speed_rate
         self.transform = transform
         if self.modality in ["audio", "audiovisual"]:
             self.audio_transform = AudioTransform()
         if self.modality in ["video", "audiovisual"]:
-            if detector == "mediapipe":
+            # the cascade detector gives the four mediapipe keypoints
+            if detector in ["mediapipe", "cascade"]:
                 from pipelines.detectors.mediapipe.video_process import VideoProcess
-                self.video_process = VideoProcess(convert_gray=convert_gray)
+                self.video_process = VideoProcess(convert_gray=convert_gray, lmeds_threshold=lmeds_threshold)
             if detector == "retinaface":
                 from pipelines.detectors.retinaface.video_process import VideoProcess
-                self.video_process = VideoProcess(convert_gray=convert_gray)
+                self.video_process = VideoProcess(convert_gray=convert_gray, lmeds_threshold=lmeds_threshold)
             self.video_transform = VideoTransform(speed_rate=speed_rate)
 
 
     def load_data(self, data_filename, landmarks=None, transform=True):
+        video, audio, sample_rate = self.read(data_filename)
+        return self.process(video, audio, sample_rate, landmarks)
+
+
+    def read(self, data_filename, video=True):
+        """Decode the streams the modality needs from a path, raw bytes or a binary file object"""
+        read_video = video and self.modality in ["video", "audiovisual"]
+        read_audio = self.modality in ["audio", "audiovisual"]
+        if isinstance(data_filename, str):
+            video = self.load_video(data_filename) if read_video else None
+            audio, sample_rate = self.load_audio(data_filename) if read_audio else (None, None)
+            return video, audio, sample_rate
+        video, audio, sample_rate, duration = read_media(data_filename, read_video, read_audio)
+        if read_audio and audio is None:
+            audio, sample_rate = silent_audio(duration)
+        return video, audio, sample_rate
+
+
+    def crop_stream(self, data_filename, detect, chunk_size=32):
+        """Decode, detect and crop the video chunk by chunk.
+
+        `detect(frames, start)` gives the landmarks of the frames starting at frame `start`.
+        Peak memory is bounded by the chunk size rather than by the clip length and resolution.
+        """
+        def chunks():
+            start = 0
+            for frames in iter_video(data_filename, chunk_size):
+                yield frames, detect(frames, start)
+                start += len(frames)
+        patches = list(self.video_process.crop_stream(chunks()))
+        return np.concatenate(patches) if patches else None
+
+
+    def process(self, video, audio, sample_rate, landmarks=None, cropped=False):
+        # cropped: video already holds the mouth patches, e.g. from crop_stream
         if self.modality == "audio":
-            audio, sample_rate = self.load_audio(data_filename)
             audio = self.audio_process(audio, sample_rate)
             return self.audio_transform(audio) if self.transform else audio
         if self.modality == "video":
-            video = self.load_video(data_filename)
-            video = self.video_process(video, landmarks)
+            if not cropped:
+                video = self.video_process(video, landmarks)
             video = torch.tensor(video)
             return self.video_transform(video) if self.transform else video
         if self.modality == "audiovisual":
             rate_ratio = 640
-            audio, sample_rate = self.load_audio(data_filename)
             audio = self.audio_process(audio, sample_rate)
-            video = self.load_video(data_filename)
-            video = self.video_process(video, landmarks)
+            if not cropped:
+                video = self.video_process(video, landmarks)
             video = torch.tensor(video)
             min_t = min(len(video), audio.size(1) // rate_ratio)
             audio = audio[:, :min_t*rate_ratio]
@@ -0,0 +1,151 @@
+#! /usr/bin/env python
+# -*- coding: utf-8 -*-
+
+# Apache 2.0  (http://www.apache.org/licenses/LICENSE-2.0)
+
+import io
+import threading
+
+import av
+import numpy as np
+import torch
+
+
+class ByteStream:
+    """Binary file object read by the demuxer while another thread appends to it.
+
+    It has no `seek`, so the container is demuxed as a live stream, e.g. the
+    chunks of a MediaRecorder. `read` blocks until more bytes are written or
+    the stream is closed.
+    """
+
+    def __init__(self):
+        self.buffer = bytearray()
+        self.closed = False
+        self.condition = threading.Condition()
+
+    def write(self, data):
+        with self.condition:
+            self.buffer.extend(data)
+            self.condition.notify_all()
+
+    def close(self):
+        with self.condition:
+            self.closed = True
+            self.condition.notify_all()
+
+    def read(self, size=-1):
+        with self.condition:
+            while not self.buffer and not self.closed:
+                self.condition.wait()
+            size = len(self.buffer) if size is None or size < 0 else size
+            data = bytes(self.buffer[:size])
+            del self.buffer[:size]
+            return data
+
+
+def open_container(source):
+    """Open a media file path, raw bytes or a binary file object with PyAV."""
+    if isinstance(source, (bytes, bytearray)):
+        source = io.BytesIO(source)
+    elif hasattr(source, "seek"):
+        source.seek(0)
+    return av.open(source)
+
+
+def read_media(source, read_video=True, read_audio=True):
+    """Demux and decode a clip in process.
+
+    The streams are found from the container metadata, and only the requested
+    ones are decoded, packets of the other streams are dropped by the demuxer.
+
+    Returns:
+        video: RGB frames (T, H, W, 3) uint8, or None
+        audio: waveform (C, N) float32 in [-1, 1], or None
+        sample_rate: audio sample rate, or None
+        duration: clip duration in seconds
+    """
+    video = audio = sample_rate = None
+    with open_container(source) as container:
+        video_stream = audio_stream = None
+        if read_video and container.streams.video:
+            video_stream = container.streams.video[0]
+        if read_audio and container.streams.audio:
+            audio_stream = container.streams.audio[0]
+        streams = [s for s in (video_stream, audio_stream) if s is not None]
+        frames, samples = [], []
+        resampler = av.AudioResampler(format="fltp")
+        # NOTE: demux() with no streams would demux all of them
+        for packet in container.demux(streams) if streams else ():
+            for frame in packet.decode():
+                if packet.stream.type == "video":
+                    frames.append(frame.to_ndarray(format="rgb24"))
+                else:
+                    sample_rate = frame.sample_rate
+                    samples.extend(f.to_ndarray() for f in resampler.resample(frame))
+        if samples:
+            samples.extend(f.to_ndarray() for f in resampler.resample(None))
+        if container.duration:
+            duration = container.duration / av.time_base
+        elif frames:
+            duration = len(frames) / float(video_stream.average_rate or 25)
+        else:
+            duration = 0.
+    if frames:
+        video = np.stack(frames)
+    if samples:
+        audio = torch.from_numpy(np.concatenate(samples, axis=1))
+    return video, audio, sample_rate, duration
+
+
+def iter_video(source, chunk_size=32):
+    """Decode the video stream chunk by chunk.
+
+    Yields:
+        RGB frames (n, H, W, 3) uint8, n <= chunk_size
+    """
+    with open_container(source) as container:
+        frames = []
+        for frame in container.decode(video=0):
+            frames.append(frame.to_ndarray(format="rgb24"))
+            if len(frames) == chunk_size:
+                yield np.stack(frames)
+                frames = []
+        if frames:
+            yield np.stack(frames)
+
+
+def sample_frames(source, num_frames=4):
+    """Decode about num_frames RGB frames spread evenly over the video stream.
+
+    When the container knows the number of frames, the first and the last
+    one and evenly spaced ones in between are kept. Otherwise every frame is
+    kept with a stride that doubles whenever twice as many are kept, so the
+    memory does not depend on the clip length. Either way only the kept
+    frames are converted.
+    """
+    frames, stride = [], 1
+    with open_container(source) as container:
+        total = container.streams.video[0].frames
+        if total > 0:
+            keep = set(np.linspace(0, total - 1, num_frames).round().astype(int).tolist())
+            for idx, frame in enumerate(container.decode(video=0)):
+                if idx in keep:
+                    frames.append(frame.to_ndarray(format="rgb24"))
+                    if idx == total - 1:
+                        break
+        else:
+            for idx, frame in enumerate(container.decode(video=0)):
+                if idx % stride == 0:
+                    frames.append(frame.to_ndarray(format="rgb24"))
+                    if len(frames) == 2 * num_frames:
+                        frames, stride = frames[::2], stride * 2
+    if not frames:
+        return None
+    keep = np.unique(np.linspace(0, len(frames) - 1, num_frames).round().astype(int))
+    return np.stack([frames[idx] for idx in keep])
+
+
+def silent_audio(duration, sample_rate=16000):
+    """Mono silence (1, N) standing in for a missing audio stream."""
+    return torch.zeros(1, int(round(duration * sample_rate))), sample_rate
@@ -0,0 +1,105 @@
+#! /usr/bin/env python
+# -*- coding: utf-8 -*-
+
+# Apache 2.0  (http://www.apache.org/licenses/LICENSE-2.0)
+
+import numpy as np
+import torchvision
+from pipelines.detectors.landmarks import LandmarkTrack
+from pipelines.detectors.mediapipe.detector import LandmarksDetector as MediapipeDetector
+from pipelines.detectors.tracking import KeyframeTracker
+
+
+def to_keypoints(landmarks):
+    """The four mediapipe keypoints (right eye, left eye, nose tip, mouth center) of 68 landmarks"""
+    return np.stack([
+        np.mean(landmarks[36:42], axis=0),
+        np.mean(landmarks[42:48], axis=0),
+        np.mean(landmarks[31:36], axis=0),
+        np.mean(landmarks[48:68], axis=0),
+    ])
+
+
+class LandmarksDetector:
+    """Run the cheapest detector on every frame and escalate the frames it misses.
+
+    The tiers are tried in order on the frames no earlier tier found a face in
+    with at least `min_score` confidence. A frame every tier misses keeps the
+    most confident low-score detection, if any. The landmarks are the four
+    mediapipe keypoints, whatever tier found them.
+
+    Args:
+        tiers: tiers in the order they are tried, out of "short_range" and
+            "full_range" (mediapipe) and "retinaface" (RetinaFace + FAN,
+            which gives no score and is loaded on first use)
+        min_score: lowest confidence of a mediapipe detection to be kept
+    """
+
+    def __init__(self, device="cuda:0", tiers=("short_range", "full_range", "retinaface"), min_score=0.8,
+                 keyframe_interval=1, downscale=1, roi_margin=None):
+        self.device = device
+        self.tiers = tiers
+        self.min_score = min_score
+        self.keyframe_interval = keyframe_interval
+        self.downscale = downscale
+        self.roi_margin = roi_margin
+        self.mediapipe = MediapipeDetector(downscale=downscale, roi_margin=roi_margin)
+        self.retinaface = None
+        # frames resolved by every tier, kept with a low score, and missed by all of them
+        self.hits = dict.fromkeys(tuple(tiers) + ("low_score", "missed"), 0)
+
+    def __call__(self, video):
+        # a filename or already decoded RGB frames (T, H, W, 3)
+        if isinstance(video, str):
+            video = torchvision.io.read_video(video, pts_unit='sec')[0].numpy()
+        landmarks = self.tracker()(video)
+        assert landmarks.valid.any(), "Cannot detect any frames in the video"
+        return landmarks
+
+    def tracker(self):
+        """Landmarks of one clip, chunk by chunk, detected every keyframe_interval frames"""
+        return KeyframeTracker(self.detect_frames, 4, self.keyframe_interval)
+
+    def hit_rates(self):
+        """Share of the frames resolved by every tier, kept with a low score, or missed"""
+        total = max(sum(self.hits.values()), 1)
+        return {tier: hits / float(total) for tier, hits in self.hits.items()}
+
+    def detect_frames(self, video_frames, prev_landmarks=None):
+        """Detect the LandmarkTrack of frames (or a chunk of them), invalid where no face is found"""
+        landmarks = [None] * len(video_frames)
+        best_scores = np.zeros(len(video_frames))
+        pending = np.arange(len(video_frames))
+        for tier in self.tiers:
+            if len(pending) == 0:
+                break
+            tier_landmarks, scores = self.detect_tier(tier, video_frames[pending], prev_landmarks)
+            found = tier_landmarks.valid & (scores >= self.min_score)
+            self.hits[tier] += int(found.sum())
+            # keep the best guess of the frames that go on to the next tier
+            for idx, lm, score in zip(pending, tier_landmarks.to_list(), scores):
+                if lm is not None and (landmarks[idx] is None or score > best_scores[idx]):
+                    landmarks[idx], best_scores[idx] = lm, score
+            pending = pending[~found]
+        missed = sum(landmarks[idx] is None for idx in pending)
+        self.hits["low_score"] += len(pending) - missed
+        self.hits["missed"] += missed
+        return LandmarkTrack.from_list(landmarks, num_points=4)
+
+    def detect_tier(self, tier, video_frames, prev_landmarks=None):
+        """LandmarkTrack and confidences of frames with one tier"""
+        if tier == "short_range":
+            return self.mediapipe.detect(video_frames, self.mediapipe.short_range_detector, prev_landmarks, return_scores=True)
+        if tier == "full_range":
+            return self.mediapipe.detect(video_frames, self.mediapipe.full_range_detector, prev_landmarks, return_scores=True)
+        if tier == "retinaface":
+            if self.retinaface is None:
+                from pipelines.detectors.retinaface.detector import LandmarksDetector as RetinafaceDetector
+                self.retinaface = RetinafaceDetector(device=self.device, downscale=self.downscale, roi_margin=self.roi_margin)
+            track = self.retinaface.detect_frames(video_frames, prev_landmarks)
+            points = np.zeros((len(track), 4, 2), dtype=np.float32)
+            for idx in np.flatnonzero(track.valid):
+                points[idx] = to_keypoints(track.points[idx])
+            # RetinaFace only keeps faces above its own threshold
+            return LandmarkTrack(points, track.valid), track.valid.astype(np.float64)
+        raise ValueError(f"unknown detector tier: {tier}")
@@ -0,0 +1,94 @@
+#! /usr/bin/env python
+# -*- coding: utf-8 -*-
+
+# Apache 2.0  (http://www.apache.org/licenses/LICENSE-2.0)
+
+import numpy as np
+
+
+class LandmarkTrack:
+    """Landmarks of consecutive frames.
+
+    Args:
+        points: (T, K, 2) float32 landmarks, arbitrary where not valid
+        valid: (T,) bool, the frames a face was detected in
+    """
+
+    def __init__(self, points, valid=None):
+        self.points = np.asarray(points, dtype=np.float32)
+        self.valid = np.ones(len(self.points), dtype=bool) if valid is None else np.asarray(valid, dtype=bool)
+
+    @classmethod
+    def from_list(cls, landmarks, num_points=0):
+        """Track of a list of (K, 2) landmarks, None for the frames without a detection"""
+        if isinstance(landmarks, cls):
+            return landmarks
+        num_points = next((len(lm) for lm in landmarks if lm is not None), num_points)
+        points = np.zeros((len(landmarks), num_points, 2), dtype=np.float32)
+        valid = np.array([lm is not None for lm in landmarks], dtype=bool)
+        if valid.any():
+            points[valid] = np.stack([lm for lm in landmarks if lm is not None])
+        return cls(points, valid)
+
+    @classmethod
+    def concatenate(cls, tracks):
+        # tracks without any detection may not know the number of landmarks
+        num_points = max(t.points.shape[1] for t in tracks)
+        points = [t.points if t.points.shape[1] == num_points else np.zeros((len(t), num_points, 2), dtype=np.float32) for t in tracks]
+        return cls(np.concatenate(points), np.concatenate([t.valid for t in tracks]))
+
+    def to_list(self):
+        return [lm if valid else None for lm, valid in zip(self.points, self.valid)]
+
+    def __len__(self):
+        return len(self.points)
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            return LandmarkTrack(self.points[index], self.valid[index])
+        return self.points[index] if self.valid[index] else None
+
+    def interpolate(self):
+        """Fill the frames without a detection linearly between their neighbouring detections.
+
+        Frames before the first and after the last detection take its landmarks.
+
+        Returns:
+            (T, K, 2) float64 landmarks, or None when no frame holds a detection
+        """
+        if not self.valid.any():
+            return None
+        frame_idx = np.arange(len(self))
+        # previous and next detection of every frame
+        prev_idx = np.maximum.accumulate(np.where(self.valid, frame_idx, -1))
+        next_idx = np.minimum.accumulate(np.where(self.valid, frame_idx, len(self))[::-1])[::-1]
+        prev_idx = np.where(prev_idx < 0, next_idx, prev_idx)
+        next_idx = np.where(next_idx >= len(self), prev_idx, next_idx)
+        gap = np.maximum(next_idx - prev_idx, 1)
+        weight = ((frame_idx - prev_idx) / gap.astype(np.float64))[:, None, None]
+        points = self.points.astype(np.float64)
+        return points[prev_idx] + weight * (points[next_idx] - points[prev_idx])
+
+
+def smooth_landmarks(landmarks, window_margin, start=0, stop=None):
+    """Average the landmarks (T, K, 2) of frames start..stop over their temporal windows.
+
+    The window of frame i spans window_margin // 2 frames on either side, shrunk
+    symmetrically at the ends of the clip, and the averaged landmarks are
+    moved back to the centre of frame i.
+
+    Returns:
+        (stop - start, K, 2) smoothed landmarks
+    """
+    num_frames = len(landmarks)
+    stop = num_frames if stop is None else stop
+    frame_idx = np.arange(start, stop)
+    half_window = np.minimum(np.minimum(window_margin // 2, frame_idx), num_frames - 1 - frame_idx)
+    # window sums from the cumulative sum of the frames the windows cover
+    first = max(start - window_margin // 2, 0)
+    last = min(stop + window_margin // 2, num_frames)
+    cumsum = np.zeros((last - first + 1,) + landmarks.shape[1:])
+    np.cumsum(landmarks[first:last], axis=0, out=cumsum[1:])
+    window_sum = cumsum[frame_idx + half_window + 1 - first] - cumsum[frame_idx - half_window - first]
+    smoothed = window_sum / (2 * half_window + 1)[:, None, None]
+    return smoothed + (landmarks[start:stop].mean(axis=1) - smoothed.mean(axis=1))[:, None]
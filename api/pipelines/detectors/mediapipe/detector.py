@@ -10,51 +10,80 @@ import mediapipe as mp
 import os
 import cv2
 import numpy as np
+from pipelines.detectors.landmarks import LandmarkTrack
+from pipelines.detectors.region import detection_image, search_region
+from pipelines.detectors.tracking import KeyframeTracker
 
 
 class LandmarksDetector:
-    def __init__(self):
+    def __init__(self, keyframe_interval=1, downscale=1, roi_margin=None):
         self.mp_face_detection = mp.solutions.face_detection
         self.short_range_detector = self.mp_face_detection.FaceDetection(min_detection_confidence=0.5, model_selection=0)
         self.full_range_detector = self.mp_face_detection.FaceDetection(min_detection_confidence=0.5, model_selection=1)
+        self.keyframe_interval = keyframe_interval
+        # faces are detected on frames downscaled by this factor
+        self.downscale = downscale
+        # look for the face around the previous landmarks first, grown by this share of their size
+        self.roi_margin = roi_margin
 
-    def __call__(self, filename):
-        video_frames = torchvision.io.read_video(filename, pts_unit='sec')[0].numpy()
-        landmarks = self.detect(video_frames, self.full_range_detector)
-        if all(element is None for element in landmarks):
-            landmarks = self.detect(video_frames, self.short_range_detector)
-            assert any(l is not None for l in landmarks), "Cannot detect any frames in the video"
+    def __call__(self, video):
+        # a filename or already decoded RGB frames (T, H, W, 3)
+        if isinstance(video, str):
+            video = torchvision.io.read_video(video, pts_unit='sec')[0].numpy()
+        landmarks = self.tracker()(video)
+        assert landmarks.valid.any(), "Cannot detect any frames in the video"
+        return landmarks
+
+    def tracker(self):
+        """Landmarks of one clip, chunk by chunk, detected every keyframe_interval frames"""
+        return KeyframeTracker(self.detect_frames, 4, self.keyframe_interval)
+
+    def detect_frames(self, video_frames, prev_landmarks=None):
+        """Detect the LandmarkTrack of frames (or a chunk of them), invalid where no face is found"""
+        landmarks = self.detect(video_frames, self.full_range_detector, prev_landmarks)
+        if not landmarks.valid.any():
+            landmarks = self.detect(video_frames, self.short_range_detector, prev_landmarks)
         return landmarks
     
-    def detect(self, video_frames, detector):
-        landmarks = []
+    def detect(self, video_frames, detector, prev_landmarks=None, return_scores=False):
+        landmarks, scores = [], []
         for frame in video_frames:
-            results = detector.process(frame)
-            if not results.detections:
-                landmarks.append(None)
-                continue
-            face_points = []
-            for idx, detected_faces in enumerate(results.detections):
-                max_id, max_size = 0, 0
-                bboxC = detected_faces.location_data.relative_bounding_box
-                ih, iw, ic = frame.shape
-                bbox = int(bboxC.xmin * iw), int(bboxC.ymin * ih), int(bboxC.width * iw), int(bboxC.height * ih)
-                bbox_size = (bbox[2] - bbox[0]) + (bbox[3] - bbox[1])
-                if bbox_size > max_size:
-                    max_id, max_size = idx, bbox_size
-                lmx = [
-                    [int(detected_faces.location_data.relative_keypoints[self.mp_face_detection.FaceKeyPoint(0).value].x * iw),
-                     int(detected_faces.location_data.relative_keypoints[self.mp_face_detection.FaceKeyPoint(0).value].y * ih)],
-                    [int(detected_faces.location_data.relative_keypoints[self.mp_face_detection.FaceKeyPoint(1).value].x * iw),
-                     int(detected_faces.location_data.relative_keypoints[self.mp_face_detection.FaceKeyPoint(1).value].y * ih)],
-                    [int(detected_faces.location_data.relative_keypoints[self.mp_face_detection.FaceKeyPoint(2).value].x * iw),
-                     int(detected_faces.location_data.relative_keypoints[self.mp_face_detection.FaceKeyPoint(2).value].y * ih)],
-                    [int(detected_faces.location_data.relative_keypoints[self.mp_face_detection.FaceKeyPoint(3).value].x * iw),
-                     int(detected_faces.location_data.relative_keypoints[self.mp_face_detection.FaceKeyPoint(3).value].y * ih)],
-                    ]
-                face_points.append(lmx)
-            landmarks.append(np.array(face_points[max_id]))
-        return landmarks
+            region = None
+            if self.roi_margin is not None and prev_landmarks is not None:
+                region = search_region(prev_landmarks, frame.shape, self.roi_margin)
+            points, score = self.detect_frame(frame, detector, region) if region is not None else (None, 0.)
+            if points is None:
+                points, score = self.detect_frame(frame, detector)
+            landmarks.append(points)
+            scores.append(score)
+            prev_landmarks = points
+        landmarks = LandmarkTrack.from_list(landmarks, num_points=4)
+        # scores: detection confidence of every frame, 0 where no face is found
+        return (landmarks, np.array(scores)) if return_scores else landmarks
+
+    def detect_frame(self, frame, detector, region=None):
+        image, offset, scale = detection_image(frame, region, self.downscale)
+        results = detector.process(image)
+        if not results.detections:
+            return None, 0.
+        face_points, face_scores = [], []
+        for idx, detected_faces in enumerate(results.detections):
+            max_id, max_size = 0, 0
+            bboxC = detected_faces.location_data.relative_bounding_box
+            ih, iw, ic = image.shape
+            bbox = int(bboxC.xmin * iw), int(bboxC.ymin * ih), int(bboxC.width * iw), int(bboxC.height * ih)
+            bbox_size = (bbox[2] - bbox[0]) + (bbox[3] - bbox[1])
+            if bbox_size > max_size:
+                max_id, max_size = idx, bbox_size
+            # keypoints in frame coordinates
+            lmx = [
+                [int(detected_faces.location_data.relative_keypoints[self.mp_face_detection.FaceKeyPoint(kp).value].x * iw * scale[0] + offset[0]),
+                 int(detected_faces.location_data.relative_keypoints[self.mp_face_detection.FaceKeyPoint(kp).value].y * ih * scale[1] + offset[1])]
+                for kp in range(4)
+                ]
+            face_points.append(lmx)
+            face_scores.append(detected_faces.score[0])
+        return np.array(face_points[max_id]), face_scores[max_id]
     
     def detect_single(self, frame):
         """Process single frame for live streaming"""
@@ -9,14 +9,9 @@ import cv2
 import numpy as np
 from skimage import transform as tf
 
-
-def linear_interpolate(landmarks, start_idx, stop_idx):
-    start_landmarks = landmarks[start_idx]
-    stop_landmarks = landmarks[stop_idx]
-    delta = stop_landmarks - start_landmarks
-    for idx in range(1, stop_idx-start_idx):
-        landmarks[start_idx+idx] = start_landmarks + idx/float(stop_idx-start_idx) * delta
-    return landmarks
+from pipelines.detectors.landmarks import LandmarkTrack, smooth_landmarks
+from pipelines.detectors.roi import estimate_similarity_transforms, patch_offsets, warp_rois
+from pipelines.detectors.streaming import crop_stream
 
 
 def warp_img(src, dst, img, std_size):
@@ -51,7 +46,7 @@ def cut_patch(img, landmarks, height, width, threshold=5):
 
 class VideoProcess:
     def __init__(self, mean_face_path="20words_mean_face.npy", crop_width=96, crop_height=96,
-                 start_idx=3, stop_idx=4, window_margin=12, convert_gray=True):
+                 start_idx=3, stop_idx=4, window_margin=12, convert_gray=True, lmeds_threshold=None):
         self.reference = np.load(os.path.join(os.path.dirname(__file__), mean_face_path))
         self.crop_width = crop_width
         self.crop_height = crop_height
@@ -59,12 +54,14 @@ class VideoProcess:
         self.stop_idx = stop_idx
         self.window_margin = window_margin
         self.convert_gray = convert_gray
+        # frames whose closed form fit is further than this from the reference fall back to LMEDS
+        self.lmeds_threshold = lmeds_threshold
 
     def __call__(self, video, landmarks):
         # Pre-process landmarks: interpolate frames that are not detected
         preprocessed_landmarks = self.interpolate_landmarks(landmarks)
         # Exclude corner cases: no landmark in all frames
-        if not preprocessed_landmarks:
+        if preprocessed_landmarks is None:
             return
         # Affine transformation and crop patch
         sequence = self.crop_patch(video, preprocessed_landmarks)
@@ -72,38 +69,34 @@ class VideoProcess:
         return sequence
 
 
-    def crop_patch(self, video, landmarks):
-        sequence = []
-        for frame_idx, frame in enumerate(video):
-            window_margin = min(self.window_margin // 2, frame_idx, len(landmarks) - 1 - frame_idx)
-            smoothed_landmarks = np.mean([landmarks[x] for x in range(frame_idx - window_margin, frame_idx + window_margin + 1)], axis=0)
-            smoothed_landmarks += landmarks[frame_idx].mean(axis=0) - smoothed_landmarks.mean(axis=0)
-            transformed_frame, transformed_landmarks = self.affine_transform(frame,smoothed_landmarks,self.reference,grayscale=self.convert_gray)
-            patch = cut_patch(transformed_frame, transformed_landmarks[self.start_idx:self.stop_idx], self.crop_height//2, self.crop_width//2,)
-            sequence.append(patch)
-        return np.array(sequence)
+    def crop_stream(self, chunks):
+        """Crop patches from (frames, landmarks) chunks, see `crop_stream`"""
+        return crop_stream(self, chunks)
 
 
-    def interpolate_landmarks(self, landmarks):
-        valid_frames_idx = [idx for idx, lm in enumerate(landmarks) if lm is not None]
+    def crop_patch(self, video, landmarks, first_frame=0):
+        # video holds the frames first_frame, first_frame + 1, ... of the interpolated landmarks
+        smoothed_landmarks = smooth_landmarks(landmarks, self.window_margin, first_frame, first_frame + len(video))
+        return self.crop_frames(np.asarray(video), smoothed_landmarks)
 
-        if not valid_frames_idx:
-            return None
 
-        for idx in range(1, len(valid_frames_idx)):
-            if valid_frames_idx[idx] - valid_frames_idx[idx - 1] > 1:
-                landmarks = linear_interpolate(landmarks, valid_frames_idx[idx - 1], valid_frames_idx[idx])
+    def crop_frame(self, frame, landmarks, frame_idx):
+        return self.crop_patch(frame[None], landmarks, frame_idx)[0]
 
-        valid_frames_idx = [idx for idx, lm in enumerate(landmarks) if lm is not None]
 
-        # Handle corner case: keep frames at the beginning or at the end that failed to be detected
-        if valid_frames_idx:
-            landmarks[:valid_frames_idx[0]] = [landmarks[valid_frames_idx[0]]] * valid_frames_idx[0]
-            landmarks[valid_frames_idx[-1]:] = [landmarks[valid_frames_idx[-1]]] * (len(landmarks) - valid_frames_idx[-1])
+    def crop_frames(self, frames, landmarks, target_size=(256, 256), reference_size=(256, 256), stable_points=(0, 1, 2, 3)):
+        # Same patches as affine_transform then cut_patch, but the crop offsets are composed
+        # into the transforms and every frame is warped straight to its patch
+        stable_reference = self.get_stable_reference(self.reference, reference_size, target_size)
+        transforms = self.estimate_affine_transforms(landmarks, stable_points, stable_reference)
+        mouth_landmarks = np.matmul(landmarks[:, self.start_idx:self.stop_idx], transforms[:, :, :2].transpose(0, 2, 1)) + transforms[:, None, :, 2]
+        transforms[:, :, 2] -= patch_offsets(mouth_landmarks, target_size, self.crop_height//2, self.crop_width//2)
+        return warp_rois(frames, transforms, (self.crop_height, self.crop_width), grayscale=self.convert_gray)
 
-        assert all(lm is not None for lm in landmarks), "not every frame has landmark"
 
-        return landmarks
+    def interpolate_landmarks(self, landmarks):
+        # a LandmarkTrack, or a list holding None for the frames that are not detected
+        return LandmarkTrack.from_list(landmarks).interpolate()
 
 
     def affine_transform(self, frame, landmarks, reference, grayscale=False,
@@ -135,6 +128,17 @@ class VideoProcess:
         return cv2.estimateAffinePartial2D(np.vstack([landmarks[x] for x in stable_points]), stable_reference, method=cv2.LMEDS)[0]
 
 
+    def estimate_affine_transforms(self, landmarks, stable_points, stable_reference):
+        transforms, residuals = estimate_similarity_transforms(landmarks[:, list(stable_points)], stable_reference)
+        if self.lmeds_threshold is not None:
+            for frame_idx in np.flatnonzero(residuals > self.lmeds_threshold):
+                transform = self.estimate_affine_transform(landmarks[frame_idx], stable_points, stable_reference)
+                # LMEDS finds no transform either when the points coincide
+                if transform is not None:
+                    transforms[frame_idx] = transform
+        return transforms
+
+
     def apply_affine_transform(self, frame, landmarks, transform, target_size, interpolation, border_mode, border_value):
         transformed_frame = cv2.warpAffine(frame, transform, dsize=(target_size[0], target_size[1]),
                                            flags=interpolation, borderMode=border_mode, borderValue=border_value)
@@ -0,0 +1,45 @@
+#! /usr/bin/env python
+# -*- coding: utf-8 -*-
+
+# Apache 2.0  (http://www.apache.org/licenses/LICENSE-2.0)
+
+import cv2
+import numpy as np
+
+
+def search_region(landmarks, frame_shape, margin):
+    """Box (x_min, y_min, x_max, y_max) to look for the face in, around the landmarks (K, 2) of the previous frame.
+
+    The bounding box of the landmarks is made square and grown by `margin`
+    times its size on every side, within the frame.
+    """
+    (x_min, y_min), (x_max, y_max) = np.min(landmarks, axis=0), np.max(landmarks, axis=0)
+    center_x, center_y = (x_min + x_max) / 2., (y_min + y_max) / 2.
+    half_size = max(x_max - x_min, y_max - y_min) * (0.5 + margin)
+    height, width = frame_shape[:2]
+    region = (int(max(center_x - half_size, 0)), int(max(center_y - half_size, 0)),
+              int(min(center_x + half_size, width)), int(min(center_y + half_size, height)))
+    # the whole frame when the landmarks left it
+    return region if region[2] > region[0] and region[3] > region[1] else None
+
+
+def detection_image(frame, region=None, downscale=1):
+    """Part of the frame a detector runs on, cut to the region and downscaled.
+
+    Returns:
+        image: the part of the frame
+        offset: (2,) frame coordinates of the top-left corner of the image
+        scale: (2,) frame pixels per image pixel, along x and y
+    """
+    offset = np.zeros(2)
+    if region is not None:
+        x_min, y_min, x_max, y_max = region
+        frame = np.ascontiguousarray(frame[y_min:y_max, x_min:x_max])
+        offset = np.array([x_min, y_min], dtype=np.float64)
+    height, width = frame.shape[:2]
+    scale = np.ones(2)
+    if downscale > 1:
+        size = (max(int(round(width / downscale)), 1), max(int(round(height / downscale)), 1))
+        frame = cv2.resize(frame, size, interpolation=cv2.INTER_AREA)
+        scale = np.array([width / float(size[0]), height / float(size[1])])
+    return frame, offset, scale
@@ -0,0 +1,166 @@
+#! /usr/bin/env python
+# -*- coding: utf-8 -*-
+
+# Apache 2.0  (http://www.apache.org/licenses/LICENSE-2.0)
+
+import math
+
+import cv2
+import numpy as np
+import torch
+
+
+# mean of the BGR channels RetinaFace is trained with
+RETINAFACE_MEAN = (104, 117, 123)
+
+
+def prior_boxes(config, height, width):
+    """Anchors (N, 4) of RetinaFace for an input of height x width, as (cx, cy, w, h) in [0, 1]."""
+    anchors = []
+    for step, min_sizes in zip(config.steps, config.min_sizes):
+        cy, cx = np.meshgrid((np.arange(math.ceil(height / step)) + 0.5) * step / height,
+                             (np.arange(math.ceil(width / step)) + 0.5) * step / width, indexing="ij")
+        sizes = np.asarray(min_sizes, dtype=np.float64)
+        # anchors of each cell, row by row, one per min size
+        cell_anchors = np.broadcast_arrays(cx[..., None], cy[..., None], sizes / width, sizes / height)
+        anchors.append(np.stack(cell_anchors, axis=-1).reshape(-1, 4))
+    anchors = np.concatenate(anchors)
+    if config.clip:
+        anchors = np.clip(anchors, 0, 1)
+    return torch.from_numpy(anchors).float()
+
+
+def decode_boxes(loc, priors, variances):
+    """Boxes (N, 4) as (x_min, y_min, x_max, y_max) in [0, 1] of the box regressions (N, 4)."""
+    centers = priors[:, :2] + loc[:, :2] * variances[0] * priors[:, 2:]
+    sizes = priors[:, 2:] * torch.exp(loc[:, 2:] * variances[1])
+    return torch.cat([centers - sizes / 2, centers + sizes / 2], dim=1)
+
+
+def decode_points(pre, priors, variances):
+    """Five points (N, 10) as x, y in [0, 1] of the point regressions (N, 10)."""
+    pre = pre.reshape(len(pre), 5, 2)
+    points = priors[:, None, :2] + pre * variances[0] * priors[:, None, 2:]
+    return points.reshape(len(pre), 10)
+
+
+def nms(dets, threshold):
+    """Indices of the boxes (N, 5) kept by non-maximum suppression, highest score first."""
+    x_min, y_min, x_max, y_max, scores = dets[:, 0], dets[:, 1], dets[:, 2], dets[:, 3], dets[:, 4]
+    areas = (x_max - x_min + 1) * (y_max - y_min + 1)
+    order = scores.argsort()[::-1]
+    keep = []
+    while order.size > 0:
+        i = order[0]
+        keep.append(i)
+        width = np.maximum(0.0, np.minimum(x_max[i], x_max[order[1:]]) - np.maximum(x_min[i], x_min[order[1:]]) + 1)
+        height = np.maximum(0.0, np.minimum(y_max[i], y_max[order[1:]]) - np.maximum(y_min[i], y_min[order[1:]]) + 1)
+        inter = width * height
+        overlap = inter / (areas[i] + areas[order[1:]] - inter)
+        order = order[np.flatnonzero(overlap <= threshold) + 1]
+    return keep
+
+
+def detect_faces(predictor, images):
+    """Faces of BGR images with one pass of the network of a RetinaFacePredictor.
+
+    The images are padded to the largest of them at the bottom and the
+    right, so the coordinates do not move, and the network runs once on the
+    batch. Its output goes through the same steps as the predictor itself:
+    score threshold, top-k, NMS, top-k and detection threshold.
+
+    Args:
+        predictor: ibug RetinaFacePredictor, only its net, config, device and threshold are used
+        images: list of (H, W, 3) uint8 images, of any size
+
+    Returns:
+        list of (n, 15) float32 faces of each image, box, score and five points
+    """
+    config = predictor.config
+    height, width = max(image.shape[0] for image in images), max(image.shape[1] for image in images)
+    mean = torch.tensor(RETINAFACE_MEAN, dtype=torch.float32)
+    # the padding is zero once the mean is subtracted, the same as the padding of the convolutions
+    batch = torch.zeros(len(images), 3, height, width)
+    for batch_image, image in zip(batch, images):
+        batch_image[:, :image.shape[0], :image.shape[1]] = (torch.from_numpy(image).float() - mean).permute(2, 0, 1)
+    with torch.no_grad():
+        locs, confs, points = predictor.net(batch.to(predictor.device))
+    priors = prior_boxes(config, height, width).to(locs.device)
+    scale = torch.tensor([width, height], dtype=torch.float32, device=locs.device)
+    faces = []
+    for loc, conf, pre in zip(locs, confs, points):
+        boxes = (decode_boxes(loc, priors, config.variance) * scale.repeat(2)).cpu().numpy()
+        landms = (decode_points(pre, priors, config.variance) * scale.repeat(5)).cpu().numpy()
+        scores = conf[:, 1].cpu().numpy()
+        keep = np.flatnonzero(scores > config.conf_thresh)
+        keep = keep[scores[keep].argsort()[::-1][:config.nms_top_k]]
+        dets = np.hstack([boxes[keep], scores[keep, None]]).astype(np.float32)
+        keep_nms = nms(dets, config.nms_thresh)[:config.top_k]
+        dets = np.concatenate([dets[keep_nms], landms[keep][keep_nms].astype(np.float32)], axis=1)
+        faces.append(dets[dets[:, 4] >= predictor.threshold])
+    return faces
+
+
+def face_patch(frame, box, crop_ratio, size):
+    """Square patch of a face box resized to size x size, zero outside the frame, and its bounds in the frame."""
+    center = (box[:2] + box[2:4]) / 2.0
+    face_size = np.mean([box[3] - box[1], box[2] - box[0]]) / (1.0 - crop_ratio)
+    left, top = np.round(center - face_size / 2.0)
+    right, bottom = np.round(np.array([left, top]) + face_size) + 1
+    left, top, right, bottom = int(left), int(top), int(right), int(bottom)
+    patch = np.zeros((bottom - top, right - left, frame.shape[2]), dtype=frame.dtype)
+    src_left, src_top = max(left, 0), max(top, 0)
+    src_right, src_bottom = min(right, frame.shape[1]), min(bottom, frame.shape[0])
+    if src_right > src_left and src_bottom > src_top:
+        patch[src_top - top:src_bottom - top, src_left - left:src_right - left] = frame[src_top:src_bottom, src_left:src_right]
+    return cv2.resize(patch, (size, size)), (left, top, right, bottom)
+
+
+def decode_heatmaps(heatmaps, radius, gamma):
+    """Points (B, K, 2) of heatmaps (B, K, H, W) in heatmap pixels, the centroid around the peak of each."""
+    num_rows, num_cols = heatmaps.shape[2:]
+    if radius ** 2 * num_rows * num_cols < num_rows ** 2 + num_cols ** 2:
+        # only the pixels within radius of the peak count
+        peaks = heatmaps.flatten(2).argmax(dim=2)
+        rows = torch.arange(num_rows, device=heatmaps.device).view(1, 1, -1, 1)
+        cols = torch.arange(num_cols, device=heatmaps.device).view(1, 1, 1, -1)
+        distances = ((rows - (peaks // num_cols)[..., None, None]) ** 2 + (cols - (peaks % num_cols)[..., None, None]) ** 2).float().sqrt()
+        heatmaps = heatmaps * (distances <= radius * (num_rows * num_cols) ** 0.5).float()
+    heatmaps = heatmaps.clamp_min(0.0)
+    if gamma != 1.0:
+        heatmaps = heatmaps.pow(gamma)
+    masses = heatmaps.sum(dim=(2, 3)).clamp_min(torch.finfo(heatmaps.dtype).eps)
+    xs = (heatmaps.sum(dim=2) * torch.arange(0.5, num_cols, device=heatmaps.device)).sum(dim=2) / masses
+    ys = (heatmaps.sum(dim=3) * torch.arange(0.5, num_rows, device=heatmaps.device)).sum(dim=2) / masses
+    return torch.stack([xs, ys], dim=-1)
+
+
+def detect_landmarks(predictor, frames, boxes):
+    """Landmarks of one face per RGB frame with one pass of the network of a FANPredictor.
+
+    Every face is cut as the predictor does, grown by its crop ratio and
+    resized to the input size, so the patches of all the frames are stacked
+    and go through the network at once.
+
+    Args:
+        predictor: ibug FANPredictor, only its net, config and device are used
+        frames: list of (H, W, 3) uint8 RGB frames
+        boxes: face box (x_min, y_min, x_max, y_max, ...) of each frame
+
+    Returns:
+        (len(frames), K, 2) landmarks in frame coordinates
+    """
+    config = predictor.config
+    patches, bounds = zip(*[face_patch(frame, np.asarray(box[:4], dtype=np.float64), config.crop_ratio, config.input_size)
+                            for frame, box in zip(frames, boxes)])
+    batch = torch.from_numpy(np.stack(patches).transpose(0, 3, 1, 2).astype(np.float32) / 255.0)
+    with torch.no_grad():
+        heatmaps = predictor.net(batch.to(predictor.device))
+    # the network also returns its features
+    heatmaps = heatmaps[0] if isinstance(heatmaps, (tuple, list)) else heatmaps
+    points = decode_heatmaps(heatmaps, config.radius, config.gamma).cpu().numpy()
+    num_rows, num_cols = heatmaps.shape[2:]
+    for face_points, (left, top, right, bottom) in zip(points, bounds):
+        face_points[:, 0] = face_points[:, 0] * (right - left) / num_cols + left
+        face_points[:, 1] = face_points[:, 1] * (bottom - top) / num_rows + top
+    return points
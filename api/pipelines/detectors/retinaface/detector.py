@@ -5,34 +5,82 @@
 # Apache 2.0  (http://www.apache.org/licenses/LICENSE-2.0)
 
 import warnings
+import numpy as np
 import torchvision
 from ibug.face_detection import RetinaFacePredictor
 from ibug.face_alignment import FANPredictor
+from pipelines.detectors.landmarks import LandmarkTrack
+from pipelines.detectors.retinaface.batching import detect_faces, detect_landmarks
+from pipelines.detectors.region import detection_image, search_region
+from pipelines.detectors.tracking import KeyframeTracker
 warnings.filterwarnings("ignore")
 
 
 class LandmarksDetector:
-    def __init__(self, device="cuda:0", model_name='resnet50'):
+    def __init__(self, device="cuda:0", model_name='resnet50', keyframe_interval=1, downscale=1, roi_margin=None, batch_size=8):
         self.face_detector = RetinaFacePredictor(
             device=device,
             threshold=0.8,
             model=RetinaFacePredictor.get_model(model_name)
         )
         self.landmark_detector = FANPredictor(device=device, model=None)
+        self.keyframe_interval = keyframe_interval
+        # faces are detected on frames downscaled by this factor, the landmarks at full resolution
+        self.downscale = downscale
+        # look for the face around the previous landmarks first, grown by this share of their size
+        self.roi_margin = roi_margin
+        # frames that go through both networks at once
+        self.batch_size = batch_size
 
-    def __call__(self, filename):
-        video_frames = torchvision.io.read_video(filename, pts_unit='sec')[0].numpy()
+    def __call__(self, video):
+        # a filename or already decoded RGB frames (T, H, W, 3)
+        if isinstance(video, str):
+            video = torchvision.io.read_video(video, pts_unit='sec')[0].numpy()
+        return self.tracker()(video)
+
+    def tracker(self):
+        """Landmarks of one clip, chunk by chunk, detected every keyframe_interval frames"""
+        return KeyframeTracker(self.detect_frames, 68, self.keyframe_interval)
+
+    def detect_frames(self, video_frames, prev_landmarks=None):
+        """Detect the LandmarkTrack of frames (or a chunk of them), invalid where no face is found"""
         landmarks = []
-        for frame in video_frames:
-            detected_faces = self.face_detector(frame, rgb=False)
-            face_points, _ = self.landmark_detector(frame, detected_faces, rgb=True)
-            if len(detected_faces) == 0:
-                landmarks.append(None)
-            else:
-                max_id, max_size = 0, 0
-                for idx, bbox in enumerate(detected_faces):
-                    bbox_size = (bbox[2] - bbox[0]) + (bbox[3] - bbox[1])
-                    if bbox_size > max_size:
-                        max_id, max_size = idx, bbox_size
-                landmarks.append(face_points[max_id])
+        for start in range(0, len(video_frames), self.batch_size):
+            frames = video_frames[start:start + self.batch_size]
+            # the whole batch is searched around the landmarks found before it
+            region = None
+            if self.roi_margin is not None and prev_landmarks is not None:
+                region = search_region(prev_landmarks, frames[0].shape, self.roi_margin)
+            points = self.detect_batch(frames, region) if region is not None else [None] * len(frames)
+            missed = [idx for idx, lm in enumerate(points) if lm is None]
+            if missed:
+                for idx, lm in zip(missed, self.detect_batch([frames[idx] for idx in missed])):
+                    points[idx] = lm
+            landmarks.extend(points)
+            prev_landmarks = next((lm for lm in reversed(points) if lm is not None), prev_landmarks)
+        return LandmarkTrack.from_list(landmarks, num_points=68)
+
+    def detect_batch(self, frames, region=None):
+        """Landmarks of the largest face of every frame, or None, with one pass of each network"""
+        images = [detection_image(frame, region, self.downscale) for frame in frames]
+        # the frames are RGB, and given to RetinaFace as they are, as the per-frame calls always did
+        detected_faces = detect_faces(self.face_detector, [image for image, _, _ in images])
+        for faces, (_, offset, scale) in zip(detected_faces, images):
+            # boxes and their five points back to frame coordinates
+            faces[:, 0:4:2] = faces[:, 0:4:2] * scale[0] + offset[0]
+            faces[:, 1:4:2] = faces[:, 1:4:2] * scale[1] + offset[1]
+            faces[:, 5::2] = faces[:, 5::2] * scale[0] + offset[0]
+            faces[:, 6::2] = faces[:, 6::2] * scale[1] + offset[1]
+        detected = [idx for idx, faces in enumerate(detected_faces) if len(faces) > 0]
+        landmarks = [None] * len(frames)
+        if not detected:
+            return landmarks
+        # only the largest face of each frame goes through FAN
+        boxes = []
+        for idx in detected:
+            faces = detected_faces[idx]
+            boxes.append(faces[np.argmax((faces[:, 2] - faces[:, 0]) + (faces[:, 3] - faces[:, 1]))])
+        points = detect_landmarks(self.landmark_detector, [frames[idx] for idx in detected], boxes)
+        for idx, face_points in zip(detected, points):
+            landmarks[idx] = face_points
         return landmarks
@@ -0,0 +1,96 @@
+#! /usr/bin/env python
+# -*- coding: utf-8 -*-
+
+# Apache 2.0  (http://www.apache.org/licenses/LICENSE-2.0)
+
+import cv2
+import numpy as np
+
+
+def estimate_similarity_transforms(points, reference, eps=1e-6):
+    """Least squares similarity transforms (Umeyama) from the points of every frame to the reference.
+
+    The points of a frame that all coincide give no rotation nor scale, they
+    are only moved onto the reference and their distance is infinite.
+
+    Args:
+        points: (T, K, 2) points of every frame
+        reference: (K, 2) reference points
+        eps: smallest spread (sum of squared distances to their mean) of the points of a frame
+
+    Returns:
+        transforms (T, 2, 3) in the layout of cv2.estimateAffinePartial2D,
+        and the RMS distances (T,) of the transformed points to the reference
+    """
+    points = np.asarray(points, dtype=np.float64)
+    points_mean = points.mean(axis=1)
+    reference_mean = reference.mean(axis=0)
+    src = points - points_mean[:, None]
+    dst = reference - reference_mean
+    # scaled rotation [[a, -b], [b, a]] in closed form, the identity for coinciding points
+    norm = np.sum(src ** 2, axis=(1, 2))
+    degenerate = norm <= eps
+    norm = np.where(degenerate, 1., norm)
+    a = np.where(degenerate, 1., np.sum(src * dst, axis=(1, 2)) / norm)
+    b = np.where(degenerate, 0., np.sum(src[..., 0] * dst[:, 1] - src[..., 1] * dst[:, 0], axis=1) / norm)
+    linear = np.stack([np.stack([a, -b], axis=-1), np.stack([b, a], axis=-1)], axis=1)
+    translation = reference_mean - np.matmul(linear, points_mean[..., None])[..., 0]
+    transformed = np.matmul(points, linear.transpose(0, 2, 1)) + translation[:, None]
+    residuals = np.sqrt(np.mean(np.sum((transformed - reference) ** 2, axis=2), axis=1))
+    residuals[degenerate] = np.inf
+    return np.concatenate([linear, translation[..., None]], axis=2), residuals
+
+
+def patch_offsets(landmarks, target_size, height, width, threshold=5):
+    """Top-left corners (T, 2) of the patches `cut_patch` cuts around landmarks (T, K, 2)."""
+    center_x, center_y = np.mean(landmarks, axis=1).T
+    # Check for too much bias in height and width
+    if np.any(np.abs(center_y - target_size[1] / 2) > height + threshold):
+        raise Exception('too much bias in height')
+    if np.any(np.abs(center_x - target_size[0] / 2) > width + threshold):
+        raise Exception('too much bias in width')
+    x_min = np.round(np.clip(center_x - width, 0, target_size[0]))
+    y_min = np.round(np.clip(center_y - height, 0, target_size[1]))
+    return np.stack([x_min, y_min], axis=1)
+
+
+def warp_rois(frames, transforms, size, grayscale=False,
+              interpolation=cv2.INTER_LINEAR, border_mode=cv2.BORDER_CONSTANT, border_value=0):
+    """Warp the frames straight to their patches.
+
+    Only the region of a frame the patch is sampled from is converted and
+    warped, so no intermediate canvas is ever produced.
+
+    Args:
+        frames: (T, H, W) or (T, H, W, C) uint8
+        transforms: (T, 2, 3) affine transforms from frame to patch coordinates
+        size: (height, width) of the patches
+        grayscale: convert RGB frames to gray before warping
+
+    Returns:
+        patches (T, height, width) or (T, height, width, C) uint8
+    """
+    height, width = size
+    H, W = frames.shape[1:3]
+    # bounding boxes of the patches in the frames, with the bilinear neighbours
+    corners = np.array([[0, 0], [width - 1, 0], [0, height - 1], [width - 1, height - 1]], dtype=np.float64)
+    inverse = np.linalg.inv(transforms[:, :, :2])
+    corners = np.matmul(corners - transforms[:, None, :, 2], inverse.transpose(0, 2, 1))
+    lower = np.clip(np.floor(corners.min(axis=1)).astype(int) - 1, 0, (W, H))
+    upper = np.clip(np.ceil(corners.max(axis=1)).astype(int) + 2, 0, (W, H))
+    # move the origin of the transforms to the top-left corners of the boxes
+    transforms = transforms.copy()
+    transforms[:, :, 2] += np.matmul(transforms[:, :, :2], lower[..., None].astype(np.float64))[..., 0]
+    patches = []
+    for frame, transform, (x_min, y_min), (x_max, y_max) in zip(frames, transforms, lower, upper):
+        region = frame[y_min:y_max, x_min:x_max]
+        if region.size == 0:
+            # the patch lies outside of the frame
+            shape = (height, width) if grayscale else (height, width) + frame.shape[2:]
+            patches.append(np.full(shape, border_value, dtype=frame.dtype))
+            continue
+        if grayscale:
+            region = cv2.cvtColor(region, cv2.COLOR_RGB2GRAY)
+        patches.append(cv2.warpAffine(region, transform, dsize=(width, height),
+                                      flags=interpolation, borderMode=border_mode, borderValue=border_value))
+    return np.array(patches)
@@ -0,0 +1,87 @@
+#! /usr/bin/env python
+# -*- coding: utf-8 -*-
+
+# Apache 2.0  (http://www.apache.org/licenses/LICENSE-2.0)
+
+import numpy as np
+
+from pipelines.detectors.landmarks import LandmarkTrack
+
+
+def crop_stream(video_process, chunks, min_frames=0):
+    """Crop mouth patches from a stream of (frames, landmarks) chunks.
+
+    A frame is cropped as soon as the landmarks it is smoothed over are
+    final, i.e. detected, or interpolated between two detections, so only
+    the frames waiting for a detection or for the smoothing window are
+    buffered. The patches are the same as `video_process(video, landmarks)`
+    on the whole clip, but for long stretches without a face: at most
+    window_margin frames plus a chunk wait past the last detection. Before
+    the first detection the older frames are dropped, after it they are
+    cropped with the landmarks of the last detection held, as the frames at
+    the end of a clip are, and the frames up to the next detection are
+    interpolated from the held landmarks.
+
+    Args:
+        video_process: VideoProcess of the detector that gave the landmarks
+        chunks: iterable of (frames, landmarks), landmarks is a LandmarkTrack,
+            or a list holding None for frames without a detection
+        min_frames: clips shorter than this give no patch at all
+
+    Yields:
+        mouth patches (n, crop_height, crop_width) of consecutive frames
+    """
+    half_window = video_process.window_margin // 2
+    track = None  # landmarks from frame `offset` on
+    pending = []  # frames not cropped yet, starting at frame `num_cropped`
+    max_pending = 0  # frames that may wait for a detection
+    offset = num_frames = num_cropped = 0
+    for frames, chunk_landmarks in chunks:
+        pending.extend(frames)
+        num_frames += len(frames)
+        max_pending = max(max_pending, video_process.window_margin + len(frames))
+        chunk_landmarks = LandmarkTrack.from_list(chunk_landmarks)
+        track = chunk_landmarks if track is None else LandmarkTrack.concatenate([track, chunk_landmarks])
+        valid_idx = np.flatnonzero(track.valid)
+        if len(valid_idx) == 0:
+            # no face so far, the frames the first detection is not smoothed over are dropped
+            num_dropped = len(pending) - max_pending
+            if num_dropped > 0:
+                del pending[:num_dropped]
+                track = track[num_dropped:]
+                offset += num_dropped
+                num_cropped += num_dropped
+            continue
+        if num_frames < min_frames:
+            continue
+        num_final = offset + valid_idx[-1] + 1
+        # the smoothing window of frame i reaches frame i + half_window
+        num_ready = num_final - half_window
+        # the frames that waited too long for a detection keep the last landmarks
+        num_held = num_frames - max_pending
+        if max(num_ready, num_held) > num_cropped:
+            held = num_held > num_ready
+            landmarks = track.interpolate() if held else track[:valid_idx[-1] + 1].interpolate()
+            num_ready = max(num_ready, num_held)
+            patches = video_process.crop_patch(np.array(pending[:num_ready - num_cropped]), landmarks, num_cropped - offset)
+            del pending[:num_ready - num_cropped]
+            num_cropped = num_ready
+            # keep the smoothing window of the next frame, from the detection it is interpolated from
+            keep = max(num_cropped - half_window, 0) - offset
+            if held:
+                # the held landmarks stand for that detection
+                valid = track.valid[keep:].copy()
+                valid[0] = True
+                track = LandmarkTrack(landmarks[keep:], valid)
+            else:
+                previous_idx = valid_idx[valid_idx <= keep]
+                keep = previous_idx[-1] if len(previous_idx) else keep
+                track = track[keep:]
+            offset += keep
+            yield patches
+
+    if track is None or not track.valid.any() or num_frames < min_frames:
+        return
+    # frames at the end that failed to be detected keep the last landmarks
+    if pending:
+        yield video_process.crop_patch(np.array(pending), track.interpolate(), num_cropped - offset)
@@ -0,0 +1,81 @@
+#! /usr/bin/env python
+# -*- coding: utf-8 -*-
+
+# Apache 2.0  (http://www.apache.org/licenses/LICENSE-2.0)
+
+import cv2
+import numpy as np
+
+from pipelines.detectors.landmarks import LandmarkTrack
+
+
+class KeyframeTracker:
+    """Detect landmarks on keyframes and follow them with optical flow in between.
+
+    The landmarks of a keyframe are tracked into the next frames with pyramidal
+    Lucas-Kanade flow, checked forwards and backwards. The detector runs again
+    every `keyframe_interval` frames, or as soon as too few landmarks are
+    tracked reliably. The state is kept across calls, so one tracker follows
+    one clip chunk by chunk.
+
+    Args:
+        detect_frames: detector of the frames, giving their LandmarkTrack, and
+            looking around the prev_landmarks of the frame before them
+        num_points: number of landmarks per frame
+        keyframe_interval: frames from one detection to the next, 1 detects every frame
+        max_flow_error: largest forward-backward error in pixels of a tracked landmark
+        min_tracked: smallest share of reliably tracked landmarks to go on tracking
+    """
+
+    def __init__(self, detect_frames, num_points, keyframe_interval=1, max_flow_error=1.0, min_tracked=0.75,
+                 win_size=(21, 21), max_level=3):
+        self.detect_frames = detect_frames
+        self.num_points = num_points
+        self.keyframe_interval = keyframe_interval
+        self.max_flow_error = max_flow_error
+        self.min_tracked = min_tracked
+        self.lk_params = dict(winSize=win_size, maxLevel=max_level,
+                              criteria=(cv2.TERM_CRITERIA_EPS | cv2.TERM_CRITERIA_COUNT, 30, 0.01))
+        self.prev_gray = None
+        self.prev_points = None
+        self.since_keyframe = 0
+        self.num_detected = 0
+
+    def __call__(self, frames):
+        if self.keyframe_interval <= 1:
+            self.num_detected += len(frames)
+            landmarks = self.detect_frames(frames, prev_landmarks=self.prev_points)
+            if len(landmarks):
+                self.prev_points = landmarks[len(landmarks) - 1]
+            return landmarks
+        landmarks = []
+        for frame in frames:
+            gray = cv2.cvtColor(frame, cv2.COLOR_RGB2GRAY)
+            points = None
+            if self.prev_points is not None and self.since_keyframe + 1 < self.keyframe_interval:
+                points = self.track(self.prev_gray, gray, self.prev_points)
+            if points is None:
+                points = self.detect_frames(frame[None], prev_landmarks=self.prev_points)[0]
+                self.num_detected += 1
+                self.since_keyframe = 0
+            else:
+                self.since_keyframe += 1
+            self.prev_gray, self.prev_points = gray, points
+            landmarks.append(points)
+        return LandmarkTrack.from_list(landmarks, num_points=self.num_points)
+
+    def track(self, prev_gray, gray, prev_points):
+        """Landmarks of prev_points moved from prev_gray to gray, None when they are lost"""
+        prev_points = prev_points.astype(np.float32).reshape(-1, 1, 2)
+        points, status, _ = cv2.calcOpticalFlowPyrLK(prev_gray, gray, prev_points, None, **self.lk_params)
+        back_points, back_status, _ = cv2.calcOpticalFlowPyrLK(gray, prev_gray, points, None, **self.lk_params)
+        error = np.linalg.norm(back_points - prev_points, axis=2)[:, 0]
+        tracked = (status[:, 0] == 1) & (back_status[:, 0] == 1) & (error < self.max_flow_error)
+        if tracked.mean() < self.min_tracked:
+            return None
+        points = points[:, 0]
+        # the landmarks that are lost follow the others
+        if not tracked.all():
+            shift = np.median(points[tracked] - prev_points[tracked, 0], axis=0)
+            points[~tracked] = prev_points[~tracked, 0] + shift
+        return points
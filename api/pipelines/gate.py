@@ -0,0 +1,50 @@
+#! /usr/bin/env python
+# -*- coding: utf-8 -*-
+
+# Apache 2.0  (http://www.apache.org/licenses/LICENSE-2.0)
+
+import numpy as np
+
+
+def motion_energy(patches):
+    """Mean absolute change between consecutive mouth patches, in [0, 1].
+
+    The patches are aligned to the mean face, so head motion is mostly
+    removed and what is left is the motion of the lips.
+    """
+    if len(patches) < 2:
+        return 0.
+    patches = np.asarray(patches, dtype=np.float32)
+    return float(np.mean(np.abs(np.diff(patches, axis=0)))) / 255.
+
+
+class ActivityGate:
+    """Tell idle clips apart before the model runs.
+
+    A clip is idle when no face is found on a few frames sampled over it, or
+    when the mouth patches barely change.
+
+    Args:
+        num_frames: frames sampled to look for a face on
+        min_motion: lowest motion energy of the mouth patches of a clip that is transcribed,
+            low so that only clips with all but still lips are skipped
+    """
+
+    def __init__(self, num_frames=4, min_motion=0.003):
+        self.num_frames = num_frames
+        self.min_motion = min_motion
+
+    def check_presence(self, frames, detect_frames):
+        """Reason to skip the clip of the sampled frames, None when a face is found"""
+        if frames is None or not detect_frames(frames).valid.any():
+            return "no face"
+        return None
+
+    def check_motion(self, patches):
+        """Reason to skip the clip of the mouth patches, None when the lips move"""
+        if patches is None or len(patches) == 0:
+            return "no face"
+        energy = motion_energy(patches)
+        if energy < self.min_motion:
+            return f"no lip activity (motion energy {energy:.4f} < {self.min_motion})"
+        return None
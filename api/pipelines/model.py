@@ -5,25 +5,31 @@
 # Apache 2.0  (http://www.apache.org/licenses/LICENSE-2.0)
 
 import os
+import copy
 import json
 import torch
 import argparse
 import numpy as np
+from torch.nn.utils.rnn import pad_sequence
 
 from espnet.asr.asr_utils import torch_load
 from espnet.asr.asr_utils import get_model_conf
 from espnet.asr.asr_utils import add_results_to_json
 from espnet.nets.batch_beam_search import BatchBeamSearch
+from espnet.nets.batch_beam_search_online import BatchBeamSearchOnline
 from espnet.nets.lm_interface import dynamic_import_lm
+from espnet.nets.pytorch_backend.backbones.conv3d_extractor import Conv3dResNet
+from espnet.nets.scorers.ctc import CTCPrefixScorer
 from espnet.nets.scorers.length_bonus import LengthBonus
 from espnet.nets.pytorch_backend.e2e_asr_transformer import E2E
 
 
 class AVSR(torch.nn.Module):
     def __init__(self, modality, model_path, model_conf, rnnlm=None, rnnlm_conf=None,
-        penalty=0., ctc_weight=0.1, lm_weight=0., beam_size=40, device="cuda:0"):
+        penalty=0., ctc_weight=0.1, lm_weight=0., beam_size=40, device="cuda:0", ctc_window_margin=0, frontend_chunk_size=0):
         super(AVSR, self).__init__()
         self.device = device
+        self.modality = modality
 
         if modality == "audiovisual":
             from espnet.nets.pytorch_backend.e2e_asr_transformer_av import E2E
@@ -45,9 +51,13 @@ class AVSR(torch.nn.Module):
 
         self.model = E2E(self.odim, self.train_args)
         self.model.load_state_dict(torch.load(model_path, map_location=lambda storage, loc: storage))
+        # long videos go through the visual front-end frontend_chunk_size frames at a time
+        for module in self.model.modules():
+            if isinstance(module, Conv3dResNet):
+                module.chunk_size = frontend_chunk_size
         self.model.to(device=self.device).eval()
 
-        self.beam_search = get_beam_search_decoder(self.model, self.token_list, rnnlm, rnnlm_conf, penalty, ctc_weight, lm_weight, beam_size)
+        self.beam_search = get_beam_search_decoder(self.model, self.token_list, rnnlm, rnnlm_conf, penalty, ctc_weight, lm_weight, beam_size, ctc_window_margin)
         self.beam_search.to(device=self.device).eval()
         
     def infer(self, data):
@@ -56,17 +66,97 @@ class AVSR(torch.nn.Module):
                 enc_feats = self.model.encode(data[0].to(self.device), data[1].to(self.device))
             else:
                 enc_feats = self.model.encode(data.to(self.device))
-            nbest_hyps = self.beam_search(enc_feats)
-            nbest_hyps = [h.asdict() for h in nbest_hyps[: min(len(nbest_hyps), 1)]]
-            transcription = add_results_to_json(nbest_hyps, self.token_list)
-            transcription = transcription.replace("▁", " ").strip()
+            return self.decode(enc_feats)
+
+    def infer_batch(self, data_list):
+        """Transcribe several clips with a single padded encoder pass and beam search."""
+        if self.modality != "video" or len(data_list) == 1:
+            return [self.infer(data) for data in data_list]
+        with torch.no_grad():
+            # (C, T, H, W) clips -> (B, C, Tmax, H, W), zero padded in time
+            ilens = torch.tensor([data.size(1) for data in data_list])
+            xs_pad = pad_sequence([data.transpose(0, 1) for data in data_list], batch_first=True).transpose(1, 2)
+            enc_feats, enc_lens = self.model.encode_batch(xs_pad.to(self.device), ilens)
+            # one beam search over all the clips, each with its own beam
+            nbest_hyps = self.beam_search.batch_forward(enc_feats, enc_lens)
+            return [self.format(hyps) for hyps in nbest_hyps]
+
+    def decode(self, enc_feats):
+        return self.format(self.beam_search(enc_feats))
+
+    def streamer(self, chunk_size=16, left_context=64, right_context=0):
+        """Encoder and beam search state of one live stream, see infer_block."""
+        assert self.modality == "video", "Only video models can be streamed."
+        return self.model.streaming_encoder(chunk_size, left_context, right_context), self.streaming_decoder()
+
+    def streaming_decoder(self):
+        # the scorers that are not modules (CTC) hold the state of the utterance, each stream gets its own
+        scorers = {k: v if isinstance(v, torch.nn.Module) else copy.copy(v) for k, v in self.beam_search.scorers.items()}
+        return BatchBeamSearchOnline(
+            beam_size=self.beam_search.beam_size,
+            vocab_size=self.beam_search.n_vocab,
+            weights=self.beam_search.weights,
+            scorers=scorers,
+            sos=self.beam_search.sos,
+            eos=self.beam_search.eos,
+            token_list=self.token_list,
+            pre_beam_score_key=self.beam_search.pre_beam_score_key,
+        )
+
+    def infer_block(self, streamer, data, is_final=False):
+        """Transcript of a stream so far, given its new frames (None if there are none)."""
+        encoder, decoder = streamer
+        with torch.no_grad():
+            enc_feats = encoder(None if data is None else data.to(self.device), is_final)
+            return self.format(decoder.process_block(enc_feats, is_final))
+
+    def infer_prefix(self, data, prefix=(), frontend_cache=None, start=0):
+        """Best token ids of a clip that start with the given ones, and its encoder output.
+
+        The clip may be a window from frame start of a stream, whose front-end features
+        are then reused from frontend_cache (see E2E.frontend_cache).
+        """
+        with torch.no_grad():
+            enc_feats = self.model.encode(data.to(self.device), frontend_cache=frontend_cache, start=start)
+            nbest_hyps = self.beam_search(enc_feats, prefix=list(prefix))
+        if not nbest_hyps:
+            return list(prefix), enc_feats
+        return [int(t) for t in nbest_hyps[0].yseq[1:] if t != self.beam_search.eos], enc_feats
+
+    def token_ends(self, enc_feats, tokens):
+        """Last frame of each token in the CTC forced alignment of the encoder output."""
+        with torch.no_grad():
+            alignment = self.model.ctc.forced_align(enc_feats.unsqueeze(0), np.array(tokens))
+        ends = []
+        for t, label in enumerate(alignment):
+            if label == 0:
+                continue
+            # a token starts where the label changes, the same token twice has a blank in between
+            if t == 0 or label != alignment[t - 1]:
+                ends.append(t)
+            else:
+                ends[-1] = t
+        return ends
+
+    def text(self, tokens):
+        return "".join(self.token_list[t] for t in tokens).replace("<space>", " ").replace("▁", " ").strip()
+
+    def format(self, nbest_hyps):
+        if not nbest_hyps:
+            return ""
+        nbest_hyps = [h.asdict() for h in nbest_hyps[: min(len(nbest_hyps), 1)]]
+        transcription = add_results_to_json(nbest_hyps, self.token_list)
+        transcription = transcription.replace("▁", " ").strip()
         return transcription.replace("<eos>", "")
 
 
-def get_beam_search_decoder(model, token_list, rnnlm=None, rnnlm_conf=None, penalty=0, ctc_weight=0.1, lm_weight=0., beam_size=40):
+def get_beam_search_decoder(model, token_list, rnnlm=None, rnnlm_conf=None, penalty=0, ctc_weight=0.1, lm_weight=0., beam_size=40, ctc_window_margin=0):
     sos = model.odim - 1
     eos = model.odim - 1
     scorers = model.scorers()
+    if ctc_window_margin > 0:
+        # only run the CTC recursion around the frames the decoder attends to
+        scorers["ctc"] = CTCPrefixScorer(model.ctc, model.eos, margin=ctc_window_margin, decoder=model.decoder)
 
     if not rnnlm:
         lm = None
@@ -13,11 +13,17 @@ import cv2
 
 from pipelines.model import AVSR
 from pipelines.data.data_module import AVSRDataLoader
+from pipelines.data.media import sample_frames
+from pipelines.gate import ActivityGate
+from pipelines.segmentation import split_segments
+from pipelines.session import StreamingSession
+from pipelines.detectors.landmarks import LandmarkTrack
 
 
 class InferencePipeline(torch.nn.Module):
-    def __init__(self, config_filename, detector="retinaface", face_track=False, device="cuda:0"):
+    def __init__(self, config_filename, detector="retinaface", face_track=False, device="cuda:0", model=None, frame_chunk_size=32, keyframe_interval=1, downscale=1, roi_margin=None, lmeds_threshold=None, gate=False, min_motion=0.003, long_form=False, max_segment_frames=250, min_segment_frames=75, segment_batch_size=8):
         super(InferencePipeline, self).__init__()
+        self.frame_chunk_size = frame_chunk_size
         assert os.path.isfile(config_filename), f"config_filename: {config_filename} does not exist."
 
         config = ConfigParser()
@@ -29,6 +35,7 @@ class InferencePipeline(torch.nn.Module):
         self.modality = modality
         # data configuration
         input_v_fps = config.getfloat("input", "v_fps")
+        self.v_fps = input_v_fps
         model_v_fps = config.getfloat("model", "v_fps")
 
         # model configuration
@@ -42,34 +49,132 @@ class InferencePipeline(torch.nn.Module):
         ctc_weight = config.getfloat("decode", "ctc_weight")
         lm_weight = config.getfloat("decode", "lm_weight")
         beam_size = config.getint("decode", "beam_size")
+        ctc_window_margin = config.getint("decode", "ctc_window_margin", fallback=0)
+        frontend_chunk_size = config.getint("model", "frontend_chunk_size", fallback=0)
 
-        self.dataloader = AVSRDataLoader(modality, speed_rate=input_v_fps/model_v_fps, detector=detector)
-        self.model = AVSR(modality, model_path, model_conf, rnnlm, rnnlm_conf, penalty, ctc_weight, lm_weight, beam_size, device)
+        self.dataloader = AVSRDataLoader(modality, speed_rate=input_v_fps/model_v_fps, detector=detector, lmeds_threshold=lmeds_threshold)
+        # an already loaded AVSR can be shared so that several pipelines hold one copy of the weights
+        if model is None:
+            model = AVSR(modality, model_path, model_conf, rnnlm, rnnlm_conf, penalty, ctc_weight, lm_weight, beam_size, device, ctc_window_margin, frontend_chunk_size)
+        self.model = model
         if face_track and self.modality in ["video", "audiovisual"]:
             if detector == "mediapipe":
                 from pipelines.detectors.mediapipe.detector import LandmarksDetector
-                self.landmarks_detector = LandmarksDetector()
+                self.landmarks_detector = LandmarksDetector(keyframe_interval=keyframe_interval, downscale=downscale, roi_margin=roi_margin)
             if detector == "retinaface":
                 from pipelines.detectors.retinaface.detector import LandmarksDetector
-                self.landmarks_detector = LandmarksDetector(device="cuda:0")
+                self.landmarks_detector = LandmarksDetector(device=str(device), keyframe_interval=keyframe_interval, downscale=downscale, roi_margin=roi_margin)
+            if detector == "cascade":
+                from pipelines.detectors.cascade.detector import LandmarksDetector
+                self.landmarks_detector = LandmarksDetector(device=str(device), keyframe_interval=keyframe_interval, downscale=downscale, roi_margin=roi_margin)
         else:
             self.landmarks_detector = None
+        # idle clips, without a face or lip activity, skip the model, skip_reason records why
+        self.gate = ActivityGate(min_motion=min_motion) if gate else None
+        self.skip_reason = None
+        # long videos are transcribed in segments, see forward_long_form
+        self.long_form = long_form
+        assert 0 < min_segment_frames <= max_segment_frames, f"min_segment_frames: {min_segment_frames} must be positive and at most max_segment_frames: {max_segment_frames}."
+        self.max_segment_frames = max_segment_frames
+        self.min_segment_frames = min_segment_frames
+        self.segment_batch_size = segment_batch_size
+        self.segments = []
 
 
-    def process_landmarks(self, data_filename, landmarks_filename):
+    def detect_landmarks(self, frames, start, landmarks=None, tracker=None):
+        if landmarks is not None:
+            return landmarks[start:start + len(frames)]
+        if tracker is not None:
+            return tracker(frames)
+        return self.landmarks_detector.detect_frames(frames)
+
+
+    def load_data(self, data_filename, landmarks_filename=None):
+        # data_filename may also hold the raw bytes of an upload or a binary file object
+        if isinstance(data_filename, str):
+            assert os.path.isfile(data_filename), f"data_filename: {data_filename} does not exist."
+        self.skip_reason = None
         if self.modality == "audio":
+            return self.dataloader.load_data(data_filename)
+        cropped = self.load_patches(data_filename, landmarks_filename)
+        if cropped is None:
+            return None
+        video, audio, sample_rate = cropped
+        return self.dataloader.process(video, audio, sample_rate, cropped=True)
+
+
+    def load_patches(self, data_filename, landmarks_filename=None):
+        # mouth patches, audio and sample rate, None when the clip is skipped (see skip_reason)
+        landmarks = LandmarkTrack.from_list(pickle.load(open(landmarks_filename, "rb"))) if isinstance(landmarks_filename, str) else None
+        # a few sampled frames tell whether there is a face at all before every frame is detected
+        if self.gate is not None and landmarks is None and self.landmarks_detector:
+            frames = sample_frames(data_filename, self.gate.num_frames)
+            self.skip_reason = self.gate.check_presence(frames, self.landmarks_detector.detect_frames)
+            if self.skip_reason:
+                return None
+        # detection only runs on keyframes, the landmarks are tracked in between
+        tracker = self.landmarks_detector.tracker() if landmarks is None and self.landmarks_detector else None
+        # frames are decoded once and go through detection and cropping chunk by chunk
+        video = self.dataloader.crop_stream(
+            data_filename, lambda frames, start: self.detect_landmarks(frames, start, landmarks, tracker), self.frame_chunk_size
+        )
+        # no face was found on any frame, there is nothing to transcribe even with the gate off
+        if video is None:
+            self.skip_reason = "no face"
             return None
-        if self.modality in ["video", "audiovisual"]:
-            if isinstance(landmarks_filename, str):
-                landmarks = pickle.load(open(landmarks_filename, "rb"))
-            else:
-                landmarks = self.landmarks_detector(data_filename)
-            return landmarks
+        if self.gate is not None:
+            self.skip_reason = self.gate.check_motion(video)
+            if self.skip_reason:
+                return None
+        _, audio, sample_rate = self.dataloader.read(data_filename, video=False)
+        return video, audio, sample_rate
+
+
+    def forward_long_form(self, data_filename, landmarks_filename=None):
+        # a long video is split at pauses of the lips into segments of at most max_segment_frames,
+        # decoded segment_batch_size at a time, self.segments holds the text of each with its times
+        if isinstance(data_filename, str):
+            assert os.path.isfile(data_filename), f"data_filename: {data_filename} does not exist."
+        assert self.modality != "audio", "Long-form transcription splits the video at pauses of the lips."
+        self.skip_reason = None
+        self.segments = []
+        cropped = self.load_patches(data_filename, landmarks_filename)
+        if cropped is None:
+            return ""
+        video, audio, sample_rate = cropped
+        bounds = split_segments(video, self.max_segment_frames, self.min_segment_frames)
+        data = []
+        for start, stop in bounds:
+            # idle segments are not decoded
+            if self.gate is not None and self.gate.check_motion(video[start:stop]):
+                data.append(None)
+                continue
+            segment_audio = None if audio is None else audio[:, round(start / self.v_fps * sample_rate):round(stop / self.v_fps * sample_rate)]
+            data.append(self.dataloader.process(video[start:stop], segment_audio, sample_rate, cropped=True))
+        active = [i for i, d in enumerate(data) if d is not None]
+        transcripts = [""] * len(data)
+        for i in range(0, len(active), self.segment_batch_size):
+            batch = active[i:i + self.segment_batch_size]
+            for j, transcript in zip(batch, self.model.infer_batch([data[j] for j in batch])):
+                transcripts[j] = transcript
+        self.segments = [
+            {"start": start / self.v_fps, "end": stop / self.v_fps, "text": transcript}
+            for (start, stop), transcript in zip(bounds, transcripts)
+        ]
+        return " ".join(transcript for transcript in transcripts if transcript)
+
+
+    def session(self, encoded=True, chunk_size=8, decoding="blockwise", window_size=75):
+        # per-stream state of live transcription, see StreamingSession
+        return StreamingSession(self, encoded, chunk_size, decoding, window_size)
 
 
     def forward(self, data_filename, landmarks_filename=None):
-        assert os.path.isfile(data_filename), f"data_filename: {data_filename} does not exist."
-        landmarks = self.process_landmarks(data_filename, landmarks_filename)
-        data = self.dataloader.load_data(data_filename, landmarks)
+        if self.long_form:
+            return self.forward_long_form(data_filename, landmarks_filename)
+        data = self.load_data(data_filename, landmarks_filename)
+        # idle clips give an empty transcript right away
+        if data is None:
+            return ""
         transcript = self.model.infer(data)
         return transcript
\ No newline at end of file
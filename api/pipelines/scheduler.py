@@ -0,0 +1,78 @@
+#! /usr/bin/env python
+# -*- coding: utf-8 -*-
+
+# Apache 2.0  (http://www.apache.org/licenses/LICENSE-2.0)
+
+import functools
+import queue
+import threading
+import time
+import traceback
+from concurrent.futures import Future
+
+
+class MicroBatchScheduler:
+    """Transcribe clips submitted by concurrent requests in padded batches.
+
+    A single thread owns the model. It blocks until a clip is queued, keeps
+    collecting until `max_batch_size` clips are queued or `max_wait_ms` has
+    passed since the first one arrived, and then runs the whole batch through
+    `AVSR.infer_batch`. Other work on the model, such as the blocks of a live
+    stream, is queued with `call` and runs on the same thread.
+    """
+
+    def __init__(self, model, max_batch_size=8, max_wait_ms=20):
+        self.model = model
+        self.max_batch_size = max_batch_size
+        self.max_wait = max_wait_ms / 1000.
+        self.requests = queue.Queue()
+        self.thread = threading.Thread(target=self.run, daemon=True)
+        self.thread.start()
+
+    def submit(self, data):
+        """Queue pre-processed model input and return a future of its transcript."""
+        future = Future()
+        self.requests.put((data, future))
+        return future
+
+    def call(self, fn, *args):
+        """Queue fn(*args) to run on the model thread and return a future of its result."""
+        future = Future()
+        self.requests.put((functools.partial(fn, *args), future))
+        return future
+
+    def next_batch(self):
+        batch = [self.requests.get()]
+        deadline = time.monotonic() + self.max_wait
+        while len(batch) < self.max_batch_size:
+            timeout = deadline - time.monotonic()
+            if timeout <= 0:
+                break
+            try:
+                batch.append(self.requests.get(timeout=timeout))
+            except queue.Empty:
+                break
+        return batch
+
+    def run(self):
+        while True:
+            batch = self.next_batch()
+            for fn, future in [(data, future) for data, future in batch if callable(data)]:
+                try:
+                    future.set_result(fn())
+                except Exception as e:
+                    traceback.print_exc()
+                    future.set_exception(e)
+            batch = [(data, future) for data, future in batch if not callable(data)]
+            if not batch:
+                continue
+            try:
+                transcripts = self.model.infer_batch([data for data, _ in batch])
+            except Exception as e:
+                traceback.print_exc()
+                for _, future in batch:
+                    future.set_exception(e)
+                continue
+            print(f"Scheduler transcribed a batch of {len(batch)} clip(s)")
+            for (_, future), transcript in zip(batch, transcripts):
+                future.set_result(transcript)
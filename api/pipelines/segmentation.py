@@ -0,0 +1,45 @@
+#! /usr/bin/env python
+# -*- coding: utf-8 -*-
+
+# Apache 2.0  (http://www.apache.org/licenses/LICENSE-2.0)
+
+import numpy as np
+
+
+def frame_motion(patches, smooth=5, chunk_size=256):
+    """Motion of the lips at each frame, the mean absolute change from the
+    previous mouth patch averaged over `smooth` frames, in [0, 1].
+
+    The uint8 patches are compared chunk_size frames at a time, so a long
+    video takes no float copy of its patches.
+    """
+    motion = np.zeros(len(patches), dtype=np.float32)
+    for start in range(1, len(patches), chunk_size):
+        stop = min(start + chunk_size, len(patches))
+        diff = np.asarray(patches[start:stop], dtype=np.int16) - np.asarray(patches[start - 1:stop - 1], dtype=np.int16)
+        motion[start:stop] = np.abs(diff).reshape(stop - start, -1).mean(axis=1) / 255.
+    if smooth > 1:
+        motion = np.convolve(motion, np.ones(smooth) / smooth, mode="same")
+    return motion
+
+
+def split_segments(patches, max_frames=250, min_frames=75):
+    """Bounds (start, stop) of segments of at most max_frames frames.
+
+    Each segment of a long video ends at the frame of least lip motion
+    between min_frames and max_frames after its start, where a pause in the
+    speech is most likely, so that few words are cut in two.
+    """
+    num_frames = len(patches)
+    if num_frames <= max_frames:
+        return [(0, num_frames)]
+    motion = frame_motion(patches)
+    bounds = []
+    start = 0
+    while num_frames - start > max_frames:
+        lo = start + min(min_frames, max_frames)
+        stop = lo + int(np.argmin(motion[lo:start + max_frames + 1]))
+        bounds.append((start, stop))
+        start = stop
+    bounds.append((start, num_frames))
+    return bounds
@@ -0,0 +1,177 @@
+#! /usr/bin/env python
+# -*- coding: utf-8 -*-
+
+# Apache 2.0  (http://www.apache.org/licenses/LICENSE-2.0)
+
+import queue
+import threading
+import traceback
+
+import cv2
+import numpy as np
+import torch
+
+from pipelines.data.media import ByteStream, iter_video
+
+
+class StreamingSession:
+    """State of one live stream, pushed to the pipeline piece by piece.
+
+    A thread of the session decodes what is pushed, detects (or tracks) the
+    landmarks and crops the mouth patches as soon as their smoothing window is
+    complete, so the tracker, the smoothing window and the patches cropped so
+    far persist from one push to the next and nothing is done twice. The same
+    goes for the model: with blockwise decoding, `decode` only encodes and
+    searches the frames cropped since its last call.
+
+    With window decoding, `decode` transcribes the window from the end of the
+    committed text to the last frame, the committed tokens forced as the start
+    of the hypothesis so that only the tail is searched, and commits the
+    tokens of the tail that agree with the previous window (local agreement).
+    Once the window is longer than window_size, it starts again after the last
+    committed token, found by CTC forced alignment, or window_size // 2 frames
+    before its end when it has none. The front-end features of the frames a
+    window shares with the previous one are not computed again when the video
+    has the frame rate of the model.
+
+    Args:
+        pipeline: InferencePipeline of a video model, with a landmarks detector
+        encoded: the pushes are pieces of one encoded container (e.g. the webm
+            chunks of a MediaRecorder), otherwise each push is an encoded image
+        chunk_size: frames detected and cropped at once
+        decoding: "blockwise" or "window"
+        window_size: patches a window keeps before it moves on, with window decoding
+    """
+
+    def __init__(self, pipeline, encoded=True, chunk_size=8, decoding="blockwise", window_size=75):
+        assert pipeline.modality == "video", "Only video models can be streamed."
+        assert pipeline.landmarks_detector is not None, "Streaming needs a landmarks detector."
+        self.pipeline = pipeline
+        self.encoded = encoded
+        self.chunk_size = chunk_size
+        self.tracker = pipeline.landmarks_detector.tracker()
+        self.stream = ByteStream() if encoded else None
+        self.frames = None if encoded else queue.Queue()
+        self.patches = []
+        self.num_cropped = 0
+        self.error = None
+        self.lock = threading.Lock()
+        self.decoding = decoding
+        self.streamer = pipeline.model.streamer() if decoding == "blockwise" else None
+        self.num_decoded = 0
+        # window decoding: first frame of the window, tokens committed in it and before, tokens not agreed on yet
+        self.window_size = window_size
+        # front-end features of the last window, for the frames the next one shares, unless the
+        # patches are resampled for the model and two windows do not take the same frames from them
+        self.frontend_cache = None
+        if decoding == "window" and pipeline.dataloader.speed_rate == 1:
+            self.frontend_cache = pipeline.model.model.frontend_cache()
+        self.window_start = 0
+        self.window_tokens = []
+        self.committed = []
+        self.tentative = []
+        self.thread = threading.Thread(target=self.run, daemon=True)
+        self.thread.start()
+
+    def push(self, data):
+        """Queue the next bytes of the container, or the next encoded image"""
+        if self.encoded:
+            self.stream.write(data)
+            return
+        frame = cv2.imdecode(np.frombuffer(data, dtype=np.uint8), cv2.IMREAD_COLOR)
+        if frame is None:
+            raise ValueError("Cannot decode the frame.")
+        self.frames.put(cv2.cvtColor(frame, cv2.COLOR_BGR2RGB))
+
+    def close(self):
+        """End the stream and wait until every frame pushed is cropped"""
+        if self.encoded:
+            self.stream.close()
+        else:
+            self.frames.put(None)
+        self.thread.join()
+
+    def frame_chunks(self):
+        if self.encoded:
+            yield from iter_video(self.stream, self.chunk_size)
+            return
+        # the frames queued by now, at most chunk_size, as soon as there is one
+        while True:
+            frames = [self.frames.get()]
+            while frames[-1] is not None and len(frames) < self.chunk_size:
+                try:
+                    frames.append(self.frames.get_nowait())
+                except queue.Empty:
+                    break
+            end = frames[-1] is None
+            if end:
+                frames.pop()
+            if frames:
+                yield np.stack(frames)
+            if end:
+                return
+
+    def run(self):
+        chunks = ((frames, self.tracker(frames)) for frames in self.frame_chunks())
+        try:
+            for patches in self.pipeline.dataloader.video_process.crop_stream(chunks):
+                with self.lock:
+                    self.patches.append(patches)
+                    self.num_cropped += len(patches)
+        except Exception:
+            self.error = traceback.format_exc()
+
+    def data(self, start=0):
+        """Model input of the mouth patches cropped so far from patch start (None
+        if there is no new one) and the number of patches it goes up to.
+
+        The counters of the session are in patches, the frames of the input
+        video: the model input has fewer or more frames when the frame rate of
+        the video is not the one of the model (see VideoTransform).
+        """
+        with self.lock:
+            if self.num_cropped <= start:
+                return None, start
+            # the patches are joined once and kept joined
+            self.patches = [np.concatenate(self.patches)]
+            video = self.patches[0][start:]
+        return self.pipeline.dataloader.process(video, None, None, cropped=True), start + len(video)
+
+    def decode(self, is_final=False):
+        """Transcript so far, runs on the model thread (see MicroBatchScheduler.call)"""
+        if self.decoding == "window":
+            return self.decode_window(is_final)
+        data, self.num_decoded = self.data(self.num_decoded)
+        return self.pipeline.model.infer_block(self.streamer, data, is_final)
+
+    def decode_window(self, is_final=False):
+        model = self.pipeline.model
+        data, self.num_decoded = self.data(self.window_start)
+        if data is None:
+            return model.text(self.committed)
+        tokens, enc_feats = model.infer_prefix(data, self.window_tokens, self.frontend_cache, self.window_start)
+        tail = tokens[len(self.window_tokens):]
+        num_patches = self.num_decoded - self.window_start
+        # a window twice as long as it should be commits its tail as it is
+        if is_final or num_patches >= 2 * self.window_size:
+            agreed = tail
+        else:
+            agreed = []
+            for new, old in zip(tail, self.tentative):
+                if new != old:
+                    break
+                agreed.append(new)
+        self.tentative = tail[len(agreed):]
+        self.window_tokens += agreed
+        self.committed += agreed
+        if num_patches > self.window_size and self.window_tokens:
+            end = model.token_ends(enc_feats, self.window_tokens)[-1]
+            # the patch the model frame was taken from (see VideoTransform)
+            end = int(torch.linspace(0, num_patches - 1, data.size(1), dtype=torch.int64)[end])
+            self.window_start += end + 1
+            self.window_tokens = []
+        elif num_patches > self.window_size:
+            # nothing committed in the window, its start moves on regardless so that it stays short
+            self.window_start = self.num_decoded - self.window_size // 2
+            self.tentative = []
+        return model.text(self.committed)
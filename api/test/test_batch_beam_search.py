@@ -0,0 +1,48 @@
+"""Equivalence tests of the multi-utterance beam search against the per-utterance one."""
+
+import pytest
+import torch
+
+from espnet.nets.batch_beam_search import BatchBeamSearch
+from espnet.nets.pytorch_backend.ctc import CTC
+from espnet.nets.pytorch_backend.transformer.decoder import Decoder
+from espnet.nets.scorers.ctc import CTCPrefixScorer
+from espnet.nets.scorers.length_bonus import LengthBonus
+
+
+ODIM = 12
+ADIM = 16
+
+
+def beam_search(ctc_weight, beam_size):
+    """A beam search over a tiny random decoder and CTC."""
+    torch.manual_seed(0)
+    decoder = Decoder(ODIM, attention_dim=ADIM, attention_heads=2, linear_units=32, num_blocks=2, dropout_rate=0.0,
+                      positional_dropout_rate=0.0).eval()
+    ctc = CTC(ODIM, ADIM, 0.0, ctc_type="builtin").eval()
+    # sharper outputs, so that hypotheses end before the maximum length
+    with torch.no_grad():
+        decoder.output_layer.weight.mul_(4)
+        ctc.ctc_lo.weight.mul_(8)
+    scorers = dict(decoder=decoder, ctc=CTCPrefixScorer(ctc, ODIM - 1), length_bonus=LengthBonus(ODIM))
+    weights = dict(decoder=1.0 - ctc_weight, ctc=ctc_weight, length_bonus=0.5)
+    return BatchBeamSearch(scorers=scorers, weights=weights, beam_size=beam_size, vocab_size=ODIM,
+                           sos=ODIM - 1, eos=ODIM - 1, pre_beam_score_key="full").eval()
+
+
+@pytest.mark.parametrize("ctc_weight, beam_size", [(0.3, 3), (0.0, 4), (1.0, 2)])
+def test_batch_forward(ctc_weight, beam_size):
+    search = beam_search(ctc_weight, beam_size)
+    g = torch.Generator().manual_seed(1)
+    xlens = torch.tensor([14, 9, 11])
+    xs = torch.randn(len(xlens), int(xlens.max()), ADIM, generator=g)
+    # the padding must not change anything
+    for x, xlen in zip(xs, xlens):
+        x[xlen:] = 100.0
+    with torch.no_grad():
+        batch_hyps = search.batch_forward(xs, xlens)
+        for x, xlen, hyps in zip(xs, xlens, batch_hyps):
+            expected = search.forward(x[:xlen])
+            assert len(hyps) > 0
+            assert [h.yseq.tolist() for h in hyps] == [h.yseq.tolist() for h in expected]
+            assert torch.allclose(torch.stack([h.score for h in hyps]), torch.stack([h.score for h in expected]), atol=1e-4)
@@ -0,0 +1,66 @@
+"""Tolerance tests of the mouth patches warped straight from the frames against the per-frame path."""
+
+import cv2
+import numpy as np
+import pytest
+
+from pipelines.detectors.mediapipe import video_process as mediapipe_video_process
+from pipelines.detectors.retinaface import video_process as retinaface_video_process
+
+
+def random_frames(num_frames=6, height=360, width=480, seed=0):
+    """RGB frames of smooth random patterns, as camera frames are."""
+    rng = np.random.default_rng(seed)
+    coarse = rng.integers(0, 256, (num_frames, height // 16, width // 16, 3), dtype=np.uint8)
+    return np.stack([cv2.resize(frame, (width, height), interpolation=cv2.INTER_CUBIC) for frame in coarse])
+
+
+def random_landmarks(reference, num_frames=6, seed=0):
+    """68 landmarks of the reference face rotated, scaled and moved differently in every frame."""
+    rng = np.random.default_rng(seed)
+    landmarks = []
+    for _ in range(num_frames):
+        angle = rng.uniform(-0.3, 0.3)
+        rotation = np.array([[np.cos(angle), -np.sin(angle)], [np.sin(angle), np.cos(angle)]]) * rng.uniform(0.8, 1.4)
+        points = (reference - reference.mean(axis=0)) @ rotation.T + rng.uniform([180, 140], [300, 220])
+        landmarks.append(points + rng.normal(0, 1.0, points.shape))
+    return np.stack(landmarks)
+
+
+def legacy_crop(video_process, cut_patch, frames, landmarks, stable_points):
+    """affine_transform then cut_patch on every frame, as the patches were cropped before."""
+    patches = []
+    for frame, frame_landmarks in zip(frames, landmarks):
+        transformed_frame, transformed_landmarks = video_process.affine_transform(
+            frame, frame_landmarks, video_process.reference, grayscale=video_process.convert_gray, stable_points=stable_points)
+        patch = cut_patch(transformed_frame, transformed_landmarks[video_process.start_idx:video_process.stop_idx],
+                          video_process.crop_height // 2, video_process.crop_width // 2)
+        patches.append(patch)
+    return np.array(patches)
+
+
+def mediapipe_case(convert_gray):
+    # the closed form fits are replaced by LMEDS, the transforms of the per-frame path
+    video_process = mediapipe_video_process.VideoProcess(convert_gray=convert_gray, lmeds_threshold=0.)
+    landmarks = random_landmarks(video_process.reference)
+    keypoints = np.stack([landmarks[:, 36:42].mean(axis=1), landmarks[:, 42:48].mean(axis=1),
+                          landmarks[:, 31:36].mean(axis=1), landmarks[:, 48:68].mean(axis=1)], axis=1)
+    return video_process, mediapipe_video_process.cut_patch, keypoints, (0, 1, 2, 3)
+
+
+def retinaface_case(convert_gray):
+    video_process = retinaface_video_process.VideoProcess(convert_gray=convert_gray, lmeds_threshold=0.)
+    landmarks = random_landmarks(video_process.reference)
+    return video_process, retinaface_video_process.cut_patch, landmarks, (28, 33, 36, 39, 42, 45, 48, 54)
+
+
+@pytest.mark.parametrize("case", [mediapipe_case, retinaface_case])
+@pytest.mark.parametrize("convert_gray", [True, False])
+def test_crop_frames(case, convert_gray):
+    video_process, cut_patch, landmarks, stable_points = case(convert_gray)
+    frames = random_frames()
+    expected = legacy_crop(video_process, cut_patch, frames, landmarks, stable_points)
+    actual = video_process.crop_frames(frames, landmarks)
+    assert actual.shape == expected.shape
+    # bilinear sampling of the same points rounds differently from another origin
+    assert np.abs(actual.astype(int) - expected.astype(int)).max() <= 1
@@ -0,0 +1,85 @@
+"""Equivalence tests of the CTC forward recursion implementations."""
+
+import numpy as np
+import pytest
+import torch
+
+import espnet.nets.ctc_prefix_score as ctc_prefix_score
+from espnet.nets.ctc_prefix_score import CTCPrefixScoreTH
+
+
+def ctc_forward_recursion_stack(r, log_phi, x, start: int, end: int):
+    """The per-frame recursion as it was before the implementations were split."""
+    n_bh, snum = r.size(2), r.size(3)
+    for t in range(start, end):
+        rp = r[t - 1]
+        rr = torch.stack([rp[0], log_phi[t - 1], rp[0], rp[1]]).view(2, 2, n_bh, snum)
+        r[t] = torch.logsumexp(rr, 1) + x[:, t]
+    return r
+
+
+def random_inputs(T=30, n_bh=6, snum=12, seed=0):
+    g = torch.Generator().manual_seed(seed)
+    x = torch.randn(2, T, n_bh, snum, generator=g).log_softmax(-1)
+    log_phi = torch.randn(T, n_bh, snum, generator=g)
+    r = torch.full((T, 2, n_bh, snum), -10000000000.0)
+    r[0] = torch.randn(2, n_bh, snum, generator=g)
+    return r, log_phi, x
+
+
+@pytest.mark.parametrize(
+    "impl",
+    [
+        ctc_prefix_score.ctc_forward_recursion,
+        ctc_prefix_score.ctc_forward_recursion_script,
+        ctc_prefix_score.ctc_forward_recursion_numpy,
+    ],
+)
+@pytest.mark.parametrize("start, end", [(1, 30), (5, 17)])
+def test_forward_recursion(impl, start, end):
+    r, log_phi, x = random_inputs()
+    expected = ctc_forward_recursion_stack(r.clone(), log_phi, x, start, end)
+    actual = impl(r.clone(), log_phi, x, start, end)
+    assert torch.allclose(actual, expected, atol=1e-4)
+
+
+def select_state(state, ids, new_ids):
+    r, log_psi, f_min, f_max, scoring_idmap = state
+    s = log_psi[ids, new_ids].unsqueeze(1).expand(-1, log_psi.size(1))
+    if scoring_idmap is not None:
+        return r[:, :, ids, scoring_idmap[ids, new_ids]], s, f_min, f_max
+    return r[:, :, ids, new_ids], s, f_min, f_max
+
+
+def decode(forward_impl, margin, pre_beam, seed=0):
+    """Scores of a few forced decoding steps of two padded utterances."""
+    g = torch.Generator().manual_seed(seed)
+    T, odim, n_hyps = 40, 20, 3
+    xlens = torch.tensor([T, T - 7])
+    x = torch.randn(2, T, odim, generator=g).log_softmax(-1)
+    impl = CTCPrefixScoreTH(x, xlens, 0, odim - 1, margin, forward_impl=forward_impl)
+    n_bh = 2 * n_hyps
+    ys = torch.full((n_bh, 1), odim - 1, dtype=torch.long)
+    state = None
+    outputs = []
+    for _ in range(4):
+        ids = torch.randint(1, odim - 1, (n_bh, 8), generator=g) if pre_beam else None
+        att_w = torch.rand(n_bh, T, generator=g).softmax(-1) if margin > 0 else None
+        scores, full_state = impl(ys, state, ids, att_w)
+        outputs.append(scores)
+        new_ids = ids[:, 0] if pre_beam else torch.randint(1, odim - 1, (n_bh,), generator=g)
+        state = select_state(full_state, torch.arange(n_bh), new_ids)
+        ys = torch.cat([ys, new_ids.unsqueeze(1)], dim=1)
+    return torch.stack(outputs)
+
+
+@pytest.mark.parametrize("forward_impl", CTCPrefixScoreTH.forward_impls)
+@pytest.mark.parametrize("margin", [0, 5])
+@pytest.mark.parametrize("pre_beam", [False, True])
+def test_prefix_scores(monkeypatch, forward_impl, margin, pre_beam):
+    actual = decode(forward_impl, margin, pre_beam)
+    monkeypatch.setattr(ctc_prefix_score, "ctc_forward_recursion", ctc_forward_recursion_stack)
+    expected = decode("python", margin, pre_beam)
+    finite = expected > -1e9
+    assert torch.equal(finite, actual > -1e9)
+    assert torch.allclose(actual[finite], expected[finite], atol=1e-4)
@@ -0,0 +1,179 @@
+"""Tests of the batched RetinaFace and FAN processing against per-image calls."""
+
+from itertools import product
+from math import ceil
+from types import SimpleNamespace
+
+import cv2
+import numpy as np
+import pytest
+import torch
+
+from pipelines.detectors.retinaface.batching import detect_faces, detect_landmarks, prior_boxes
+
+
+RETINAFACE_CONFIG = SimpleNamespace(
+    min_sizes=[[16, 32], [64, 128], [256, 512]], steps=[8, 16, 32], variance=[0.1, 0.2], clip=False,
+    conf_thresh=0.02, nms_thresh=0.4, nms_top_k=5000, top_k=750,
+)
+FAN_CONFIG = SimpleNamespace(crop_ratio=0.55, input_size=64, gamma=1.0, radius=0.1)
+
+
+class FakeRetinaFace(torch.nn.Module):
+    """Outputs of the shape of RetinaFace, one per anchor, from the mean of its cell."""
+
+    def __init__(self, config):
+        super().__init__()
+        self.steps = config.steps
+        self.heads = torch.nn.ModuleList(torch.nn.Conv2d(3, 16 * len(sizes), 1) for sizes in config.min_sizes)
+
+    def forward(self, x):
+        outputs = []
+        for step, head in zip(self.steps, self.heads):
+            y = head(torch.nn.functional.avg_pool2d(x, step, ceil_mode=True) / 20)
+            outputs.append(y.permute(0, 2, 3, 1).reshape(len(x), -1, 16))
+        outputs = torch.cat(outputs, dim=1)
+        return outputs[..., :4], (5 * outputs[..., 4:6]).softmax(-1), outputs[..., 6:]
+
+
+class FakeFAN(torch.nn.Module):
+    """Heatmaps (B, 68, H / 4, W / 4) of the patches, with the features FAN also returns."""
+
+    def __init__(self):
+        super().__init__()
+        self.head = torch.nn.Conv2d(3, 68, 1)
+
+    def forward(self, x):
+        return self.head(torch.nn.functional.avg_pool2d(x, 4)), None, None
+
+
+def reference_priors(config, image_size):
+    anchors = []
+    for k, step in enumerate(config.steps):
+        for i, j in product(range(ceil(image_size[0] / step)), range(ceil(image_size[1] / step))):
+            for min_size in config.min_sizes[k]:
+                anchors += [(j + 0.5) * step / image_size[1], (i + 0.5) * step / image_size[0],
+                            min_size / image_size[1], min_size / image_size[0]]
+    return torch.Tensor(anchors).view(-1, 4)
+
+
+def reference_nms(dets, thresh):
+    x1, y1, x2, y2, scores = dets[:, 0], dets[:, 1], dets[:, 2], dets[:, 3], dets[:, 4]
+    areas = (x2 - x1 + 1) * (y2 - y1 + 1)
+    order = scores.argsort()[::-1]
+    keep = []
+    while order.size > 0:
+        i = order[0]
+        keep.append(i)
+        w = np.maximum(0.0, np.minimum(x2[i], x2[order[1:]]) - np.maximum(x1[i], x1[order[1:]]) + 1)
+        h = np.maximum(0.0, np.minimum(y2[i], y2[order[1:]]) - np.maximum(y1[i], y1[order[1:]]) + 1)
+        inter = w * h
+        ovr = inter / (areas[i] + areas[order[1:]] - inter)
+        order = order[np.where(ovr <= thresh)[0] + 1]
+    return keep
+
+
+def reference_detect_faces(predictor, image):
+    """RetinaFacePredictor.__call__(image, rgb=False) on one image."""
+    config, variances = predictor.config, predictor.config.variance
+    im_height, im_width, _ = image.shape
+    x = torch.from_numpy((image.astype(int) - np.array([104, 117, 123])).transpose(2, 0, 1)).unsqueeze(0).float()
+    loc, conf, landms = predictor.net(x)
+    priors = reference_priors(config, (im_height, im_width))
+    boxes = torch.cat((priors[:, :2] + loc[0, :, :2] * variances[0] * priors[:, 2:],
+                       priors[:, 2:] * torch.exp(loc[0, :, 2:] * variances[1])), 1)
+    boxes[:, :2] -= boxes[:, 2:] / 2
+    boxes[:, 2:] += boxes[:, :2]
+    boxes = (boxes * torch.Tensor([im_width, im_height] * 2)).numpy()
+    scores = conf[0].numpy()[:, 1]
+    landms = torch.cat([priors[:, :2] + landms[0, :, 2 * k:2 * k + 2] * variances[0] * priors[:, 2:] for k in range(5)], dim=1)
+    landms = (landms * torch.Tensor([im_width, im_height] * 5)).numpy()
+    inds = np.where(scores > config.conf_thresh)[0]
+    boxes, landms, scores = boxes[inds], landms[inds], scores[inds]
+    order = scores.argsort()[::-1][:config.nms_top_k]
+    boxes, landms, scores = boxes[order], landms[order], scores[order]
+    dets = np.hstack((boxes, scores[:, np.newaxis])).astype(np.float32, copy=False)
+    keep = reference_nms(dets, config.nms_thresh)
+    dets = np.concatenate((dets[keep][:config.top_k], landms[keep][:config.top_k]), axis=1)
+    return dets[dets[:, 4] >= predictor.threshold]
+
+
+def reference_detect_landmarks(predictor, image, face_box):
+    """FANPredictor.__call__(image, face_box, rgb=True) on one face."""
+    config = predictor.config
+    face_boxes = face_box[np.newaxis, :4]
+    centres = (face_boxes[:, [0, 1]] + face_boxes[:, [2, 3]]) / 2.0
+    face_sizes = (face_boxes[:, [3, 2]] - face_boxes[:, [1, 0]]).mean(axis=1)
+    sizes = (face_sizes / (1.0 - config.crop_ratio))[:, np.newaxis].repeat(2, axis=1)
+    enlarged = np.zeros_like(face_boxes)
+    enlarged[:, :2] = np.round(centres - sizes / 2.0)
+    enlarged[:, 2:] = np.round(enlarged[:, :2] + sizes) + 1
+    left, top, right, bottom = enlarged.astype(int)[0]
+    pad = ((max(-top, 0), max(bottom - image.shape[0], 0)), (max(-left, 0), max(right - image.shape[1], 0)), (0, 0))
+    padded = np.pad(image, pad)
+    patch = cv2.resize(padded[top + pad[0][0]:bottom + pad[0][0], left + pad[1][0]:right + pad[1][0]], (config.input_size,) * 2)
+    heatmaps = predictor.net(torch.from_numpy(patch[None].transpose(0, 3, 1, 2).astype(np.float32)) / 255.0)[0]
+    heatmaps = heatmaps.contiguous()
+    h, w = heatmaps.shape[2:]
+    m = heatmaps.view(heatmaps.shape[0] * heatmaps.shape[1], -1).argmax(1)
+    peaks = torch.cat([(m / w).trunc().view(-1, 1), (m % w).view(-1, 1)], dim=1).reshape(1, -1, 1, 1, 2).repeat(1, 1, h, w, 1).float()
+    indices = torch.zeros_like(peaks) + torch.stack([torch.arange(h).unsqueeze(-1).repeat(1, w), torch.arange(w).unsqueeze(0).repeat(h, 1)], dim=-1).float()
+    heatmaps = heatmaps * ((indices - peaks).norm(dim=-1) <= config.radius * (h * w) ** 0.5).float()
+    heatmaps = heatmaps.clamp_min(0.0)
+    m00s = heatmaps.sum(dim=(2, 3)).clamp_min(torch.finfo(heatmaps.dtype).eps)
+    xs = heatmaps.sum(dim=2).mul(torch.arange(0.5, w)).sum(dim=2).div(m00s)
+    ys = heatmaps.sum(dim=3).mul(torch.arange(0.5, h)).sum(dim=2).div(m00s)
+    landmarks = torch.stack((xs, ys), dim=-1)[0].numpy()
+    landmarks[:, 0] = landmarks[:, 0] * (right - left) / w + left
+    landmarks[:, 1] = landmarks[:, 1] * (bottom - top) / h + top
+    return landmarks
+
+
+@pytest.fixture
+def face_detector():
+    torch.manual_seed(0)
+    return SimpleNamespace(net=FakeRetinaFace(RETINAFACE_CONFIG).eval(), config=RETINAFACE_CONFIG, device="cpu", threshold=0.5)
+
+
+def random_images(sizes, seed=0):
+    rng = np.random.default_rng(seed)
+    return [rng.integers(0, 256, (height, width, 3), dtype=np.uint8) for height, width in sizes]
+
+
+@pytest.mark.parametrize("height, width", [(96, 128), (100, 70)])
+def test_prior_boxes(height, width):
+    assert torch.allclose(prior_boxes(RETINAFACE_CONFIG, height, width), reference_priors(RETINAFACE_CONFIG, (height, width)))
+
+
+def test_detect_faces(face_detector):
+    images = random_images([(96, 128)] * 4)
+    faces = detect_faces(face_detector, images)
+    assert sum(len(f) for f in faces) > 0
+    with torch.no_grad():
+        for image, image_faces in zip(images, faces):
+            expected = reference_detect_faces(face_detector, image)
+            assert image_faces.shape == expected.shape
+            np.testing.assert_allclose(image_faces, expected, rtol=1e-4, atol=1e-3)
+
+
+def test_detect_faces_padded(face_detector):
+    # the largest image is not padded, the others still give (n, 15) faces
+    images = random_images([(128, 160), (96, 100), (64, 160)], seed=1)
+    faces = detect_faces(face_detector, images)
+    with torch.no_grad():
+        expected = reference_detect_faces(face_detector, images[0])
+    np.testing.assert_allclose(faces[0], expected, rtol=1e-4, atol=1e-3)
+    assert all(f.ndim == 2 and f.shape[1] == 15 for f in faces)
+
+
+def test_detect_landmarks():
+    torch.manual_seed(0)
+    predictor = SimpleNamespace(net=FakeFAN().eval(), config=FAN_CONFIG, device="cpu")
+    frames = random_images([(120, 160)] * 3, seed=2)
+    # a face inside the frame, and faces over its top-left and bottom-right edges
+    boxes = [np.array([50., 30., 100., 90.]), np.array([-10., -5., 40., 50.]), np.array([130., 90., 175., 140.])]
+    landmarks = detect_landmarks(predictor, frames, boxes)
+    assert landmarks.shape == (3, 68, 2)
+    with torch.no_grad():
+        for frame, box, points in zip(frames, boxes, landmarks):
+            np.testing.assert_allclose(points, reference_detect_landmarks(predictor, frame, box), atol=1e-3)